@@ -1,24 +1,1790 @@
 import pandas as pd
+import numpy as np
 import logging
 import os
-from datetime import datetime, timedelta
+import sys
+import re
+import hashlib
+import shutil
+import json
+import pickle
+import difflib
+import copy
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, time as dt_time, timedelta
+from xml.sax.saxutils import escape
 from openpyxl import load_workbook
-import win32com.client
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import column_index_from_string, get_column_letter
 import time
-import pythoncom
-import xlwings as xw
+import csv
+import functools
+import threading
+from contextlib import contextmanager
 import psutil
 
+from formula_engine import FormulaEngine, UnsupportedFormula
+
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class ExcelAutomation:
+
+def file_fingerprint(path):
+    """Return (mtime, size) of a file, used as a cheap change check"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-1 hex digest of a file's contents"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _pad_block(block, rows, width):
+    """Pad a block to its full height: read_only iter_rows stops at the sheet's last stored row"""
+    return block + [[None] * width for _ in range(rows - len(block))]
+
+
+def stream_plan_block(path, locate, sheet_name="plan", first_row=6, last_row=44, width=3):
+    """Locate the date column in row 4 of the plan and read its block in one pass.
+
+    The sheet is streamed in read_only mode, so only the rows 4 to last_row
+    are parsed and only the width columns starting at the date are kept.
+    locate(header_row) returns the 1-based column for the date, or None.
+    Returns (column, row 5 value, block) or (None, None, None).
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name]
+        target_col = None
+        status = None
+        block = []
+        for row_idx, row in enumerate(ws.iter_rows(min_row=4, max_row=last_row, values_only=True), 4):
+            if row_idx == 4:
+                target_col = locate(row)
+                if target_col is None:
+                    return None, None, None
+                continue
+            values = list(row[target_col - 1:target_col - 1 + width])
+            values += [None] * (width - len(values))
+            if row_idx == 5:
+                status = values[0]
+            elif row_idx >= first_row:
+                block.append(values)
+        if target_col is None:
+            return None, None, None
+        return target_col, status, _pad_block(block, last_row - first_row + 1, width)
+    finally:
+        wb.close()
+
+
+def read_header_row(path, sheet_name, row=4):
+    """Stream a single header row of a sheet"""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for values in wb[sheet_name].iter_rows(min_row=row, max_row=row, values_only=True):
+            return list(values)
+        return []
+    finally:
+        wb.close()
+
+
+def parse_header_dates(values):
+    """Parse header cells to dates with one vectorized to_datetime call.
+
+    Only datetimes and strings are candidates, numbers and times give None.
+    """
+    candidates = pd.Series(
+        [v if isinstance(v, (datetime, date)) or (isinstance(v, str) and v.strip()) else None
+         for v in values],
+        dtype=object,
+    )
+    parsed = pd.to_datetime(candidates, errors='coerce', format='mixed')
+    return [None if pd.isna(ts) else ts.date() for ts in parsed]
+
+
+def _header_key(value):
+    """JSON-safe representation of a header cell, used to detect changes"""
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return f"{type(value).__name__}:{value}"
+
+
+class HeaderIndex:
+    """Persistent date -> column index for the row-4 date headers.
+
+    Each workbook gets a sidecar JSON file next to it with one entry per
+    sheet, holding the workbook's content hash, the raw header row and the
+    parsed date per column. While the hash matches, lookups need no workbook
+    access at all. When the hash changes, the row is read again and only the
+    cells that differ from the stored row are re-parsed.
+    """
+
+    def __init__(self, header_row=4):
+        self.header_row = header_row
+        self._entries = {}  # (path, sheet) -> entry dict
+        self._maps = {}  # (path, sheet) -> {date: column}
+
+    @staticmethod
+    def sidecar_path(path):
+        folder, name = os.path.split(os.path.abspath(path))
+        return os.path.join(folder, f".{name}.headers.json")
+
+    def fresh_columns(self, path, sheet_name, content_hash=None):
+        """Return the date map if the stored entry matches the file, else None"""
+        key = (os.path.abspath(path), sheet_name)
+        entry = self._load_entry(key)
+        if entry is None:
+            return None
+        if content_hash is None:
+            content_hash = file_hash(key[0])
+        if entry['hash'] != content_hash:
+            return None
+        return self._maps[key]
+
+    def columns(self, path, sheet_name, header_values=None):
+        """Return {date: column} for a sheet, refreshing the index if stale.
+
+        header_values may be passed when the row is already in memory;
+        otherwise it is streamed from the file only if the hash changed.
+        """
+        content_hash = file_hash(path)
+        if header_values is None:
+            cached = self.fresh_columns(path, sheet_name, content_hash)
+            if cached is not None:
+                return cached
+            header_values = read_header_row(path, sheet_name, self.header_row)
+        return self.update(path, sheet_name, header_values, content_hash)
+
+    def update(self, path, sheet_name, header_values, content_hash=None):
+        """Merge a freshly read header row into the index and persist it"""
+        key = (os.path.abspath(path), sheet_name)
+        if content_hash is None:
+            content_hash = file_hash(key[0])
+        entry = self._load_entry(key) or {'hash': None, 'header': [], 'dates': []}
+
+        header = [_header_key(v) for v in header_values]
+        old_header, old_dates = entry['header'], entry['dates']
+        dates = [old_dates[i] if i < len(old_header) and old_header[i] == h else None
+                 for i, h in enumerate(header)]
+        changed = [i for i, h in enumerate(header) if i >= len(old_header) or old_header[i] != h]
+        if changed:
+            parsed = parse_header_dates([header_values[i] for i in changed])
+            for i, d in zip(changed, parsed):
+                dates[i] = d.isoformat() if d else None
+            logger.info(f"Header index: re-parsed {len(changed)} of {len(header)} cells "
+                        f"in '{sheet_name}' row {self.header_row}")
+
+        if changed or entry['hash'] != content_hash:
+            entry = {'hash': content_hash, 'header': header, 'dates': dates}
+            self._entries[key] = entry
+            self._maps[key] = self._build_map(dates)
+            self._save(key[0])
+        return self._maps[key]
+
+    def lookup(self, path, sheet_name, target_date, header_values=None):
+        """Return the column of target_date in the header row, or None"""
+        if isinstance(target_date, datetime):
+            target_date = target_date.date()
+        return self.columns(path, sheet_name, header_values).get(target_date)
+
+    @staticmethod
+    def _build_map(dates):
+        mapping = {}
+        for col, iso in enumerate(dates, 1):
+            if iso:
+                mapping.setdefault(date.fromisoformat(iso), col)  # First match wins
+        return mapping
+
+    def _load_entry(self, key):
+        if key in self._entries:
+            return self._entries[key]
+        sidecar = self.sidecar_path(key[0])
+        try:
+            with open(sidecar, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('path') != key[0] or data.get('header_row') != self.header_row:
+            return None
+        for sheet_name, entry in data.get('sheets', {}).items():
+            sheet_key = (key[0], sheet_name)
+            self._entries[sheet_key] = entry
+            self._maps[sheet_key] = self._build_map(entry['dates'])
+        return self._entries.get(key)
+
+    def _save(self, path):
+        sheets = {sheet: entry for (p, sheet), entry in self._entries.items() if p == path}
+        sidecar = self.sidecar_path(path)
+        tmp = sidecar + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'path': path, 'header_row': self.header_row, 'sheets': sheets}, f)
+            os.replace(tmp, sidecar)
+        except OSError as e:
+            logger.warning(f"Could not write header index {sidecar}: {e}")
+
+
+def read_plan_range(path, start_col, sheet_name="plan", first_row=6, last_row=44, width=3):
+    """Stream a width-column block of the plan sheet, bounded on both axes"""
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name]
+        block = []
+        for row in ws.iter_rows(min_row=first_row, max_row=last_row,
+                                min_col=start_col, max_col=start_col + width - 1, values_only=True):
+            values = list(row) + [None] * (width - len(row))
+            block.append(values)
+        return _pad_block(block, last_row - first_row + 1, width)
+    finally:
+        wb.close()
+
+
+def read_plan_blocks(path, columns, sheet_name="plan", first_row=6, last_row=44, width=3):
+    """Row-5 status and block of several date columns in one streaming pass.
+
+    Returns {column: (status, block)} with the same block layout as
+    read_plan_range().
+    """
+    columns = sorted(set(columns))
+    if not columns:
+        return {}
+    blocks = {col: [None, []] for col in columns}
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name]
+        for row_idx, row in enumerate(ws.iter_rows(min_row=5, max_row=last_row, min_col=columns[0],
+                                                   max_col=columns[-1] + width - 1, values_only=True), 5):
+            for col in columns:
+                values = list(row[col - columns[0]:col - columns[0] + width])
+                values += [None] * (width - len(values))
+                if row_idx == 5:
+                    blocks[col][0] = values[0]
+                if row_idx >= first_row:
+                    blocks[col][1].append(values)
+        return {col: (status, _pad_block(block, last_row - first_row + 1, width))
+                for col, (status, block) in blocks.items()}
+    finally:
+        wb.close()
+
+
+# OOXML namespaces used when patching packages directly
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+# Built-in number formats Excel treats as dates (m/d/yyyy, m/d/yyyy h:mm)
+DATE_NUMFMT_IDS = {14, 22}
+
+
+def _excel_serial(values):
+    """Convert datetime-likes to Excel serial day numbers, NaT -> NaN"""
+    stamps = pd.to_datetime(values, errors='coerce')
+    return ((stamps - EXCEL_EPOCH) / pd.Timedelta(days=1)).to_numpy(dtype=float, na_value=np.nan)
+
+
+def _inline_str(series):
+    """Escape a Series of strings into inlineStr cell bodies"""
+    text = series.str.replace(ILLEGAL_CHARACTERS_RE, '', regex=True).map(escape)
+    return ' t="inlineStr"><is><t xml:space="preserve">' + text + '</t></is></c>'
+
+
+def _number_cells(values, style=""):
+    """Render a float array as <v> cell bodies, None where NaN"""
+    out = np.full(len(values), None, dtype=object)
+    mask = np.isfinite(values)
+    out[mask] = [f'{style}><v>{int(v) if v.is_integer() else repr(v)}</v></c>' for v in values[mask].tolist()]
+    return out
+
+
+def _day_fractions(values):
+    """datetime.time values as fractions of a day"""
+    return np.array([(v.hour * 3600 + v.minute * 60 + v.second + v.microsecond / 1e6) / 86400 for v in values])
+
+
+def render_column(series, styles):
+    """Convert one DataFrame column to cell XML bodies in a single pass.
+
+    Returns an object array with the part of each <c> element after its
+    r attribute, or None for empty cells. Numeric, datetime and timedelta
+    columns are converted vectorized; object columns are split by value
+    type first. styles maps 'date', 'time' and 'duration' to the cellXfs
+    indexes of those values.
+    """
+    n = len(series)
+    date_attr, time_attr, duration_attr = (f' s="{styles[kind]}"' for kind in ('date', 'time', 'duration'))
+    if pd.api.types.is_bool_dtype(series):
+        out = np.full(n, None, dtype=object)
+        mask = series.notna().to_numpy()
+        out[mask] = np.where(series[mask].astype(bool).to_numpy(), ' t="b"><v>1</v></c>', ' t="b"><v>0</v></c>')
+        return out
+    if pd.api.types.is_timedelta64_dtype(series):
+        return _number_cells((series / pd.Timedelta(days=1)).to_numpy(dtype=float, na_value=np.nan), duration_attr)
+    if pd.api.types.is_numeric_dtype(series):
+        return _number_cells(series.to_numpy(dtype=float, na_value=np.nan))
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return _number_cells(_excel_serial(series), date_attr)
+
+    out = np.full(n, None, dtype=object)
+    values = series.to_numpy(dtype=object)
+    kinds = np.array([
+        'none' if v is None or v is pd.NaT or v is pd.NA else
+        'str' if isinstance(v, str) else
+        'bool' if isinstance(v, (bool, np.bool_)) else
+        'date' if isinstance(v, (datetime, date, np.datetime64)) else
+        'time' if isinstance(v, dt_time) else
+        'duration' if isinstance(v, (timedelta, np.timedelta64)) else
+        'num' if isinstance(v, (int, float, np.number)) else
+        'str'
+        for v in values
+    ], dtype=object)
+    if n == 0:
+        return out
+
+    mask = kinds == 'str'
+    if mask.any():
+        out[mask] = _inline_str(pd.Series(values[mask]).astype(str)).to_numpy()
+    mask = kinds == 'bool'
+    if mask.any():
+        out[mask] = [' t="b"><v>1</v></c>' if v else ' t="b"><v>0</v></c>' for v in values[mask]]
+    mask = kinds == 'num'
+    if mask.any():
+        out[mask] = _number_cells(values[mask].astype(float))
+    mask = kinds == 'date'
+    if mask.any():
+        out[mask] = _number_cells(_excel_serial(pd.Series(values[mask], dtype=object)), date_attr)
+    mask = kinds == 'time'
+    if mask.any():
+        out[mask] = _number_cells(_day_fractions(values[mask]), time_attr)
+    mask = kinds == 'duration'
+    if mask.any():
+        out[mask] = _number_cells(pd.to_timedelta(values[mask]) / pd.Timedelta(days=1), duration_attr)
+    return out
+
+
+def _row_xml(r, letters, cells):
+    body = ''.join(f'<c r="{letters[j]}{r}"{cell}' for j, cell in enumerate(cells) if cell is not None)
+    return f'<row r="{r}">{body}</row>'
+
+
+def render_rows(data_df, styles, sheet_rows):
+    """Render DataFrame rows to <row> elements numbered by sheet_rows"""
+    letters = [get_column_letter(i) for i in range(1, data_df.shape[1] + 1)]
+    columns = [render_column(data_df.iloc[:, j], styles) for j in range(data_df.shape[1])]
+    return [_row_xml(r, letters, cells) for r, cells in zip(sheet_rows, zip(*columns))]
+
+
+def sheet_rows_xml(data_df, styles, first_row=1, chunk_rows=2000):
+    """Yield the <row> elements for a header row plus the DataFrame rows"""
+    letters = [get_column_letter(i) for i in range(1, data_df.shape[1] + 1)]
+    header = render_column(pd.Series([str(c) for c in data_df.columns], dtype=object), styles)
+    columns = [render_column(data_df.iloc[:, j], styles) for j in range(data_df.shape[1])]
+
+    yield _row_xml(first_row, letters, header)
+    chunk = []
+    for i, cells in enumerate(zip(*columns)):
+        chunk.append(_row_xml(first_row + 1 + i, letters, cells))
+        if len(chunk) >= chunk_rows:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+ROW_RE = re.compile(r'<row\b[^>]*?\br="(\d+)"[^>]*?(?:/>|(?<!/)>.*?</row>)', re.S)
+
+
+ROW_REF_RE = re.compile(r'( r="[A-Z]*)(\d+)"')
+
+
+def _shift_rows(rows_xml, delta):
+    """Move <row> elements and their cell references down by delta rows"""
+    return ROW_REF_RE.sub(lambda m: f'{m.group(1)}{int(m.group(2)) + delta}"', rows_xml)
+
+
+def incremental_rows_xml(sheet_data_xml, data_df, old_hashes, new_hashes, styles):
+    """Plan a row-level update of existing <sheetData> content.
+
+    Rows are matched by hash with difflib; matched rows keep their XML
+    (renumbered if they moved) and only inserted or changed rows are
+    rendered. Returns (list of row XML, rendered row count), or None when
+    the sheet does not line up with the stored hashes or when most rows
+    would have to be rendered or renumbered anyway, where a full rewrite
+    is faster.
+    """
+    existing = {int(m.group(1)): m.group(0) for m in ROW_RE.finditer(sheet_data_xml)}
+    if 1 not in existing or max(existing) != len(old_hashes) + 1:
+        return None
+
+    matcher = difflib.SequenceMatcher(None, old_hashes.tolist(), new_hashes.tolist())
+    opcodes = matcher.get_opcodes()
+    positions = [j for tag, _, _, j1, j2 in opcodes if tag in ('replace', 'insert') for j in range(j1, j2)]
+    moved = sum(i2 - i1 for tag, i1, i2, j1, _ in opcodes if tag == 'equal' and i1 != j1)
+    if len(positions) + moved > len(new_hashes) // 2:
+        return None
+    rendered = dict(zip(positions, render_rows(data_df.iloc[positions], styles, [p + 2 for p in positions])))
+
+    rows = [existing[1]]  # Header row, the schema is unchanged
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            block = [existing[r] for r in range(i1 + 2, i2 + 2) if r in existing]
+            rows.extend(block if i1 == j1 else [_shift_rows(''.join(block), j1 - i1)])
+        elif tag in ('replace', 'insert'):
+            rows.extend(rendered[j] for j in range(j1, j2))
+    return rows, len(positions)
+
+
+def _sheet_part_names(zf):
+    """Map sheet names to their worksheet part names inside the package"""
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {}
+    for rel in rels.findall(f'{{{NS_PKG_REL}}}Relationship'):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        elif not target.startswith('xl/'):
+            target = 'xl/' + target
+        targets[rel.get('Id')] = target
+    return {
+        sheet.get('name'): targets[sheet.get(f'{{{NS_REL}}}id')]
+        for sheet in workbook.iter(f'{{{NS_MAIN}}}sheet')
+    }
+
+
+# Built-in number formats per kind of value, the first one used when a style is added
+NUMBER_FORMAT_IDS = {'date': [14, 22], 'time': [21, 20], 'duration': [46]}
+
+
+def _format_kind(code):
+    """'date', 'time', 'duration' or None for a custom number format code"""
+    plain = re.sub(r'"[^"]*"|\[[^\]]*\]', '', code).lower()
+    if '[h' in code.lower():
+        return 'duration'
+    if 'd' in plain and 'y' in plain:
+        return 'date'
+    if 'h' in plain and 'd' not in plain and 'y' not in plain:
+        return 'time'
+    return None
+
+
+def _number_style(styles_xml, kind='date'):
+    """Return (xf index of a plain date/time/duration style, styles xml).
+
+    Only an xf with the default font, fill and border and no alignment is
+    reused, so pasted values don't pick up another cell's formatting; one
+    is appended to cellXfs if there is none.
+    """
+    root = ET.fromstring(styles_xml)
+    fmt_ids = set(NUMBER_FORMAT_IDS[kind])
+    for fmt in root.iter(f'{{{NS_MAIN}}}numFmt'):
+        if _format_kind(fmt.get('formatCode', '')) == kind:
+            fmt_ids.add(int(fmt.get('numFmtId')))
+    cell_xfs = root.find(f'{{{NS_MAIN}}}cellXfs')
+    xfs = cell_xfs.findall(f'{{{NS_MAIN}}}xf') if cell_xfs is not None else []
+    for idx, xf in enumerate(xfs):
+        plain = all(xf.get(attr, '0') == '0' for attr in ('fontId', 'fillId', 'borderId')) and len(xf) == 0
+        if plain and int(xf.get('numFmtId', 0)) in fmt_ids:
+            return idx, styles_xml
+
+    # No such style yet: append one to cellXfs and bump its count
+    text = styles_xml.decode('utf-8')
+    new_xf = (f'<xf numFmtId="{NUMBER_FORMAT_IDS[kind][0]}" fontId="0" fillId="0" borderId="0" xfId="0" '
+              f'applyNumberFormat="1"/>')
+    text = re.sub(r'(<cellXfs\b[^>]*\bcount=")(\d+)(")',
+                  lambda m: f'{m.group(1)}{int(m.group(2)) + 1}{m.group(3)}', text, count=1)
+    text = text.replace('</cellXfs>', new_xf + '</cellXfs>', 1)
+    return len(xfs), text.encode('utf-8')
+
+
+def _date_style(styles_xml):
+    """Return (xf index of a plain date style, styles xml) adding the style if missing"""
+    return _number_style(styles_xml, 'date')
+
+
+def _cell_styles(styles_xml):
+    """Return ({'date'|'time'|'duration': xf index}, styles xml) for render_column()"""
+    styles = {}
+    for kind in NUMBER_FORMAT_IDS:
+        styles[kind], styles_xml = _number_style(styles_xml, kind)
+    return styles, styles_xml
+
+
+def _full_calc_on_load(workbook_xml):
+    """workbook.xml with <calcPr fullCalcOnLoad="1">, so Excel recalculates
+    the cached formula values a direct XML write left stale"""
+    text = workbook_xml.decode('utf-8')
+    match = re.search(r'<calcPr\b[^>]*?/?>', text)
+    if match:
+        tag = re.sub(r'\s+fullCalcOnLoad="[^"]*"', '', match.group(0))
+        tag = re.sub(r'\s*(/?>)$', r' fullCalcOnLoad="1"\1', tag)
+        text = text[:match.start()] + tag + text[match.end():]
+    else:
+        # calcPr follows definedNames and precedes these in CT_Workbook
+        follow = re.search(r'<(?:oleSize|customWorkbookViews|pivotCaches|smartTagPr|smartTagTypes|webPublishing'
+                           r'|fileRecoveryPr|webPublishObjects|extLst)\b|</workbook>', text)
+        text = text[:follow.start()] + '<calcPr fullCalcOnLoad="1"/>' + text[follow.start():]
+    return text.encode('utf-8')
+
+
+def write_sheet_data(path, sheet_frames, baselines=None):
+    """Replace the cell data of whole sheets directly in an OOXML package.
+
+    sheet_frames maps sheet name -> DataFrame; each sheet's <sheetData> is
+    rewritten with a header row and the DataFrame rows, streamed as XML
+    with inline strings. When baselines holds the row hashes last written
+    to a sheet, only the rows that differ are rendered. See write_package().
+    Returns {sheet name: rows rendered}.
+    """
+    return write_package(path, sheet_frames, baselines=baselines)[0]
+
+
+def write_package(path, sheet_frames=None, sheet_cells=None, baselines=None):
+    """Rewrite whole sheets and patch single cells of an OOXML package in one pass.
+
+    sheet_frames and baselines are as for write_sheet_data(), sheet_cells
+    as for patch_cells(); a sheet can't be in both. Every other part
+    (vbaProject.bin included) is copied without being inflated. When whole
+    sheets are rewritten calcChain.xml is dropped so Excel rebuilds it,
+    otherwise it only loses the entries of the patched cells; either way
+    the workbook is flagged to be recalculated on load. All patched parts
+    are built before the package is written, so a ValueError leaves the
+    file untouched. Returns ({sheet name: rows rendered}, [rewritten parts]).
+    """
+    sheet_frames, sheet_cells = sheet_frames or {}, sheet_cells or {}
+    baselines = baselines or {}
+    both = sorted(set(sheet_frames) & set(sheet_cells))
+    if both:
+        raise ValueError(f"Sheets both rewritten and patched: {both}")
+    rendered = {}
+    tmp = path + '.tmp'
+    with zipfile.ZipFile(path) as zin:
+        names = set(zin.namelist())
+        parts = _sheet_part_names(zin)
+        missing = [name for name in [*sheet_frames, *sheet_cells] if name not in parts]
+        if missing:
+            raise KeyError(f"Sheets not found in {os.path.basename(path)}: {missing}")
+        targets = {parts[name]: name for name in sheet_frames}
+
+        styles_xml = zin.read('xl/styles.xml')
+        styles, date_style, new_styles = None, None, styles_xml
+        if sheet_frames:
+            styles, new_styles = _cell_styles(styles_xml)
+            date_style = styles['date']
+        elif any(isinstance(v, (datetime, date)) for cells in sheet_cells.values() for v in cells.values()):
+            date_style, new_styles = _date_style(styles_xml)
+        date_xfs = _date_xfs(new_styles)
+        replaced = {
+            parts[sheet]: patch_sheet_xml(zin.read(parts[sheet]).decode('utf-8'), cells,
+                                          date_xfs, date_style).encode('utf-8')
+            for sheet, cells in sheet_cells.items() if cells
+        }
+        if new_styles != styles_xml:
+            replaced['xl/styles.xml'] = new_styles
+        replaced['xl/workbook.xml'] = _full_calc_on_load(zin.read('xl/workbook.xml'))
+
+        drop = set()
+        if 'xl/calcChain.xml' in names:
+            calc_xml = None
+            if not sheet_frames:
+                ids = _sheet_ids(zin)
+                refs = {(ids[sheet], f'{get_column_letter(c)}{r}') for sheet, cells in sheet_cells.items()
+                        for r, c in cells}
+                calc_xml = _patch_calc_chain(zin.read('xl/calcChain.xml'), refs)
+            if calc_xml is not None:
+                replaced['xl/calcChain.xml'] = calc_xml
+            else:
+                drop.add('xl/calcChain.xml')
+                text = zin.read('[Content_Types].xml').decode('utf-8')
+                replaced['[Content_Types].xml'] = re.sub(
+                    r'<Override[^>]*PartName="/xl/calcChain.xml"[^>]*/>', '', text).encode('utf-8')
+                text = zin.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+                replaced['xl/_rels/workbook.xml.rels'] = re.sub(
+                    r'<Relationship[^>]*Target="[^"]*calcChain.xml"[^>]*/>', '', text).encode('utf-8')
+
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for item in zin.infolist():
+                name = item.filename
+                if name in drop:
+                    continue
+                if name in replaced:
+                    info = zipfile.ZipInfo(name, date_time=item.date_time)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    zout.writestr(info, replaced[name])
+                elif name in targets:
+                    sheet = targets[name]
+                    rendered[sheet] = _write_sheet_part(zin.read(name).decode('utf-8'), sheet_frames[sheet],
+                                                        styles, zout, item, baselines.get(sheet))
+                else:
+                    _copy_part(zin, zout, item)
+    os.replace(tmp, path)
+    return rendered, sorted(replaced)
+
+
+def _write_sheet_part(sheet_xml, data_df, styles, zout, item, baseline=None):
+    """Stream a worksheet part with its <sheetData> replaced"""
+    match = re.search(r'<sheetData\s*/>|<sheetData>(.*?)</sheetData>', sheet_xml, re.S)
+    if match is None:
+        raise ValueError(f"No <sheetData> element in {item.filename}")
+    head, tail = sheet_xml[:match.start()], sheet_xml[match.end():]
+    rows, cols = len(data_df) + 1, max(data_df.shape[1], 1)
+    head = re.sub(r'<dimension ref="[^"]*"\s*/>', f'<dimension ref="A1:{get_column_letter(cols)}{rows}"/>', head)
+
+    plan = None
+    if baseline is not None:
+        plan = incremental_rows_xml(match.group(1) or '', data_df, baseline, row_hashes(data_df), styles)
+        if plan is None:
+            logger.info(f"Incremental update of {item.filename} not possible or not worth it, rewriting in full")
+    if plan:
+        rows_xml, count = plan
+        chunks = (''.join(rows_xml[i:i + 2000]) for i in range(0, len(rows_xml), 2000))
+    else:
+        chunks, count = sheet_rows_xml(data_df, styles), len(data_df)
+
+    info = zipfile.ZipInfo(item.filename, date_time=item.date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    with zout.open(info, 'w') as f:
+        f.write(head.encode('utf-8'))
+        f.write(b'<sheetData>')
+        for chunk in chunks:
+            f.write(chunk.encode('utf-8'))
+        f.write(b'</sheetData>')
+        f.write(tail.encode('utf-8'))
+    return count
+
+
+# Copying a member's compressed bytes as they are relies on ZipFile internals
+# (fp, start_dir, _didModify) as they are in these Python versions; any other
+# version copies through the public API, inflating and deflating again
+_RAW_ZIP_COPY = (3, 8) <= sys.version_info[:2] <= (3, 13)
+
+
+def _copy_part(zin, zout, item):
+    """Copy a package member unchanged, without inflating it where supported"""
+    if _RAW_ZIP_COPY and all(hasattr(zout, attr) for attr in ('fp', 'start_dir', '_didModify')):
+        _copy_raw(zin, zout, item)
+        return
+    info = zipfile.ZipInfo(item.filename, date_time=item.date_time)
+    info.compress_type, info.external_attr = item.compress_type, item.external_attr
+    with zin.open(item) as src, zout.open(info, 'w', force_zip64=item.file_size > zipfile.ZIP64_LIMIT) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _copy_raw(zin, zout, item):
+    """Copy a package member's compressed bytes as they are"""
+    zin.fp.seek(item.header_offset)
+    header = zin.fp.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"Bad local header for {item.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    zin.fp.seek(item.header_offset + 30 + name_len + extra_len)
+    data = zin.fp.read(item.compress_size)
+
+    info = copy.copy(item)
+    info.flag_bits &= ~0x08  # CRC and sizes go into the local header, no data descriptor
+    info.header_offset = zout.fp.tell()
+    zout.fp.write(info.FileHeader())
+    zout.fp.write(data)
+    zout.filelist.append(info)
+    zout.NameToInfo[info.filename] = info
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+
+CELL_RE = re.compile(r'<c\b[^>]*?(?:/>|(?<!/)>.*?</c>)', re.S)
+CELL_POS_RE = re.compile(r'\br="([A-Z]+)(\d+)"')
+STYLE_ATTR_RE = re.compile(r'\bs="(\d+)"')
+
+
+def _date_xfs(styles_xml):
+    """Indexes of the cellXfs entries that format their cell as a date"""
+    root = ET.fromstring(styles_xml)
+    date_fmt_ids = set(DATE_NUMFMT_IDS) | set(range(14, 23)) | set(range(45, 48))
+    for fmt in root.iter(f'{{{NS_MAIN}}}numFmt'):
+        code = re.sub(r'"[^"]*"|\[[^\]]*\]', '', fmt.get('formatCode', '')).lower()
+        if 'd' in code or 'y' in code or 'h' in code:
+            date_fmt_ids.add(int(fmt.get('numFmtId')))
+    cell_xfs = root.find(f'{{{NS_MAIN}}}cellXfs')
+    xfs = cell_xfs.findall(f'{{{NS_MAIN}}}xf') if cell_xfs is not None else []
+    return {idx for idx, xf in enumerate(xfs) if int(xf.get('numFmtId', 0)) in date_fmt_ids}
+
+
+def _cell_xml(ref, value, style, date_xfs, date_style):
+    """One <c> element holding value, keeping the cell's existing style; '' for an empty unstyled cell"""
+    if isinstance(value, float) and not np.isfinite(value):
+        value = None
+    if isinstance(value, (datetime, date)):
+        if style is None or style not in date_xfs:
+            style = date_style
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        value = (value - EXCEL_EPOCH.to_pydatetime()) / timedelta(days=1)
+    s = f' s="{style}"' if style is not None else ''
+    if value is None:
+        return f'<c r="{ref}"{s}/>' if s else ''
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, np.number)):
+        value = float(value)
+        return f'<c r="{ref}"{s}><v>{int(value) if value.is_integer() else repr(value)}</v></c>'
+    text = escape(ILLEGAL_CHARACTERS_RE.sub('', str(value)))
+    return f'<c r="{ref}"{s} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _patch_row(row_xml, r, cells, date_xfs, date_style):
+    """Rewrite one <row> element with cells {col: value} overwritten or added"""
+    if row_xml is None:
+        open_tag, body = f'<row r="{r}">', ''
+    else:
+        open_tag = row_xml[:row_xml.index('>') + 1]
+        body = '' if open_tag.endswith('/>') else row_xml[len(open_tag):-len('</row>')]
+        # spans is only a load hint and may no longer cover the row
+        open_tag = re.sub(r'\s+spans="[^"]*"', '', open_tag).replace('/>', '>')
+
+    existing = {}
+    for match in CELL_RE.finditer(body):
+        pos = CELL_POS_RE.search(match.group(0)[:match.group(0).index('>')])
+        existing[column_index_from_string(pos.group(1))] = match.group(0)
+
+    for col, value in cells.items():
+        old = existing.get(col, '')
+        tag = old[:old.index('>') + 1] if old else ''
+        if re.search(r'<f\b[^>]*\b(?:ref="|t="array")', old):
+            raise ValueError(f"Cell {get_column_letter(col)}{r} holds a shared or array formula")
+        style = STYLE_ATTR_RE.search(tag)
+        existing[col] = _cell_xml(f'{get_column_letter(col)}{r}', value,
+                                  int(style.group(1)) if style else None, date_xfs, date_style)
+    body = ''.join(existing[col] for col in sorted(existing))
+    if row_xml is None and not body:
+        return ''  # Clearing cells of a row that doesn't exist
+    return open_tag + body + '</row>'
+
+
+def patch_sheet_xml(sheet_xml, cells, date_xfs, date_style):
+    """Overwrite cells {(row, col): value} in a worksheet part.
+
+    Only the affected <row> elements are rebuilt; everything else is sliced
+    through as it is. Overwritten cells keep their style (dates get a date
+    style if theirs is not one), lose any formula, and hold text as inline
+    strings, so sharedStrings.xml is left untouched. Cells that are shared
+    or array formula masters raise ValueError, as their dependents would
+    lose their formula.
+    """
+    match = re.search(r'<sheetData\s*/>|<sheetData>(.*?)</sheetData>', sheet_xml, re.S)
+    if match is None:
+        raise ValueError("No <sheetData> element in worksheet")
+    sheet_data = match.group(1) or ''
+    by_row = {}
+    for (r, col), value in cells.items():
+        by_row.setdefault(r, {})[col] = value
+
+    pieces, pos, pending = [], 0, sorted(by_row)
+    for row_match in ROW_RE.finditer(sheet_data):
+        r = int(row_match.group(1))
+        while pending and pending[0] < r:  # Rows that don't exist yet go before this one
+            new_r = pending.pop(0)
+            pieces.append(sheet_data[pos:row_match.start()])
+            pos = row_match.start()
+            pieces.append(_patch_row(None, new_r, by_row[new_r], date_xfs, date_style))
+        if pending and pending[0] == r:
+            pending.pop(0)
+            pieces.append(sheet_data[pos:row_match.start()])
+            pieces.append(_patch_row(row_match.group(0), r, by_row[r], date_xfs, date_style))
+            pos = row_match.end()
+        if not pending:
+            break
+    pieces.append(sheet_data[pos:])
+    pieces.extend(_patch_row(None, r, by_row[r], date_xfs, date_style) for r in pending)
+
+    head, tail = sheet_xml[:match.start()], sheet_xml[match.end():]
+    rows = [r for r, _ in cells]
+    cols = [c for _, c in cells]
+
+    def grow(m):
+        c1, r1 = column_index_from_string(m.group(1)), int(m.group(2))
+        c2, r2 = (column_index_from_string(m.group(3)), int(m.group(4))) if m.group(3) else (c1, r1)
+        return (f'<dimension ref="{get_column_letter(min(c1, *cols))}{min(r1, *rows)}:'
+                f'{get_column_letter(max(c2, *cols))}{max(r2, *rows)}"')
+    head = re.sub(r'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"', grow, head, count=1)
+    return head + '<sheetData>' + ''.join(pieces) + '</sheetData>' + tail
+
+
+def _sheet_ids(zf):
+    """Map sheet names to their sheetId, the sheet reference used by calcChain.xml"""
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    return {sheet.get('name'): int(sheet.get('sheetId')) for sheet in workbook.iter(f'{{{NS_MAIN}}}sheet')}
+
+
+def _patch_calc_chain(calc_xml, refs):
+    """Drop calcChain entries of cells that no longer hold a formula.
+
+    refs is a set of (sheetId, 'A1') pairs. Entries inherit the sheet of the
+    previous entry when they have no i attribute, so the kept entries are
+    written with an explicit i. Returns None when no entry is left.
+    """
+    text = calc_xml.decode('utf-8')
+    match = re.search(r'(<calcChain\b[^>]*>)(.*)(</calcChain>)', text, re.S)
+    if match is None:
+        return None
+    kept, sheet_id = [], None
+    for entry in re.finditer(r'<c\b([^>]*?)/>', match.group(2)):
+        attrs = entry.group(1)
+        i = re.search(r'\bi="(\d+)"', attrs)
+        if i:
+            sheet_id = int(i.group(1))
+        ref = re.search(r'\br="([^"]+)"', attrs).group(1)
+        if (sheet_id, ref) in refs:
+            continue
+        attrs = re.sub(r'\s+i="\d+"', '', attrs)
+        kept.append(f'<c{attrs} i="{sheet_id}"/>')
+    if not kept:
+        return None
+    return (text[:match.start()] + match.group(1) + ''.join(kept) + match.group(3)
+            + text[match.end():]).encode('utf-8')
+
+
+def patch_cells(path, sheet_cells):
+    """Overwrite individual cells directly in an OOXML package.
+
+    sheet_cells maps sheet name -> {(row, col): value}. Only the affected
+    worksheet parts are rewritten (see patch_sheet_xml), calcChain.xml
+    loses the entries of the overwritten cells, workbook.xml is flagged to
+    be recalculated on load and styles.xml changes only if a date style has
+    to be added. Every other part, vbaProject.bin included, is copied byte
+    for byte without being inflated. Raises ValueError, leaving the file
+    untouched, when a cell can't be patched. Returns the rewritten parts.
+    """
+    return write_package(path, sheet_cells=sheet_cells)[1]
+
+
+def sheet_dimension(path, sheet_name):
+    """(last row, last column) of a sheet's <dimension ref>, read without loading the workbook.
+
+    Raises KeyError if there is no such sheet; None if the sheet has no
+    dimension element.
+    """
+    with zipfile.ZipFile(path) as zf:
+        part = _sheet_part_names(zf)[sheet_name]
+        with zf.open(part) as f:
+            head = f.read(4096).decode('utf-8', errors='ignore')
+    match = re.search(r'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"', head)
+    if match is None:
+        return None
+    col, row = match.group(3) or match.group(1), match.group(4) or match.group(2)
+    return int(row), column_index_from_string(col)
+
+
+def sheet_dimension_rows(path, sheet_name):
+    """Last row of a sheet's <dimension ref>, read without loading the workbook"""
+    dimension = sheet_dimension(path, sheet_name)
+    return dimension[0] if dimension else None
+
+
+def row_hashes(data_df):
+    """One uint64 hash per DataFrame row, computed vectorized"""
+    return pd.util.hash_pandas_object(data_df, index=False).to_numpy()
+
+
+def frame_schema(data_df):
+    """Column names and dtypes; a change forces a full rewrite"""
+    return [f"{col}:{dtype}" for col, dtype in zip(data_df.columns.astype(str), data_df.dtypes.astype(str))]
+
+
+class RowFingerprint:
+    """Row hashes of the DataFrame last written to a sheet.
+
+    Stored in a sidecar .npz next to the workbook so the next run can diff
+    its export against what is already in the sheet.
+    """
+
+    def __init__(self, path, sheet_name):
+        folder, name = os.path.split(os.path.abspath(path))
+        self.sidecar = os.path.join(folder, f".{name}.{sheet_name}.rows.npz")
+
+    def load(self, data_df):
+        """Return the stored hashes if the schema matches data_df, else None"""
+        try:
+            with np.load(self.sidecar, allow_pickle=False) as data:
+                schema, hashes = data['schema'].tolist(), data['hashes']
+        except (OSError, ValueError, KeyError):
+            return None
+        if schema != frame_schema(data_df):
+            logger.info("Schema changed since the last paste, incremental update disabled")
+            return None
+        return hashes
+
+    def save(self, data_df, hashes=None):
+        if hashes is None:
+            hashes = row_hashes(data_df)
+        tmp = self.sidecar + '.tmp.npz'
+        try:
+            np.savez(tmp, schema=np.array(frame_schema(data_df), dtype=str), hashes=hashes)
+            os.replace(tmp, self.sidecar)
+        except OSError as e:
+            logger.warning(f"Could not write row fingerprint {self.sidecar}: {e}")
+
+    def clear(self):
+        try:
+            os.remove(self.sidecar)
+        except OSError:
+            pass
+
+
+class SnapshotCache:
+    """Columnar snapshots of parsed exports, so unchanged files are not parsed again.
+
+    Each snapshot is a folder named after the source's content hash with
+    one .npy file per column (strings as fixed-width unicode plus a null
+    mask, mixed object columns as typed JSON) and a meta.json holding the
+    column dtypes and the source's path, size and mtime. A matching size/mtime is trusted without hashing;
+    otherwise the file is hashed and looked up by content. Columns are
+    memory-mapped copy-on-write on load, so the DataFrame is writable like
+    a freshly parsed one and loading never writes to the cache. The oldest
+    snapshots are evicted once the folder grows beyond max_bytes.
+    """
+
+    def __init__(self, folder, max_bytes=200 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def _metas(self):
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        for name in names:
+            try:
+                with open(os.path.join(self.folder, name, 'meta.json'), encoding='utf-8') as f:
+                    yield name, json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def load(self, path):
+        """DataFrame snapshot of path, or None if it was never stored"""
+        path = os.path.abspath(path)
+        stamp = list(file_fingerprint(path))
+        name = next((n for n, meta in self._metas() if meta['source'] == path and meta['stamp'] == stamp), None)
+        if name is None:
+            name = file_hash(path)
+            if not os.path.exists(os.path.join(self.folder, name, 'meta.json')):
+                return None
+        try:
+            data_df = self._read(os.path.join(self.folder, name))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Snapshot {name} unreadable, parsing again: {e}")
+            return None
+        logger.info(f"Loaded {os.path.basename(path)} from snapshot {name[:12]} ({len(data_df)} rows)")
+        return data_df
+
+    def _read(self, snapshot):
+        with open(os.path.join(snapshot, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        columns = {}
+        for i, col in enumerate(meta['columns']):
+            if col['kind'] == 'json':
+                with open(os.path.join(snapshot, f"{i}.json"), encoding='utf-8') as f:
+                    values = pd.Series(json.load(f, object_hook=self._decode), dtype=object)
+            else:
+                values = np.load(os.path.join(snapshot, f"{i}.npy"), mmap_mode='c')
+            if col['kind'] == 'str':
+                mask = np.load(os.path.join(snapshot, f"{i}.mask.npy"), mmap_mode='r')
+                values = pd.Series(values.astype(object)).where(~mask, None)
+                if col['dtype'] != 'object':
+                    values = values.astype(col['dtype'])
+            columns[i] = values
+        data_df = pd.DataFrame(columns, copy=False)
+        data_df.columns = [col['name'] for col in meta['columns']]
+        return data_df
+
+    def store(self, path, data_df):
+        """Write a snapshot of data_df parsed from path, then evict old snapshots"""
+        path = os.path.abspath(path)
+        name = file_hash(path)
+        snapshot = os.path.join(self.folder, name)
+        tmp = snapshot + '.tmp'
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            columns = []
+            for i, col_name in enumerate(data_df.columns):
+                series = data_df.iloc[:, i]
+                kind = self._kind(series)
+                if kind == 'str':
+                    mask = series.isna().to_numpy()
+                    np.save(os.path.join(tmp, f"{i}.npy"), series.where(~mask, '').astype(str).to_numpy(dtype=str))
+                    np.save(os.path.join(tmp, f"{i}.mask.npy"), mask)
+                elif kind == 'json':
+                    with open(os.path.join(tmp, f"{i}.json"), 'w', encoding='utf-8') as f:
+                        json.dump([None if pd.isna(v) else v for v in series.tolist()], f, default=self._encode)
+                else:
+                    np.save(os.path.join(tmp, f"{i}.npy"), series.to_numpy())
+                columns.append({'name': col_name, 'kind': kind, 'dtype': str(series.dtype)})
+            meta = {'source': path, 'stamp': list(file_fingerprint(path)), 'stored': time.time(),
+                    'rows': len(data_df), 'columns': columns}
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            if os.path.exists(snapshot):
+                shutil.rmtree(snapshot)
+            os.replace(tmp, snapshot)
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Could not write snapshot of {os.path.basename(path)}: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        logger.info(f"Stored snapshot {name[:12]} of {os.path.basename(path)}")
+        self.evict(keep=name)
+
+    @staticmethod
+    def _encode(value):
+        """JSON for the object column values JSON has no type of its own for.
+
+        Dates and times are tagged so they load back as the same types;
+        anything else raises TypeError and the file is not snapshotted.
+        """
+        if isinstance(value, np.datetime64):
+            value = pd.Timestamp(value).to_pydatetime()
+        elif isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, datetime):
+            return {'__datetime__': value.isoformat()}
+        if isinstance(value, date):
+            return {'__date__': value.isoformat()}
+        if isinstance(value, dt_time):
+            return {'__time__': value.isoformat()}
+        if isinstance(value, timedelta):
+            return {'__timedelta__': value.total_seconds()}
+        raise TypeError(f"{type(value).__name__} values can't be snapshotted")
+
+    @staticmethod
+    def _decode(obj):
+        """json object_hook reversing _encode()"""
+        if len(obj) == 1:
+            (tag, value), = obj.items()
+            if tag == '__datetime__':
+                return datetime.fromisoformat(value)
+            if tag == '__date__':
+                return date.fromisoformat(value)
+            if tag == '__time__':
+                return dt_time.fromisoformat(value)
+            if tag == '__timedelta__':
+                return timedelta(seconds=value)
+        return obj
+
+    @staticmethod
+    def _kind(series):
+        """Storage kind: numpy dtypes as is, text as fixed-width unicode, anything else as JSON"""
+        if isinstance(series.dtype, pd.StringDtype):
+            return 'str'
+        if series.dtype == object:
+            return 'str' if series.dropna().map(type).eq(str).all() else 'json'
+        return 'numpy' if series.dtype.kind in 'biufmM' else 'json'
+
+    def evict(self, keep=None):
+        """Remove the oldest snapshots until the folder fits max_bytes"""
+        entries = []
+        for name, meta in self._metas():
+            folder = os.path.join(self.folder, name)
+            size = sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+            entries.append((meta.get('stored', 0), name, size))
+        total = sum(size for _, _, size in entries)
+        for stored, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted snapshot {name[:12]} ({size / 2 ** 20:.1f} MB)")
+
+
+class WorkbookSession:
+    """Keeps each workbook loaded once per run.
+
+    Workbooks are cached per (path, data_only) view. A cached view is reused
+    as long as the file on disk is unchanged: the mtime/size is checked first
+    and the content hash only when those differ. Writes go to the formula view
+    and are saved in one go by flush(); sheet rewrites and small edits
+    registered with replace_sheet_data() and patch_cells() are written
+    straight into the package XML instead, and applied to the loaded views
+    so they stay valid without being parsed again.
+    """
+
     def __init__(self):
-        self.pregled_file = os.path.abspath('43.xls')
-        self.porocanje_file = os.path.abspath("poročanje proizvodnje2025.xlsm")
-        self.plan_file = os.path.abspath("plan brizganja 2025 mesečni.xlsx")
+        self._books = {}  # (path, data_only) -> workbook
+        self._stamps = {}  # (path, data_only) -> (mtime, size, sha1)
+        self._dirty = set()  # paths with pending writes
+        self._sheet_data = {}  # path -> {sheet name: (DataFrame, incremental)} written as XML
+        self._cells = {}  # path -> {sheet name: {(row, col): value}} patched into the XML
+        self.loads = 0
+        self.saves = 0
+
+    def get(self, path, data_only=False):
+        """Return the cached workbook for path, loading it if needed"""
+        path = os.path.abspath(path)
+        key = (path, data_only)
+        if key in self._books:
+            if not data_only and path in self._dirty:
+                return self._books[key]
+            if not self._changed_on_disk(key):
+                return self._books[key]
+            logger.info(f"{os.path.basename(path)} changed on disk, reloading")
+            self._drop(key)
+
+        keep_vba = path.lower().endswith('.xlsm') and not data_only
+        logger.info(f"Loading {os.path.basename(path)} (data_only={data_only})")
+        wb = load_workbook(path, data_only=data_only, keep_vba=keep_vba)
+        self.loads += 1
+        self._books[key] = wb
+        self._stamps[key] = file_fingerprint(path) + (file_hash(path),)
+        return wb
+
+    def mark_dirty(self, path):
+        """Register a pending write on the formula view of path"""
+        path = os.path.abspath(path)
+        if (path, False) not in self._books:
+            raise KeyError(f"Workbook not loaded in session: {path}")
+        self._dirty.add(path)
+
+    def replace_sheet_data(self, path, sheet_name, data_df, incremental=False):
+        """Register a rewrite of a sheet's cells, applied as XML on flush.
+
+        With incremental=True only the rows that differ from the last
+        written DataFrame are rendered, and an unchanged sheet is skipped.
+        """
+        path = os.path.abspath(path)
+        self._sheet_data.setdefault(path, {})[sheet_name] = (data_df, incremental)
+
+    def patch_cells(self, path, sheet_name, cells):
+        """Register cell values {(row, col): value} to patch into the sheet XML on flush.
+
+        The cached formula view is updated as well, so reads before the
+        flush see the new values and a full save, if one happens anyway,
+        writes the same cells.
+        """
+        path = os.path.abspath(path)
+        ws = self._books[(path, False)][sheet_name] if (path, False) in self._books else None
+        for (r, col), value in cells.items():
+            if ws is not None:
+                ws.cell(row=r, column=col).value = value
+        self._cells.setdefault(path, {}).setdefault(sheet_name, {}).update(cells)
+
+    def flush(self):
+        """Save every workbook with pending writes, once each"""
+        # Taken first: the saves below invalidate the views of the same paths
+        patches, self._cells = self._cells, {}
+        for path in sorted(self._dirty):
+            logger.info(f"Saving {os.path.basename(path)}")
+            self._books[(path, False)].save(path)
+            self.saves += 1
+            self._stamps[(path, False)] = file_fingerprint(path) + (file_hash(path),)
+            # Cached values of the data_only view are stale after a save
+            self._drop((path, True))
+        self._dirty.clear()
+
+        # Sheet rewrites and cell patches of a path go into one package pass
+        for path in sorted(set(self._sheet_data) | set(patches)):
+            frames, baselines, hashes = {}, {}, {}
+            for sheet_name, (data_df, incremental) in self._sheet_data.get(path, {}).items():
+                fingerprint = RowFingerprint(path, sheet_name)
+                hashes[sheet_name] = row_hashes(data_df)
+                previous = fingerprint.load(data_df) if incremental else None
+                if (previous is not None and np.array_equal(previous, hashes[sheet_name])
+                        and sheet_dimension_rows(path, sheet_name) == len(data_df) + 1):
+                    logger.info(f"'{sheet_name}' is unchanged since the last paste, skipping write")
+                    continue
+                frames[sheet_name] = data_df
+                if previous is not None:
+                    baselines[sheet_name] = previous
+            sheets = patches.get(path, {})
+            if not frames and not sheets:
+                continue
+
+            start = time.perf_counter()
+            try:
+                rendered, written = write_package(path, frames, sheets, baselines)
+            except ValueError as e:
+                # A cell the XML patch can't handle safely, fall back to a full save for the cells
+                logger.warning(f"Cannot patch {os.path.basename(path)} directly ({e}), saving with openpyxl")
+                rendered = write_sheet_data(path, frames, baselines) if frames else {}
+                self.saves += bool(frames)
+                self.invalidate(path)
+                wb = self.get(path)
+                for sheet_name, cells in sheets.items():
+                    for (r, col), value in cells.items():
+                        wb[sheet_name].cell(row=r, column=col).value = value
+                wb.save(path)
+                written = []
+            rows = sum(rendered.values())
+            count = sum(len(cells) for cells in sheets.values())
+            elapsed = time.perf_counter() - start
+            logger.info(f"Wrote {rows} rows of {sorted(frames)} and {count} cells to {os.path.basename(path)} "
+                        f"in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/s), rewrote {written}, "
+                        f"other parts copied as is")
+            self.saves += 1
+            for sheet_name, data_df in frames.items():
+                RowFingerprint(path, sheet_name).save(data_df, hashes[sheet_name])
+            if written:
+                self._apply_to_views(path, frames, sheets)
+            else:
+                self.invalidate(path)
+        self._sheet_data.clear()
+
+    def _apply_to_views(self, path, frames, sheets):
+        """Bring the loaded views of path in line with a package write, so they stay valid.
+
+        The written cells hold values, which both views show as they are;
+        formula results elsewhere are left to recalc().
+        """
+        stamp = None
+        for data_only in (False, True):
+            wb = self._books.get((path, data_only))
+            if wb is None:
+                continue
+            for sheet_name, data_df in frames.items():
+                ws = wb[sheet_name]
+                ws.delete_rows(1, ws.max_row)
+                ws.append(list(data_df.columns))
+                for row in data_df.astype(object).where(data_df.notna(), None).values.tolist():
+                    ws.append(row)
+            for sheet_name, cells in sheets.items():
+                ws = wb[sheet_name]
+                for (r, col), value in cells.items():
+                    ws.cell(row=r, column=col).value = value
+            stamp = stamp or file_fingerprint(path) + (file_hash(path),)
+            self._stamps[(path, data_only)] = stamp
+
+    def invalidate(self, path):
+        """Forget all cached views of path; pending patch_cells() edits are kept"""
+        path = os.path.abspath(path)
+        self._dirty.discard(path)
+        self._sheet_data.pop(path, None)
+        for data_only in (False, True):
+            self._drop((path, data_only))
+
+    def close(self):
+        """Close all cached workbooks, discarding unsaved writes"""
+        pending = self._dirty | set(self._sheet_data) | set(self._cells)
+        if pending:
+            logger.warning(f"Discarding unsaved changes to: {sorted(pending)}")
+        for key in list(self._books):
+            self._drop(key)
+        self._dirty.clear()
+        self._sheet_data.clear()
+        self._cells.clear()
+
+    def _changed_on_disk(self, key):
+        mtime, size, sha1 = self._stamps[key]
+        if file_fingerprint(key[0]) == (mtime, size):
+            return False
+        return file_hash(key[0]) != sha1
+
+    def _drop(self, key):
+        wb = self._books.pop(key, None)
+        self._stamps.pop(key, None)
+        if wb is not None:
+            try:
+                wb.close()
+            except Exception:
+                pass
+
+
+def file_locked(path):
+    """True while another process holds path open for writing (Excel's share lock)"""
+    try:
+        with open(path, 'r+b'):
+            return False
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return True
+
+
+def excel_pid(app):
+    """PID of the Excel process behind a win32com Excel.Application"""
+    import win32process  # Windows only, imported when Excel is needed
+
+    return win32process.GetWindowThreadProcessId(app.Hwnd)[1]
+
+
+class ExcelProcesses:
+    """Lifecycle of the Excel processes this script starts.
+
+    track() takes ownership of the PID of an instance this script created
+    (DispatchEx and xlwings always start a new process), spawn() of the
+    PIDs that appear while start() runs. shutdown() waits for exactly
+    those with psutil.wait_procs, escalating from waiting to terminate to
+    kill with bounded timeouts, then polls until the workbooks are no
+    longer locked. Excel instances the user opened are never touched.
+    names can be any process names,
+    e.g. a stand-in python process when testing on Linux.
+    """
+
+    def __init__(self, names=('excel.exe', 'xlview.exe'), grace=5.0, timeout=5.0):
+        self.names = {n.lower() for n in names}
+        self.grace = grace  # Time given to a process to exit on its own after Quit()
+        self.timeout = timeout  # Time allowed after terminate and after kill
+        self.owned = {}  # pid -> psutil.Process
+        self.calls = 0
+        self.dead_time = 0.0
+
+    def running(self):
+        """{pid: process} of the matching processes currently running"""
+        found = {}
+        for proc in psutil.process_iter(['name']):
+            try:
+                if (proc.info['name'] or '').lower() in self.names:
+                    found[proc.pid] = proc
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+        return found
+
+    def spawn(self, start):
+        """Call start() and take ownership of the processes it launched"""
+        before = set(self.running())
+        result = start()
+        new = {pid: proc for pid, proc in self.running().items() if pid not in before}
+        self.owned.update(new)
+        if new:
+            logger.info(f"Started Excel process(es): {sorted(new)}")
+        return result
+
+    def track(self, pid):
+        """Take ownership of a process started elsewhere"""
+        self.owned[pid] = psutil.Process(pid)
+
+    def shutdown(self, paths=()):
+        """Stop the owned processes and wait until paths are unlocked.
+
+        Returns the time spent, which is also added to dead_time.
+        """
+        start = time.perf_counter()
+        self.calls += 1
+        procs = list(self.owned.values())
+        stopped = 0
+        if procs:
+            _, alive = psutil.wait_procs(procs, timeout=self.grace)
+            for action in ('terminate', 'kill'):
+                if not alive:
+                    break
+                for proc in alive:
+                    try:
+                        getattr(proc, action)()
+                    except psutil.NoSuchProcess:
+                        pass
+                _, alive = psutil.wait_procs(alive, timeout=self.timeout)
+            for proc in alive:
+                logger.warning(f"Excel process {proc.pid} still running after kill")
+            stopped = len(procs) - len(alive)
+            self.owned = {proc.pid: proc for proc in alive}
+        locked = self.wait_unlocked(paths)
+        elapsed = time.perf_counter() - start
+        self.dead_time += elapsed
+        logger.info(f"Excel shutdown: {stopped} process(es) stopped in {elapsed * 1000:.0f} ms"
+                    f"{f', still locked: {locked}' if locked else ''} "
+                    f"(dead time {self.dead_time:.2f}s over {self.calls} calls)")
+        return elapsed
+
+    def wait_unlocked(self, paths, interval=0.01, max_interval=0.2):
+        """Poll until no path is locked or timeout passes, returns the ones still locked"""
+        deadline = time.perf_counter() + self.timeout
+        locked = [p for p in paths if file_locked(p)]
+        while locked and time.perf_counter() < deadline:
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
+            locked = [p for p in locked if file_locked(p)]
+        return locked
+
+
+class ComCounter:
+    """Counts COM round-trips made through wrapped Excel objects.
+
+    Every property read or write, method lookup and collection item
+    counts as one call. Objects returned by a wrapped object are wrapped
+    as well; arguments are unwrapped before they reach COM.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def wrap(self, obj):
+        if isinstance(obj, _ComProxy) or obj is None or isinstance(obj, (str, int, float, bool, tuple)):
+            return obj
+        return _ComProxy(obj, self)
+
+
+def _unwrap(value):
+    return object.__getattribute__(value, '_obj') if isinstance(value, _ComProxy) else value
+
+
+def _is_com(obj):
+    return hasattr(obj, '_oleobj_') or type(obj).__module__.startswith('xlwings')
+
+
+class _ComProxy:
+    __slots__ = ('_obj', '_counter')
+
+    def __init__(self, obj, counter):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_counter', counter)
+
+    def _result(self, value):
+        return self._counter.wrap(value) if _is_com(value) or callable(value) else value
+
+    def __getattr__(self, name):
+        self._counter.calls += 1
+        return self._result(getattr(self._obj, name))
+
+    def __setattr__(self, name, value):
+        self._counter.calls += 1
+        setattr(self._obj, name, _unwrap(value))
+
+    def __call__(self, *args, **kwargs):
+        args = [_unwrap(a) for a in args]
+        kwargs = {k: _unwrap(v) for k, v in kwargs.items()}
+        return self._result(self._obj(*args, **kwargs))
+
+    def __iter__(self):
+        for item in self._obj:
+            self._counter.calls += 1
+            yield self._result(item)
+
+
+class RunReport:
+    """Wall time, CPU time, peak RSS, I/O, workbook loads/saves and COM
+    calls per instrumented step of one run.
+
+    write() stores the run as JSON and appends one row per step to a CSV
+    history shared by all runs.
+    """
+
+    FIELDS = ['run_id', 'step', 'depth', 'started', 'ok', 'wall_s', 'cpu_s', 'peak_rss_mb',
+              'read_bytes', 'write_bytes', 'workbook_loads', 'workbook_saves', 'com_calls']
+
+    def __init__(self, session=None, sample_interval=0.05):
+        self.session = session
+        self.com = ComCounter()
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.steps = []
+        self._process = psutil.Process()
+        self._active = []
+        self._interval = sample_interval
+        self._sampler = None
+        self._start = time.perf_counter()
+
+    def _io(self):
+        try:
+            io = self._process.io_counters()
+        except (AttributeError, psutil.AccessDenied):
+            return 0, 0
+        # read_chars/write_chars (Linux) include cached I/O, read_bytes only disk I/O
+        return getattr(io, 'read_chars', io.read_bytes), getattr(io, 'write_chars', io.write_bytes)
+
+    def _cpu(self):
+        t = self._process.cpu_times()
+        return t.user + t.system + getattr(t, 'children_user', 0) + getattr(t, 'children_system', 0)
+
+    def _sample(self):
+        while self._active:
+            rss = self._process.memory_info().rss
+            for record in list(self._active):
+                record['_peak'] = max(record['_peak'], rss)
+            time.sleep(self._interval)
+        self._sampler = None
+
+    @contextmanager
+    def measure(self, step):
+        rss = self._process.memory_info().rss
+        read, written = self._io()
+        record = {
+            'run_id': self.run_id, 'step': step, 'depth': len(self._active),
+            'started': datetime.now().isoformat(timespec='seconds'), 'ok': False, '_peak': rss,
+        }
+        loads = self.session.loads if self.session else 0
+        saves = self.session.saves if self.session else 0
+        com, cpu, wall = self.com.calls, self._cpu(), time.perf_counter()
+        self._active.append(record)
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        try:
+            yield record
+            record['ok'] = True
+        finally:
+            self._active.remove(record)
+            end_read, end_written = self._io()
+            record.update({
+                'wall_s': round(time.perf_counter() - wall, 4),
+                'cpu_s': round(self._cpu() - cpu, 4),
+                'peak_rss_mb': round(max(record.pop('_peak'), self._process.memory_info().rss) / 2 ** 20, 1),
+                'read_bytes': end_read - read,
+                'write_bytes': end_written - written,
+                'workbook_loads': (self.session.loads if self.session else 0) - loads,
+                'workbook_saves': (self.session.saves if self.session else 0) - saves,
+                'com_calls': self.com.calls - com,
+            })
+            self.steps.append(record)
+            logger.info(f"[report] {step}: {record['wall_s']:.2f}s wall, {record['cpu_s']:.2f}s CPU, "
+                        f"peak {record['peak_rss_mb']} MB, {record['workbook_loads']} loads, "
+                        f"{record['workbook_saves']} saves, {record['com_calls']} COM calls")
+
+    def write(self, folder, history_name="run_history.csv"):
+        """Write run_<id>.json and append the steps to the CSV history"""
+        os.makedirs(folder, exist_ok=True)
+        report = {
+            'run_id': self.run_id,
+            'wall_s': round(time.perf_counter() - self._start, 4),
+            'steps': self.steps,
+        }
+        json_path = os.path.join(folder, f"run_{self.run_id}.json")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        history = os.path.join(folder, history_name)
+        new_file = not os.path.exists(history)
+        with open(history, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS, extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            writer.writerows(self.steps)
+        logger.info(f"Run report written to {json_path}, history appended to {history}")
+        return json_path
+
+
+def instrumented(method):
+    """Measure an ExcelAutomation method in the run report"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.report.measure(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+XL_UP = -4162  # xlUp
+
+
+def com_rows(value):
+    """Range.Value as a list of row lists (COM returns a scalar for one cell)"""
+    if value is None or not isinstance(value, (tuple, list)):
+        return [[value]]
+    return [list(row) if isinstance(row, (tuple, list)) else [row] for row in value]
+
+
+def last_used_row(sheet, column):
+    """Equivalent of Cells(Rows.Count, column).End(xlUp).Row"""
+    return sheet.Cells(sheet.Rows.Count, column).End(XL_UP).Row
+
+
+def read_izbor_blocks(izbor_sheet):
+    """Header and rows of izbor F:M plus their AA keys, in two COM calls"""
+    last_row = last_used_row(izbor_sheet, "F")
+    data = com_rows(izbor_sheet.Range(f"F1:M{last_row}").Value)
+    keys = [row[0] for row in com_rows(izbor_sheet.Range(f"AA1:AA{last_row}").Value)]
+    return data[0], list(zip(keys[1:], data[1:]))
+
+
+def group_izbor_rows(keyed_rows):
+    """{AA value: [F:M rows]} in sheet order"""
+    groups = {}
+    for key, row in keyed_rows:
+        groups.setdefault(key, []).append(row)
+    return groups
+
+
+def write_list2_block(list2_sheet, header, rows):
+    """Replace List2 T:AA with header + rows using one Range.Value assignment"""
+    last_row = last_used_row(list2_sheet, "T")
+    list2_sheet.Range(f"T2:AA{max(last_row, 2)}").ClearContents()
+    block = [header] + rows
+    list2_sheet.Range(f"T1:AA{len(block)}").Value = [tuple(row) for row in block]
+
+
+def plan_row_heights(anchors, first_row, last_row, default=16.5):
+    """Row heights worked out from (row, height) image anchors.
+
+    Rows first_row to last_row without an image get default. A row with an
+    image anchored in it takes the height of the last image placed there;
+    images that were already on the sheet (height None) leave their row's
+    height as it is (None). Rows of placed images outside the range are
+    included as well.
+    """
+    heights = {row: default for row in range(first_row, last_row + 1)}
+    for row, height in anchors:
+        if height is None and row in heights:
+            heights[row] = None
+    for row, height in anchors:
+        if height is not None:
+            heights[row] = height
+    return heights
+
+
+def row_height_runs(heights):
+    """[(first row, last row, height)] runs of consecutive rows with the same height, None skipped"""
+    runs = []
+    for row in sorted(heights):
+        height = heights[row]
+        if height is None:
+            continue
+        if runs and runs[-1][1] == row - 1 and runs[-1][2] == height:
+            runs[-1] = (runs[-1][0], row, height)
+        else:
+            runs.append((row, row, height))
+    return runs
+
+
+class ShapeIndex:
+    """Shape anchors and column labels of a sheet, read once over COM.
+
+    Deletions, image target rows and row heights are worked out in Python
+    from this snapshot and written back in batches, instead of walking
+    Shapes again for every row. Only Shapes, Cells, Range and Rows of the
+    sheet are used, so an in-memory fake sheet can stand in for Excel.
+    """
+
+    def __init__(self, sheet, label_column="A"):
+        self.sheet = sheet
+        # (row, column, height) of each shape in Shapes order, height only for images placed by this run
+        self.anchors = []
+        for shape in sheet.Shapes:
+            cell = shape.TopLeftCell
+            self.anchors.append((cell.Row, cell.Column, None))
+        last_row = last_used_row(sheet, label_column)
+        self.label_rows = {}  # label -> first row it appears in
+        for row, values in enumerate(com_rows(sheet.Range(f"{label_column}1:{label_column}{last_row}").Value), 1):
+            self.label_rows.setdefault(values[0], row)
+
+    def delete_in(self, min_row, min_col, max_row, max_col):
+        """Delete the shapes anchored inside the range in one Shapes.Range call"""
+        doomed = [i for i, (row, col, _) in enumerate(self.anchors, 1)
+                  if min_row <= row <= max_row and min_col <= col <= max_col]
+        if doomed:
+            self.sheet.Shapes.Range(doomed).Delete()
+            self.anchors = [anchor for i, anchor in enumerate(self.anchors, 1) if i not in set(doomed)]
+        return len(doomed)
+
+    def target_row(self, text):
+        """Row below the first label equal to text, None if there is none"""
+        row = self.label_rows.get(text)
+        return None if row is None else row + 1
+
+    def placed(self, row, column, height):
+        """Record an image pasted with its top-left corner at (row, column)"""
+        self.anchors.append((row, column, height))
+
+    def row_heights(self, first_row, last_row, default=16.5):
+        """Planned heights, see plan_row_heights()"""
+        return plan_row_heights([(row, height) for row, _, height in self.anchors], first_row, last_row, default)
+
+    def apply_row_heights(self, heights):
+        """Write heights with one RowHeight assignment per run of equal rows, returns the run count"""
+        runs = row_height_runs(heights)
+        for first, last, height in runs:
+            self.sheet.Rows(f"{first}:{last}").RowHeight = height
+        return len(runs)
+
+
+def parse_amounts(values):
+    """Parse numbers and currency or locale formatted text to floats in one vectorized pass.
+
+    '1.234,50 €', '€ 60', '12,5', '1,234.5' and '(12,5)' all parse: the
+    separator that comes last is the decimal one unless it repeats. Values
+    that are not numbers become NaN.
+    """
+    s = pd.Series(values, dtype=object)
+    is_text = s.map(lambda v: isinstance(v, str)).astype(bool)
+    is_number = s.map(lambda v: isinstance(v, (int, float, np.number))).astype(bool)
+    out = pd.Series(np.nan, index=s.index)
+    out[is_number] = s[is_number].astype(float)
+
+    text = s[is_text].astype(str).str.replace(r'[€$£\s ]|EUR', '', regex=True)
+    text = text.str.replace(r'^\((.*)\)$', r'-\1', regex=True)
+    decimal_comma = (text.str.rfind(',') > text.str.rfind('.')) & text.str.count(',').eq(1)
+    text = text.where(~decimal_comma, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    text = text.where(decimal_comma, text.str.replace(',', '', regex=False))
+    text = text.where(text.str.count(r'\.').le(1), text.str.replace('.', '', regex=False))
+    out[is_text] = pd.to_numeric(text, errors='coerce')
+    return out
+
+
+RULE_OPS = {'>': 'gt', '>=': 'ge', '<': 'lt', '<=': 'le'}
+
+
+def analyze_rows(frame, rules, key='A', required=('A', 'L'), rank=None):
+    """Flag the rows of frame that match any of rules, vectorized.
+
+    frame holds raw cell values indexed by sheet row, with column letters
+    as columns. Rows with an empty required column are skipped, and like
+    the old step 6 loop a falsy key (0, False) counts as empty. Each rule
+    is a dict with column and threshold, and optionally name, op ('>',
+    '>=', '<', '<=', default '>') and by: when threshold is a mapping
+    {value: limit}, the column whose value picks the limit (default key),
+    with '*' for all other values. Returns a DataFrame of the flagged rows
+    with the key text, each rule's parsed value and limit and the matched
+    rule names, in sheet order or by descending value of the rank column.
+    """
+    present = pd.Series(True, index=frame.index)
+    for col in required:
+        if col == key:
+            present &= frame[col].map(lambda v: not pd.isna(v) and bool(v)).astype(bool)
+        else:
+            present &= frame[col].notna() & frame[col].ne('')
+
+    result = pd.DataFrame({'text': frame[key].astype(str)}, index=frame.index)
+    matched = pd.DataFrame(index=frame.index)
+    for rule in rules:
+        name = rule.get('name', rule['column'])
+        values = parse_amounts(frame[rule['column']])
+        limit = rule['threshold']
+        if isinstance(limit, dict):
+            by = frame[rule.get('by', key)].astype(str).str.strip()
+            limit = by.map({str(k): v for k, v in limit.items()}).astype(float).fillna(limit.get('*', np.nan))
+        else:
+            limit = pd.Series(float(limit), index=frame.index)
+        result[name], result[f'{name}_limit'] = values, limit
+        # Comparisons with NaN are False, so unparsable values never match
+        matched[name] = getattr(values, RULE_OPS[rule.get('op', '>')])(limit)
+
+    flagged = present & matched.any(axis=1)
+    result = result[flagged]
+    result['rules'] = [', '.join(matched.columns[hits]) for hits in matched[flagged].to_numpy()]
+    if rank is not None:
+        order = parse_amounts(frame.loc[result.index, rank]).sort_values(ascending=False, kind='stable')
+        result = result.loc[order.index]
+    result.index.name = 'row'
+    return result
+
+
+class ExcelAutomation:
+    def __init__(self, folder="."):
+        self.pregled_file = os.path.abspath(os.path.join(folder, '43.xls'))
+        self.porocanje_file = os.path.abspath(os.path.join(folder, "poročanje proizvodnje2025.xlsm"))
+        self.plan_file = os.path.abspath(os.path.join(folder, "plan brizganja 2025 mesečni.xlsx"))
+
+        # Shared workbook cache, each file is parsed once per run
+        self.session = WorkbookSession()
+        # Persistent date -> column index of the row-4 headers
+        self.header_index = HeaderIndex()
+        # Parsed Pregled exports, keyed by content
+        self.pregled_cache = SnapshotCache(os.path.join(os.path.dirname(self.pregled_file), '.pregled_cache'))
+        # (plan fingerprint, column, block) streamed by step 3 for step 4
+        self._plan_block = None
+        # (sheet, min row, min col, max row, max col) written by steps 2 and 5
+        self.written_ranges = []
+        # In-process formula results, set by recalc_python()
+        self.engine = None
+        # Rows flagged by step 6 with their values and limits
+        self.analysis = None
+        # Excel processes started by this run
+        self.excel = ExcelProcesses()
+        # Per-step measurements of this run
+        self.report = RunReport(self.session)
 
         # Validate files exist
         self._validate_files()
@@ -30,17 +1796,22 @@ class ExcelAutomation:
             if not os.path.exists(file):
                 raise FileNotFoundError(f"File not found: {file}")
         
+    @instrumented
     def step1_copy_pregled_data(self):
         """Step 1: Copy data from Pregled.xls"""
         logger.info("Step 1: Copying data from Pregled.xls")
         
         try:
-            # Read Pregled.xls
-            try:
-                df = pd.read_excel(self.pregled_file, sheet_name="Sheet1", engine='xlrd')
-            except ImportError:
-                df = pd.read_excel(self.pregled_file, sheet_name="Sheet1", engine='openpyxl')
-            
+            # Unchanged exports come from the columnar snapshot
+            df = self.pregled_cache.load(self.pregled_file)
+            if df is None:
+                # Read Pregled.xls
+                try:
+                    df = pd.read_excel(self.pregled_file, sheet_name="Sheet1", engine='xlrd')
+                except ImportError:
+                    df = pd.read_excel(self.pregled_file, sheet_name="Sheet1", engine='openpyxl')
+                self.pregled_cache.store(self.pregled_file, df)
+
             logger.info(f"Successfully read Pregled.xls with {len(df)} rows")
             return df
             
@@ -48,42 +1819,50 @@ class ExcelAutomation:
             logger.error(f"Error reading Pregled.xls: {e}")
             raise
     
-    def step2_paste_to_porocanje(self, data_df):
-        """Step 2: Paste data into poročanje proizvodnje2025.xlsm sheet 'prilepi gosoft' using openpyxl (safe for macros)"""
+    @instrumented
+    def step2_paste_to_porocanje(self, data_df, incremental=True):
+        """Step 2: Paste data into poročanje proizvodnje2025.xlsm sheet 'prilepi gosoft' using openpyxl (safe for macros)
+
+        With incremental=True only the rows that changed since the last paste
+        are rewritten; a schema change falls back to a full rewrite.
+        """
         logger.info("Step 2: Pasting data into poročanje proizvodnje2025.xlsm (safe method)")
         try:
-            from openpyxl import load_workbook
-
-            # Load the workbook with macros preserved
-            wb = load_workbook(self.porocanje_file, keep_vba=True)
-            if 'prilepi gosoft' not in wb.sheetnames:
+            # Old extent from the sheet XML, the workbook itself is not loaded
+            try:
+                old_extent = sheet_dimension(self.porocanje_file, 'prilepi gosoft')
+            except KeyError:
+                old_extent = None
+                wb = self.session.get(self.porocanje_file)
+            else:
+                if old_extent is None:  # No <dimension>, count the loaded cells
+                    ws = self.session.get(self.porocanje_file)['prilepi gosoft']
+                    old_extent = ws.max_row, ws.max_column
+            old_rows, old_cols = old_extent or (0, 0)
+            self.written_ranges.append(('prilepi gosoft', 1, 1, max(len(data_df) + 1, old_rows),
+                                        max(data_df.shape[1], old_cols)))
+            if old_extent is None:
+                # New sheet has no XML part to patch yet, append whole rows via openpyxl
                 ws = wb.create_sheet('prilepi gosoft')
+                ws.append(list(data_df.columns))
+                for row in data_df.astype(object).where(data_df.notna(), None).values.tolist():
+                    ws.append(row)
+                self.session.mark_dirty(self.porocanje_file)
+                RowFingerprint(self.porocanje_file, 'prilepi gosoft').clear()
             else:
-                ws = wb['prilepi gosoft']
-            
-            # Clear the sheet
-            ws.delete_rows(1, ws.max_row)
+                # The sheet XML itself is rewritten in bulk from the DataFrame by flush()
+                self.session.replace_sheet_data(self.porocanje_file, 'prilepi gosoft', data_df, incremental)
 
-            # Write headers
-            for c_idx, col_name in enumerate(data_df.columns, 1):
-                ws.cell(row=1, column=c_idx, value=col_name)
-
-            # Write DataFrame to sheet
-            for r_idx, row in enumerate(data_df.values, 2):
-                for c_idx, value in enumerate(row, 1):
-                    ws.cell(row=r_idx, column=c_idx, value=value)
-
-            wb.save(self.porocanje_file)
-            wb.close()
             logger.info(f"Successfully pasted {len(data_df)} rows to 'prilepi gosoft' sheet (safe method)")
             return True
         except Exception as e:
             logger.error(f"Error pasting data to poročanje proizvodnje2025.xlsm (safe method): {e}")
             raise
     
-    def get_target_date(self) -> datetime:
+    @staticmethod
+    def get_target_date(today=None) -> datetime:
         """Get the target date based on the rules"""
-        today = datetime.now()
+        today = today or datetime.now()
         if today.weekday() == 0:  # Monday
             # Go back to Friday
             target_date = today - timedelta(days=3)
@@ -92,6 +1871,81 @@ class ExcelAutomation:
             target_date = today - timedelta(days=1)
         return target_date
 
+    @staticmethod
+    def brizganje_date(plan_date):
+        """Date whose 'brizganje izračun' column receives the plan block of plan_date
+
+        The working day before the plan date: Friday for a Monday, else the day before.
+        """
+        return plan_date - timedelta(days=3 if plan_date.weekday() == 0 else 1)
+
+    def paste_plan_block(self, paste_col, copied_data):
+        """Clear and fill the block of 'brizganje izračun' starting at row 4 of paste_col
+
+        The ~120 cells are patched into the sheet XML by the next flush()
+        instead of a full openpyxl save of the workbook.
+        """
+        self.written_ranges.append(("brizganje izračun", 4, paste_col, 4 + len(copied_data), paste_col + 2))
+        logger.info(f"Pasting values into column {paste_col}")
+
+        # Clear the target range
+        cells = {(r, c): None for r in range(4, 5 + len(copied_data)) for c in range(paste_col, paste_col + 3)}
+
+        # Paste copied_data into brizganje izracun sheet
+        start_row = 4  # Assuming we start from row 4 (just like when copying)
+        for i, row_data in enumerate(copied_data):
+            for j, value in enumerate(row_data):
+                cells[(start_row + i, paste_col + j)] = value
+        self.session.patch_cells(self.porocanje_file, "brizganje izračun", cells)
+
+    @instrumented
+    def backfill(self, start_date, end_date):
+        """Steps 3-5 for every plan date from start_date to end_date in one pass.
+
+        All target columns are resolved at once, the fixed plan blocks are
+        read in one pass over the plan and patched into the poročanje sheet
+        XML at once by the next flush(). Days that are
+        not fixed yet or have no column are skipped and reported. Returns
+        {'pasted': [...], 'not_fixed': [...], 'not_found': [...]} of dates.
+        """
+        logger.info(f"Backfill: plan dates {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}")
+        try:
+            report = {'pasted': [], 'not_fixed': [], 'not_found': []}
+            dates = [d.date() for d in pd.date_range(start_date, end_date, freq='D')]
+            plan_columns = self.header_index.columns(self.plan_file, "plan")
+
+            wb = self.session.get(self.porocanje_file)
+            ws = wb["brizganje izračun"]
+            header = [cell.value for cell in ws[4]]
+            brizganje_columns = self.header_index.columns(self.porocanje_file, "brizganje izračun", header)
+
+            targets = {}
+            for day in dates:
+                plan_col = plan_columns.get(day)
+                paste_col = brizganje_columns.get(self.brizganje_date(day))
+                if plan_col is None or paste_col is None:
+                    report['not_found'].append(day)
+                else:
+                    targets[day] = (plan_col, paste_col - 1)
+
+            blocks = read_plan_blocks(self.plan_file, [plan_col for plan_col, _ in targets.values()])
+            for day, (plan_col, paste_col) in targets.items():
+                status, block = blocks[plan_col]
+                if status != "Fiksno":
+                    report['not_fixed'].append(day)
+                    continue
+                self.paste_plan_block(paste_col, block)
+                report['pasted'].append(day)
+
+            for key, days in report.items():
+                logger.info(f"Backfill {key}: {', '.join(f'{d:%Y-%m-%d}' for d in days) or '-'}")
+            return report
+
+        except Exception as e:
+            logger.error(f"Error in backfill: {e}")
+            raise
+
+    @instrumented
     def step3_find_date_in_plan(self):
         """Step 3: Find the correct date in plan sheet"""
         logger.info("Step 3: Finding date in plan sheet")
@@ -100,64 +1954,49 @@ class ExcelAutomation:
         logger.info(f"Looking for date: {target_date.strftime('%Y-%m-%d')}")
         
         try:
-            wb = load_workbook(self.plan_file, data_only=True)
-            ws = wb["plan"]
-            
-            # Check row 4 for dates
-            date_found = False
-            target_col = None
-            
-            for col in range(1, ws.max_column + 1):
-                cell_value = ws.cell(row=4, column=col).value
-                if cell_value:
-                    # Try to parse as date
-                    if isinstance(cell_value, datetime):
-                        cell_date = cell_value.date()
-                    else:
-                        try:
-                            cell_date = pd.to_datetime(cell_value).date()
-                        except:
-                            continue
-                    
-                    if cell_date == target_date.date():
-                        target_col = col
-                        date_found = True
-                        logger.info(f"Found target date at column {col}")
-
-                        # Check if the cell below contains "Fiksno"
-                        fiksno_cell = ws.cell(row=5, column=col).value
-                        if fiksno_cell == "Fiksno":
-                            logger.info("Found 'Fiksno' below the target date")
-                        else:
-                            raise ValueError("Plan is not fixed yet")
-                        
-                        break
-        
-            if not date_found:
+            plan_hash = file_hash(self.plan_file)
+            columns = self.header_index.fresh_columns(self.plan_file, "plan", plan_hash)
+            if columns is not None:
+                # Index is current, read only the bounded block below the date
+                target_col = columns.get(target_date.date())
+                fiksno_cell, block = None, None
+                if target_col is not None:
+                    rows = read_plan_range(self.plan_file, target_col, first_row=5)
+                    fiksno_cell, block = rows[0][0], rows[1:]
+            else:
+                # One streaming pass refreshes the index and keeps the block for step 4
+                def locate(header):
+                    return self.header_index.update(self.plan_file, "plan", header, plan_hash).get(target_date.date())
+                target_col, fiksno_cell, block = stream_plan_block(self.plan_file, locate)
+
+            if target_col is None:
                 raise ValueError(f"Target date {target_date.strftime('%Y-%m-%d')} not found in row 4")
-            
+            logger.info(f"Found target date at column {target_col}")
+
+            # Check if the cell below contains "Fiksno"
+            if fiksno_cell == "Fiksno":
+                logger.info("Found 'Fiksno' below the target date")
+            else:
+                raise ValueError("Plan is not fixed yet")
+
+            self._plan_block = (file_fingerprint(self.plan_file), target_col, block)
             return target_col
             
         except Exception as e:
             logger.error(f"Error finding date in plan: {e}")
             raise
 
+    @instrumented
     def step4_copy_plan_range(self, start_col):
         """Step 4: Copy range from plan sheet"""
         logger.info(f"Step 4: Copying range from column {start_col}")
 
         try:
-            wb = load_workbook(self.plan_file, data_only=True)  # Use data_only=True to get values
-            ws = wb["plan"]
-
-            copied_data = []  # Will store list of rows, each row is a list of 3 cell values
-
-            for row in range(6, 45):  # Rows 6 to 44 inclusive
-                row_data = []
-                for col_offset in range(3):  # Copy 3 columns: start_col, start_col+1, start_col+2
-                    cell = ws.cell(row=row, column=start_col + col_offset)
-                    row_data.append(cell.value)  # This will get the calculated value, not the formula
-                copied_data.append(row_data)
+            cached = self._plan_block
+            if cached and cached[:2] == (file_fingerprint(self.plan_file), start_col):
+                copied_data = cached[2]  # Already read by step 3
+            else:
+                copied_data = read_plan_range(self.plan_file, start_col)
 
             logger.info(f"Copied range from column {start_col} to {start_col+2}, rows 6 to 44")
             return copied_data
@@ -166,67 +2005,30 @@ class ExcelAutomation:
             logger.error(f"Error copying plan range: {e}")
             raise
     
+    @instrumented
     def step5_paste_to_brizganje(self, copied_data):
         logger.info("Step 5: Pasting data into 'brizganje izračun' sheet")
         try:
             # Kill any existing Excel processes
             self.kill_excel_processes()
 
-            # Load workbook
-            wb = load_workbook(self.porocanje_file, keep_vba=True)
+            # Same workbook object as step 2
+            wb = self.session.get(self.porocanje_file)
             ws = wb["brizganje izračun"]
 
-            # Get the target date
-            """Get the target date based on the rules"""
-            today = datetime.now()
-            if today.weekday() == 0 or today.weekday() == 1:  # Monday or Tuesday
-                # Go back to Thursday or Friday
-                target_date = today - timedelta(days=4)
-            else:
-                # Go back to yesterday
-                target_date = today - timedelta(days=2)
+            # The day before the plan date of step 3 (Thursday or Friday on Monday/Tuesday)
+            target_date = self.brizganje_date(self.get_target_date())
             logger.info(f"Looking for date: {target_date.strftime('%Y-%m-%d')}")
 
-            # Search row 4, starting from column D (index 4)
-            target_col = None
-            for col in range(1, ws.max_column + 1):
-                cell_value = ws.cell(row=4, column=col).value
-                if cell_value:
-                    if isinstance(cell_value, datetime):
-                        cell_date = cell_value.date()
-                    else:
-                        try:
-                            cell_date = pd.to_datetime(cell_value).date()
-                        except:
-                            continue
-
-                    if cell_date == target_date.date():
-                        target_col = col
-                        logger.info(f"Found target date in column {col}")
-                        break
-
+            # Look up the date in row 4 through the header index
+            header = [cell.value for cell in ws[4]]
+            target_col = self.header_index.lookup(self.porocanje_file, "brizganje izračun", target_date, header)
             if target_col is None:
                 raise ValueError(f"Target date {target_date.strftime('%Y-%m-%d')} not found in row 4")
+            logger.info(f"Found target date in column {target_col}")
 
-            paste_col = target_col - 1  # One column to the left
-
-            logger.info(f"Pasting values into column {paste_col}")
-
-            # Clear the target range
-            clear_range = ws[f"{ws.cell(row=4, column=paste_col).column_letter}4:{ws.cell(row=4+len(copied_data), column=paste_col+2).column_letter}{4+len(copied_data)}"]
-            for row in clear_range:
-                for cell in row:
-                    cell.value = None
-
-            # Paste copied_data into brizganje izracun sheet
-            start_row = 4  # Assuming we start from row 4 (just like when copying)
-            for i, row_data in enumerate(copied_data):
-                for j, value in enumerate(row_data):
-                    ws.cell(row=start_row + i, column=paste_col + j, value=value)
-                    
-            # Save the workbook
-            wb.save(self.porocanje_file)
-            wb.close()
+            # Patched into the sheet XML by flush(), after step 2's writes
+            self.paste_plan_block(target_col - 1, copied_data)  # One column to the left
             logger.info("Successfully pasted values to 'brizganje izračun' sheet")
             return  # If successful, exit the function
 
@@ -234,41 +2036,65 @@ class ExcelAutomation:
             logger.error(f"Error in Step 5: {e}")
             raise
 
+    # Step 6 rules, see analyze_rows(): a row is flagged when any rule matches
+    STEP6_RULES = [{'name': 'loss', 'column': 'M', 'op': '>', 'threshold': 50}]
+    STEP6_KEY = 'A'  # Text saved for a flagged row (machine or product)
+    STEP6_REQUIRED = ('A', 'L')  # Rows with any of these empty are skipped
+    STEP6_RANK = None  # Sheet order, or a column to rank flagged rows by its descending value
+    # First and last row analyzed, None as last row for the whole sheet. Step 7
+    # manages the images of rows 7 to 44, so the default stays on that table.
+    STEP6_ROWS = (7, 46)
+
+    def step6_columns(self):
+        """Column letters step 6 reads: key, required, rule and rank columns"""
+        columns = {self.STEP6_KEY, *self.STEP6_REQUIRED}
+        columns.update(rule['column'] for rule in self.STEP6_RULES)
+        columns.update(rule.get('by', self.STEP6_KEY) for rule in self.STEP6_RULES)
+        if self.STEP6_RANK is not None:
+            columns.add(self.STEP6_RANK)
+        return sorted(columns, key=column_index_from_string)
+
+    def step6_cells(self, engine):
+        """(sheet, row, column) of every cell step 6 reads, evaluated eagerly by recalc_python()"""
+        sheet = "brizganje izračun"
+        first_row, last_row = self.STEP6_ROWS
+        last_row = last_row or engine.extent(sheet)[0]
+        indexes = [column_index_from_string(col) for col in self.step6_columns()]
+        return [(sheet, r, c) for r in range(first_row, last_row + 1) for c in indexes]
+
+    def step6_frame(self, columns):
+        """Raw values of columns (letters) of 'brizganje izračun' over STEP6_ROWS, one row per sheet row"""
+        sheet = "brizganje izračun"
+        first_row, last_row = self.STEP6_ROWS
+        indexes = [column_index_from_string(col) for col in columns]
+        if self.engine is not None:
+            # Formula results computed in-process by recalc_python()
+            last_row = last_row or self.engine.extent(sheet)[0]
+            rows = [[self.engine.value(sheet, r, c) for c in indexes] for r in range(first_row, last_row + 1)]
+        else:
+            # Workbook with formula results, read in one pass over the columns' span
+            ws = self.session.get(self.porocanje_file, data_only=True)[sheet]
+            last_row = last_row or ws.max_row
+            lo = min(indexes)
+            rows = [[row[c - lo] for c in indexes] for row in
+                    ws.iter_rows(min_row=first_row, max_row=last_row, min_col=lo, max_col=max(indexes), values_only=True)]
+        return pd.DataFrame(rows, index=range(first_row, first_row + len(rows)), columns=columns, dtype=object)
+
+    @instrumented
     def step6_analyze_brizganje(self):
         try:
-            logger.info("Step 6: Analyzing rows 7 to 46 in 'brizganje izračun'")
+            first_row, last_row = self.STEP6_ROWS
+            logger.info(f"Step 6: Analyzing rows {first_row} to {last_row or 'end'} in 'brizganje izračun'")
 
-            # Load workbook with formula results
-            wb = load_workbook(self.porocanje_file, data_only=True)
-            ws = wb["brizganje izračun"]
-
-            saved_texts = []
-            
-            logger.setLevel(logging.DEBUG)
-            for row in range(7, 47): # Rows 7 to 46 inclusive
-                cell_a = ws.cell(row=row, column=1).value  # Column A
-                if not cell_a:
-                    continue  # Skip if column A is empty
-
-                cell_l = ws.cell(row=row, column=12).value  # Column L (12)
-                if cell_l in (None, ""):
-                    continue  # Skip if column L is empty or zero
-
-                cell_m = ws.cell(row=row, column=13).value  # Column M (13)
-                # Try converting to float if possible
-                try:
-                    if isinstance(cell_m, str):
-                        # Remove euro sign and replace comma with dot, if needed
-                        cleaned = cell_m.replace("€", "").replace(",", ".").strip()
-                        value_m = float(cleaned)
-                    else:
-                        value_m = float(cell_m)
-                except (TypeError, ValueError):
-                    continue  # Skip if not a number
+            frame = self.step6_frame(self.step6_columns())
 
-                if value_m > 50:
-                    saved_texts.append(str(cell_a))  # Save value from column A
+            result = analyze_rows(frame, self.STEP6_RULES, self.STEP6_KEY, self.STEP6_REQUIRED, self.STEP6_RANK)
+            self.analysis = result
+            logger.info(f"Flagged {len(result)} of {len(frame)} rows")
+            if len(result):
+                logger.info(f"Step 6 results:\n{result.to_string()}")
 
+            saved_texts = result['text'].tolist()
             logger.info(f"Saved texts: {saved_texts}")
             return saved_texts
 
@@ -276,16 +2102,58 @@ class ExcelAutomation:
             logger.error(f"Error in Step 6: {e}")
             raise
 
+    @instrumented
+    def recalc(self, full=False):
+        """Recalculate the workbook, in-process when its formulas allow it"""
+        try:
+            self.recalc_python(full)
+        except UnsupportedFormula as e:
+            logger.warning(f"In-process recalculation not possible ({e}), falling back to Excel")
+            self.engine = None
+            self.recalc_excel()
+
+    @instrumented
+    def recalc_python(self, full=False):
+        """Recompute the formulas downstream of steps 2 and 5 without Excel
+
+        Only the cells step 6 reads (step6_cells()) and the stale formulas
+        they depend on are evaluated, so an unsupported formula among them
+        is found here; other cells are computed lazily when read. With full
+        every formula downstream of the written ranges is recomputed.
+        """
+        self.session.flush()
+        logger.info(f"Recalculating formulas in-process for {len(self.written_ranges)} written ranges")
+        start = time.perf_counter()
+        engine = FormulaEngine(self.session.get(self.porocanje_file),
+                               self.session.get(self.porocanje_file, data_only=True))
+        if not full:
+            targets = self.step6_cells(engine)
+            computed = engine.evaluate_cells(targets, self.written_ranges)
+            logger.info(f"Evaluated {computed} formulas for {len(targets)} target cells "
+                        f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+        else:
+            engine.recalc(self.written_ranges)
+        self.engine = engine
+        logger.info("In-process recalculation completed successfully")
+
+    @instrumented
     def recalc_excel(self):
         max_retries = 3
-        retry_delay = 5  # seconds
+
+        # Excel must see the pending openpyxl writes, and step 6 reads its results
+        self.session.flush()
+        self.engine = None
 
         for attempt in range(max_retries):
             try:
                 logger.info(f"Recalculating Excel (Attempt {attempt + 1})")
                 self.kill_excel_processes()  # Ensure no Excel processes are running
 
-                app = xw.App(visible=False)
+                import xlwings as xw  # Windows only, imported when Excel is needed
+
+                app = xw.App(visible=False)  # Always a new Excel process
+                self.excel.track(app.pid)
+                app = self.report.com.wrap(app)
                 wb = app.books.open(self.porocanje_file)
                 
                 logger.info("Calculating...")
@@ -306,8 +2174,8 @@ class ExcelAutomation:
             except Exception as e:
                 logger.error(f"Error in recalc_excel (Attempt {attempt + 1}): {e}")
                 if attempt < max_retries - 1:
-                    logger.info(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
+                    # The finally block waits until Excel has exited and released the file
+                    logger.info("Retrying once Excel has shut down...")
                 else:
                     logger.error("Max retries reached. Unable to recalculate Excel.")
                     raise
@@ -322,55 +2190,45 @@ class ExcelAutomation:
         # If we've exhausted all retries, raise an exception
         raise Exception("Failed to recalculate Excel after multiple attempts")
 
+    @instrumented
     def kill_excel_processes(self):
-        logger.info("Attempting to kill all Excel processes")
-        for proc in psutil.process_iter(['name']):
-            try:
-                if proc.info['name'].lower() in ['excel.exe', 'xlview.exe']:
-                    proc.kill()
-                    logger.info(f"Killed Excel process: {proc.pid}")
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        time.sleep(2)  # Wait for 2 seconds after killing processes
+        """Stop the Excel processes this run started and wait for the workbook to unlock"""
+        self.excel.shutdown([self.porocanje_file])
 
+    @instrumented
     def step7_process_saved_texts(self, saved_texts):
         logger.info("Step 7: Processing saved texts")
         excel = None
         try:
-            excel = win32com.client.Dispatch("Excel.Application")
+            import win32com.client  # Windows only, imported when Excel is needed
+
+            # DispatchEx starts a new Excel, Dispatch would attach to one the user has open
+            excel = win32com.client.DispatchEx("Excel.Application")
+            self.excel.track(excel_pid(excel))
+            excel = self.report.com.wrap(excel)
             excel.Visible = False
             wb = excel.Workbooks.Open(self.porocanje_file)
             izbor_sheet = wb.Worksheets("izbor")
             list2_sheet = wb.Worksheets("List2")
             brizganje_izracun_sheet = wb.Worksheets("brizganje izračun")  
             
+            # Shape anchors and column A labels, read once for steps 7 and 9
+            shapes = ShapeIndex(brizganje_izracun_sheet)
+
             # Delete all existing shapes (images) in the range A7:M44
-            for shape in brizganje_izracun_sheet.Shapes:
-                if (7 <= shape.TopLeftCell.Row <= 44 and 
-                    1 <= shape.TopLeftCell.Column <= 13): 
-                    shape.Delete()
+            removed = shapes.delete_in(7, 1, 44, 13)
+            logger.info(f"Removed {removed} shapes from A7:M44")
+
+            # a. Read izbor F:M and AA once and group the rows by AA
+            header, keyed_rows = read_izbor_blocks(izbor_sheet)
+            groups = group_izbor_rows(keyed_rows)
+            logger.info(f"Read {len(keyed_rows)} izbor rows in {len(groups)} groups")
 
             for text in saved_texts:
                 logger.info(f"Processing text: {text}")
 
-                # a. Filter data in Izbor sheet manually
-                last_row = izbor_sheet.Cells(izbor_sheet.Rows.Count, "F").End(-4162).Row
-                filtered_data = []
-
-                for row in range(1, last_row + 1):
-                    cell_value = izbor_sheet.Cells(row, 27).Value  # Column AA
-                    if cell_value == text or row == 1:  # Include header row
-                        row_data = [izbor_sheet.Cells(row, col).Value for col in range(6, 14)]  # Columns F to M
-                        filtered_data.append(row_data)
-
-                # b. Clear List2 target range
-                last_row_list2 = list2_sheet.Cells(list2_sheet.Rows.Count, "T").End(-4162).Row
-                list2_sheet.Range(f"T2:AA{last_row_list2}").ClearContents()
-
-                # c. Paste filtered data into List2 sheet
-                for i, row_data in enumerate(filtered_data):
-                    for j, value in enumerate(row_data):
-                        list2_sheet.Cells(i + 1, 20 + j).Value = value  # Start from column T (20th column)
+                # b./c. Replace the List2 target range with the group in one write
+                write_list2_block(list2_sheet, header, groups.get(text, []))
 
                 # d. Execute macro (gumb1)
                 excel.Run("sortiraj")
@@ -379,20 +2237,13 @@ class ExcelAutomation:
                 self.step8_copy_processed_data(list2_sheet)
 
                 # Step 9: Paste as image in "brizganje izracun" sheet
-                self.step9_paste_as_image(brizganje_izracun_sheet, text)
+                self.step9_paste_as_image(brizganje_izracun_sheet, text, shapes)
 
                 excel.CutCopyMode = False  # Clear clipboard
 
-            # Set the height of rows 7 to 44 to 16.5 if they don't contain an image
-            for row in range(7, 45):
-                has_image = False
-                for shape in brizganje_izracun_sheet.Shapes:
-                    if shape.TopLeftCell.Row == row:
-                        has_image = True
-                        break
-                if not has_image:
-                    brizganje_izracun_sheet.Rows(row).RowHeight = 16.5
-            logger.info("Adjusted heights of rows without images to 16.5")
+            # Rows with a new image fit it, rows 7 to 44 without an image get 16.5
+            runs = shapes.apply_row_heights(shapes.row_heights(7, 44))
+            logger.info(f"Adjusted row heights in {runs} batched writes")
 
             wb.Save()
             wb.Close()
@@ -424,6 +2275,7 @@ class ExcelAutomation:
         except Exception as e:
             logger.error(f"Failed to enable macros: {e}")
     
+    @instrumented
     def step8_copy_processed_data(self, list2_sheet):
         """Step 8: Copy processed data from List2 sheet"""
         logger.info("Step 8: Copying processed data from List2")
@@ -440,63 +2292,393 @@ class ExcelAutomation:
 
         logger.info(f"Successfully copied range B1:L{last_row} from List2 as picture")
 
-    def step9_paste_as_image(self, brizganje_izracun_sheet, text):
-        """Step 9: Paste as image in 'brizganje izračun' sheet"""
+    @instrumented
+    def step9_paste_as_image(self, brizganje_izracun_sheet, text, shapes=None):
+        """Step 9: Paste as image in 'brizganje izračun' sheet
+
+        With the ShapeIndex of step 7 the target row comes from its labels and
+        the row height is left to its batched write; without one the sheet is
+        indexed here and the row fitted right away.
+        """
         logger.info(f"Step 9: Pasting as image for text '{text}'")
 
-        last_row_brizganje = brizganje_izracun_sheet.Cells(brizganje_izracun_sheet.Rows.Count, "A").End(-4162).Row
-        target_row = None
-        for row in range(1, last_row_brizganje + 1):
-            if brizganje_izracun_sheet.Cells(row, 1).Value == text:
-                target_row = row + 1  # Go one row below
-                break
+        batched = shapes is not None
+        if not batched:
+            shapes = ShapeIndex(brizganje_izracun_sheet)
+        target_row = shapes.target_row(text)  # One row below the text
 
         if target_row:
             target_cell = brizganje_izracun_sheet.Cells(target_row, 1)
             brizganje_izracun_sheet.Paste(target_cell, Link=False)
     
             # Get the last pasted shape (which should be our image)
-            last_shape = brizganje_izracun_sheet.Shapes(brizganje_izracun_sheet.Shapes.Count)
-    
+            last_shape = brizganje_izracun_sheet.Shapes(len(shapes.anchors) + 1)
+            shapes.placed(target_row, 1, last_shape.Height)
+
             # Adjust row height to fit the image
-            image_height = last_shape.Height
-            brizganje_izracun_sheet.Rows(target_row).RowHeight = image_height
+            if not batched:
+                shapes.apply_row_heights({target_row: last_shape.Height})
     
-            logger.info(f"Successfully pasted image for text '{text}' at row {target_row} and adjusted row height")
-            # Add this line to check if the shape is actually there
-            logger.info(f"Shape count after pasting: {brizganje_izracun_sheet.Shapes.Count}")
+            logger.info(f"Successfully pasted image for text '{text}' at row {target_row}")
+            logger.info(f"Shape count after pasting: {len(shapes.anchors)}")
         else:
             logger.warning(f"Could not find row for text '{text}' in 'brizganje izračun' sheet")
 
 
-if __name__ == "__main__":
-    # Create automation instance
-    automation = ExcelAutomation()
+def read_plan_status(path, column, sheet_name="plan", row=5):
+    """Row-5 status of one plan column, streamed without loading the sheet"""
+    wb = load_workbook(path, read_only=True, data_only=True)
     try:
-        automation.kill_excel_processes()
-        # Run step 1
-        pregled_data = automation.step1_copy_pregled_data()
+        for values in wb[sheet_name].iter_rows(min_row=row, max_row=row, min_col=column, max_col=column,
+                                               values_only=True):
+            return values[0] if values else None
+        return None
+    finally:
+        wb.close()
+
+
+class DirectoryEvents:
+    """inotify watch on a folder through libc (Linux only), raises OSError elsewhere"""
+
+    MASK = 0x2 | 0x8 | 0x80 | 0x100  # IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, folder):
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK)
+        if self.fd < 0 or libc.inotify_add_watch(self.fd, os.fsencode(folder), self.MASK) < 0:
+            raise OSError(ctypes.get_errno(), "inotify setup failed")
+
+    def wait(self, timeout):
+        """Block until something in the folder changes or timeout passes"""
+        import select
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+        return bool(ready)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PlanWatcher:
+    """Runs the pipeline once per target date, as soon as the plan column is 'Fiksno'.
+
+    The plan file is watched through inotify where available, otherwise
+    its size and mtime are polled every interval seconds. After a change
+    the file must stay unchanged and unlocked for debounce seconds before
+    it is read, so half-written saves are never parsed; a lock held longer
+    than lock_timeout (the plan left open in Excel) stops blocking the
+    read. Only row 4 (through the header index) and the row-5 cell of the
+    target column are read, and only when the plan or the target date
+    changed since the last read. A failed pipeline is retried once the plan
+    changes, or on an unchanged plan after retry seconds, doubling up to
+    max_retry.
+    """
+
+    def __init__(self, plan_file, interval=30.0, debounce=5.0, header_index=None,
+                 lock_timeout=60.0, retry=300.0, max_retry=3600.0):
+        self.plan_file = os.path.abspath(plan_file)
+        self.interval = interval
+        self.debounce = debounce
+        self.lock_timeout = lock_timeout
+        self.retry = retry
+        self.max_retry = max_retry
+        self.header_index = header_index or HeaderIndex()
+        self.done = set()  # target dates the pipeline completed for
+        self.failed = {}  # target date -> (plan stamp, monotonic retry time, failures)
+        try:
+            self.events = DirectoryEvents(os.path.dirname(self.plan_file))
+        except OSError as e:
+            logger.info(f"Watching {os.path.basename(self.plan_file)} by polling every {interval:.0f}s ({e})")
+            self.events = None
+
+    def wait_for_change(self, stamp):
+        """Wait up to interval for the plan's (size, mtime) to differ from stamp"""
+        deadline = time.monotonic() + self.interval
+        while time.monotonic() < deadline:
+            remaining = deadline - time.monotonic()
+            if self.events is not None:
+                self.events.wait(remaining)
+            else:
+                time.sleep(min(remaining, self.interval))
+            if self._stamp() != stamp:
+                return True
+        return False
+
+    def settle(self):
+        """Wait until the plan has been stable for debounce seconds and is unlocked.
+
+        The lock is waited for at most lock_timeout seconds: Excel keeps it
+        while a planner has the plan open, and the saved file is complete
+        once it has been stable.
+        """
+        stamp = self._stamp()
+        start = stable_since = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now - stable_since >= self.debounce:
+                if not file_locked(self.plan_file):
+                    break
+                if now - start >= self.lock_timeout:
+                    logger.info(f"{os.path.basename(self.plan_file)} is still open elsewhere, reading the saved file")
+                    break
+            time.sleep(min(self.debounce / 5, 1.0) or 0.1)
+            current = self._stamp()
+            if current != stamp:
+                stamp, stable_since = current, time.monotonic()
+        return stamp
+
+    def _stamp(self):
+        try:
+            return file_fingerprint(self.plan_file)
+        except OSError:
+            return None
+
+    def status(self, target_date):
+        """Row-5 value of the target date's column, or None if the date is missing"""
+        if not zipfile.is_zipfile(self.plan_file):
+            return None  # Still being written
+        column = self.header_index.lookup(self.plan_file, "plan", target_date)
+        if column is None:
+            return None
+        return read_plan_status(self.plan_file, column)
+
+    def run(self, pipeline, target_date=None, max_runs=None):
+        """Watch until stopped; pipeline() returns True once the day is done.
+
+        target_date() gives the plan date to wait for, by default the same
+        rule as step 3, so the watcher moves on to the next day by itself.
+        """
+        target_date = target_date or (lambda: ExcelAutomation.get_target_date().date())
+        runs = 0
+        checked = None  # (day, plan stamp) of the last status read
+        logger.info(f"Watching {self.plan_file}")
+        try:
+            while max_runs is None or runs < max_runs:
+                day = target_date()
+                failed = self.failed.get(day)
+                retry_due = failed is not None and time.monotonic() >= failed[1]
+                # An unchanged plan for the same day is not read again, unless a failed run is due
+                if day not in self.done and (checked != (day, self._stamp()) or retry_due):
+                    stamp = self.settle()
+                    checked = (day, stamp)
+                    if failed and failed[0] == stamp and not retry_due:
+                        pass  # Back to the plan of the failed run, wait for the back-off
+                    else:
+                        status = self.status(day)
+                        logger.info(f"Plan status for {day:%Y-%m-%d}: {status}")
+                        if status == "Fiksno":
+                            runs += 1
+                            if pipeline():
+                                self.done.add(day)
+                                self.failed.pop(day, None)
+                                continue
+                            count = failed[2] + 1 if failed else 1
+                            delay = min(self.retry * 2 ** (count - 1), self.max_retry)
+                            self.failed[day] = (stamp, time.monotonic() + delay, count)
+                            logger.warning(f"Pipeline failed for {day:%Y-%m-%d}, retrying when the plan "
+                                           f"changes or in {delay:.0f}s")
+                        else:
+                            self.failed.pop(day, None)  # No longer fixed, nothing to retry
+                self.wait_for_change(self._stamp())
+        finally:
+            if self.events is not None:
+                self.events.close()
+
+
+class Checkpoints:
+    """Stage outputs of one run date, so a failed run can resume where it stopped.
+
+    Each stage is recorded with its inputs (file hashes and options), the
+    poročanje workbook hash before and after it ran, and its output
+    pickled next to a manifest.json. A later run with the same run date
+    reuses the longest chain of recorded stages whose inputs still match
+    and whose last 'after' hash is the workbook as it is now, then runs
+    the remaining stages. Folders of older run dates are pruned.
+    """
+
+    def __init__(self, folder, run_date=None, keep_days=7):
+        self.root = folder
+        self.run_date = (run_date or date.today()).isoformat()
+        self.folder = os.path.join(folder, self.run_date)
+        self.keep_days = keep_days
+        self.manifest = self._load()
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.folder, 'manifest.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _output_path(self, stage):
+        return os.path.join(self.folder, f"{stage}.pkl")
+
+    def _write(self, stage, inputs, before, after, output):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self._output_path(stage) + '.tmp', 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self._output_path(stage) + '.tmp', self._output_path(stage))
+        self.manifest[stage] = {'inputs': inputs, 'before': before, 'after': after,
+                                'finished': datetime.now().isoformat(timespec='seconds')}
+        tmp = os.path.join(self.folder, 'manifest.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.folder, 'manifest.json'))
+
+    def _read(self, stage):
+        with open(self._output_path(stage), 'rb') as f:
+            return pickle.load(f)
+
+    def reusable(self, stages, state):
+        """Names of the leading stages whose recorded outputs are still valid"""
+        chain, previous_after = [], None
+        for name, inputs, _ in stages:
+            record = self.manifest.get(name)
+            if (record is None or record['inputs'] != inputs or not os.path.exists(self._output_path(name))
+                    or (previous_after is not None and record['before'] != previous_after)):
+                break
+            chain.append(name)
+            previous_after = record['after']
+        # The workbook must be in the state the last reused stage left it in
+        while chain and self.manifest[chain[-1]]['after'] != state:
+            chain.pop()
+        return chain
+
+    def run(self, stages, state):
+        """Run (name, inputs, func) stages, func(outputs) returns the stage output.
+
+        state() returns the current workbook hash. Returns {name: output}.
+        """
+        self.prune()
+        skip = self.reusable(stages, state())
+        outputs = {}
+        for name in skip:
+            outputs[name] = self._read(name)
+            logger.info(f"Checkpoint: reusing '{name}' from {self.manifest[name]['finished']}")
+        for name, inputs, func in stages[len(skip):]:
+            before = state()
+            outputs[name] = func(outputs)
+            self._write(name, inputs, before, state(), outputs[name])
+        return outputs
+
+    def prune(self):
+        cutoff = (date.fromisoformat(self.run_date) - timedelta(days=self.keep_days)).isoformat()
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            if re.fullmatch(r'\d{4}-\d{2}-\d{2}', name) and name < cutoff:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
 
+def run_once(args):
+    """One pipeline run with its run report, returns True when all steps succeeded
+
+    Stages are checkpointed per run date: a rerun skips the stages whose
+    inputs are unchanged and resumes from the first one that failed.
+    """
+    import cProfile
+
+    # Create automation instance
+    automation = ExcelAutomation()
+    checkpoints = Checkpoints(os.path.join(os.path.dirname(automation.porocanje_file), '.checkpoints'))
+    if args.fresh:
+        checkpoints.manifest = {}
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    def paste(outputs):
         # Run step 2
-        automation.step2_paste_to_porocanje(pregled_data)
+        automation.step2_paste_to_porocanje(outputs['pregled'])
+        result = {}
+        if args.backfill:
+            # Steps 3-5 for the whole date range
+            result['backfill'] = automation.backfill(*args.backfill)
+        else:
+            # Run step 3
+            result['target_col'] = automation.step3_find_date_in_plan()
 
-        # Run step 3
-        target_col = automation.step3_find_date_in_plan()
+            # Run step 4
+            plan_range_data = automation.step4_copy_plan_range(result['target_col'])
+            result['plan_block'] = plan_range_data
 
-        # Run step 4
-        plan_range_data = automation.step4_copy_plan_range(target_col)
+            # Run step 5
+            automation.step5_paste_to_brizganje(plan_range_data)
 
-        # Run step 5
-        automation.step5_paste_to_brizganje(plan_range_data)
+        # Single save for steps 2 and 5
+        with automation.report.measure("flush"):
+            automation.session.flush()
+        result['written_ranges'] = automation.written_ranges
+        return result
 
-        automation.recalc_excel()
+    def analyze(outputs):
+        automation.written_ranges = outputs['paste']['written_ranges']
+        automation.recalc()
         # Run step 6
-        saved_texts = automation.step6_analyze_brizganje()
+        return automation.step6_analyze_brizganje()
+
+    def images(outputs):
+        # Run steps 7-9
+        automation.step7_process_saved_texts(outputs['analyze'])
 
-        # Run step 7
-        automation.step7_process_saved_texts(saved_texts)
+    stages = [
+        # Run step 1
+        ("pregled", [file_hash(automation.pregled_file)], lambda outputs: automation.step1_copy_pregled_data()),
+        ("paste", [file_hash(automation.plan_file), str(args.backfill)], paste),
+        ("analyze", [], analyze),
+        ("images", [], images),
+    ]
+    try:
+        automation.kill_excel_processes()
+        checkpoints.run(stages, lambda: file_hash(automation.porocanje_file))
+        return True
     except Exception as e:
         logger.error((f"An error occurred: {e}"))
+        return False
     finally:
+        automation.session.close()
         automation.kill_excel_processes()
-        logger.info("Script execution finished")
\ No newline at end of file
+        logger.info(f"Excel process handling: {automation.excel.dead_time:.2f}s over {automation.excel.calls} calls")
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            logger.info(f"Profile written to {args.profile}")
+        automation.report.write(args.report_dir)
+        logger.info("Script execution finished")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Daily injection-moulding report automation")
+    parser.add_argument('--report-dir', default='reports', help="folder for run reports and the run history")
+    parser.add_argument('--profile', metavar='FILE', help="write cProfile stats of the run to FILE")
+    parser.add_argument('--backfill', nargs=2, metavar=('START', 'END'),
+                        type=lambda s: datetime.strptime(s, "%Y-%m-%d"),
+                        help="paste every fixed plan date from START to END (YYYY-MM-DD) in one pass")
+    parser.add_argument('--fresh', action='store_true', help="ignore today's checkpoints and run every step")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and start the pipeline as soon as the plan is 'Fiksno'")
+    parser.add_argument('--poll', type=float, default=30.0, help="seconds between plan checks in --watch mode")
+    parser.add_argument('--debounce', type=float, default=5.0,
+                        help="seconds the plan must stay unchanged before it is read in --watch mode")
+    args = parser.parse_args()
+
+    if args.watch:
+        PlanWatcher(os.path.abspath("plan brizganja 2025 mesečni.xlsx"), args.poll, args.debounce).run(
+            lambda: run_once(args))
+    else:
+        run_once(args)
@@ -0,0 +1,365 @@
+"""Benchmarks for the openpyxl/pandas parts of automate_process.py.
+
+Runs on synthetic data, no production files or Excel needed:
+
+    python benchmark.py step2 --rows 20000
+    python benchmark.py render --tables 24
+    python benchmark.py pipeline --rows 1000 5000 20000 --days 120 --machines 38
+
+The pipeline benchmark generates look-alikes of 43.xls, the poročanje
+.xlsm (with a stub VBA part) and the plan workbook, then runs steps 1-6
+twice per size (cold caches, then warm) with Excel stubbed out, and
+checks the pasted step 5 block and the step 6 texts of every run.
+
+Benchmark-only dependencies: xlwt writes the synthetic 43.xls and xlrd
+reads it back (pip install -r requirements-dev.txt).
+"""
+import argparse
+import csv
+import logging
+import os
+import zipfile
+from datetime import datetime, timedelta
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+from automate_process import ExcelAutomation, RowFingerprint, RunReport, write_sheet_data
+from table_image import render_tables, table_spec
+
+
+def machine_names(machines):
+    return [f'BR{i:02d}' for i in range(1, machines + 1)]
+
+
+def synthetic_pregled(rows, seed=0, machines=39):
+    """DataFrame shaped like the 43.xls Pregled export"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Datum': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+        'Stroj': rng.choice(machine_names(machines), rows),
+        'Šifra': rng.integers(100000, 999999, rows).astype(str),
+        'Opis': rng.choice(['Pokrov', 'Ohišje', 'Nosilec', 'Tesnilo & obroč'], rows),
+        'Količina': rng.integers(0, 5000, rows),
+        'Izmet': rng.random(rows) * 100,
+        'Ure': rng.random(rows) * 24,
+    })
+    df.loc[df.sample(frac=0.05, random_state=seed).index, 'Izmet'] = np.nan
+    return df
+
+
+def template_workbook(path):
+    """Workbook with the sheets step 2 writes to"""
+    wb = Workbook()
+    wb.active.title = 'prilepi gosoft'
+    wb.create_sheet('brizganje izračun')
+    wb.save(path)
+
+
+def write_pregled_xls(path, data_df):
+    """43.xls look-alike: one Sheet1 with a header row (BIFF, so at most 65535 rows)"""
+    import xlwt
+
+    if len(data_df) > 65535:
+        raise ValueError(f"{len(data_df)} rows do not fit in an .xls sheet")
+    book = xlwt.Workbook()
+    sheet = book.add_sheet('Sheet1')
+    date_style = xlwt.easyxf(num_format_str='DD.MM.YYYY')
+    for c, name in enumerate(data_df.columns):
+        sheet.write(0, c, name)
+    for c, name in enumerate(data_df.columns):
+        values = data_df[name].tolist()
+        is_date = pd.api.types.is_datetime64_any_dtype(data_df[name])
+        for r, value in enumerate(values, 1):
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                continue
+            if is_date:
+                sheet.write(r, c, value.to_pydatetime(), date_style)
+            else:
+                sheet.write(r, c, value.item() if hasattr(value, 'item') else value)
+    book.save(path)
+
+
+def plan_dates(days, today=None):
+    """Calendar days covered by the synthetic plan, ending three days after today"""
+    today = (today or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return [today + timedelta(days=d) for d in range(3 - days, 4)]
+
+
+def write_plan(path, days, machines, seed=0):
+    """plan brizganja look-alike: one 4-column block per day from column H"""
+    rng = np.random.default_rng(seed)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'plan'
+    ws['C5'] = 'Status plana'
+    ws['B8'], ws['C8'] = 'št.stroja', 'stroj'
+    names = machine_names(machines)
+    today = datetime.now()
+    for i, day in enumerate(plan_dates(days)):
+        col = 8 + 4 * i
+        ws.cell(4, col, day)
+        ws.cell(5, col, 'Fiksno' if day <= today else 'V pripravi')
+        # Row 6 repeats the date like the '=H4' formulas of the real plan
+        ws.cell(6, col, day)
+        ws.cell(6, col + 1, 'posluž:')
+        ws.cell(6, col + 2, float(rng.random() * 20))
+        for j, header in enumerate(['šifra', 'opis', 'KOS/dan', 'posl/stroj']):
+            ws.cell(8, col + j, header)
+        for r in range(9, 45):
+            if r - 9 < len(names):
+                ws.cell(r, col, int(rng.integers(100000000, 999999999)))
+                ws.cell(r, col + 1, f'Izdelek {names[r - 9]}')
+                ws.cell(r, col + 2, float(rng.random() * 5000))
+    for r in range(9, 45):
+        if r - 9 < len(names):
+            ws.cell(r, 2, r - 8)
+            ws.cell(r, 3, names[r - 9])
+    wb.create_sheet('dnevni pregled')
+    wb.save(path)
+
+
+VBA_PROJECT = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + bytes(504)  # Empty OLE header, never executed
+
+
+def add_stub_vba(path):
+    """Turn a saved .xlsx package into an .xlsm with a placeholder vbaProject.bin"""
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+    types = parts['[Content_Types].xml'].decode('utf-8')
+    types = types.replace('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml',
+                          'application/vnd.ms-excel.sheet.macroEnabled.main+xml')
+    types = types.replace('<Default Extension="xml"',
+                          '<Default Extension="bin" ContentType="application/vnd.ms-office.vbaProject" />'
+                          '<Default Extension="xml"', 1)
+    rels = parts['xl/_rels/workbook.xml.rels'].decode('utf-8')
+    rels = rels.replace('</Relationships>',
+                        '<Relationship Id="rIdVba" Type="http://schemas.microsoft.com/office/2006/relationships/'
+                        'vbaProject" Target="vbaProject.bin" /></Relationships>')
+    parts['[Content_Types].xml'] = types.encode('utf-8')
+    parts['xl/_rels/workbook.xml.rels'] = rels.encode('utf-8')
+    parts['xl/vbaProject.bin'] = VBA_PROJECT
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+
+def write_porocanje(path, data_df, days, machines):
+    """poročanje .xlsm look-alike with the sheets steps 2-9 use"""
+    wb = Workbook()
+    wb.active.title = 'prilepi gosoft'
+    write_rows = [list(data_df.columns)] + data_df.astype(object).where(data_df.notna(), None).values.tolist()
+    for row in write_rows:
+        wb.active.append(row)
+    ws = wb.create_sheet('brizganje izračun')
+    for i, day in enumerate(plan_dates(days)):
+        ws.cell(4, 15 + 4 * i, day)
+    izmet = "'prilepi gosoft'!$F:$F"
+    stroj = "'prilepi gosoft'!$B:$B"
+    for r, name in enumerate(machine_names(machines)[:40], 7):
+        ws.cell(r, 1, name)
+        ws.cell(r, 12, f'=SUMIF({stroj},$A{r},{izmet})/1000')
+        ws.cell(r, 13, f'=ROUND(L{r}*12.5,2)').number_format = '#,##0.00 "€"'
+    izbor = wb.create_sheet('izbor')
+    for c, name in enumerate(data_df.columns[:8], 6):
+        izbor.cell(1, c, name)
+    izbor.cell(1, 27, 'Stroj')
+    list2 = wb.create_sheet('List2')
+    for r in range(1, 28):
+        for c, source in zip(range(2, 13), range(20, 28)):
+            list2.cell(r, c, f'=IF({list2.cell(r, source).coordinate}="","",{list2.cell(r, source).coordinate})')
+    wb.save(path)
+    add_stub_vba(path)
+
+
+def generate_inputs(folder, rows, days=120, machines=38, seed=0):
+    """Write the three input files ExcelAutomation expects into folder"""
+    data_df = synthetic_pregled(rows, seed, machines)
+    write_pregled_xls(os.path.join(folder, '43.xls'), data_df)
+    write_plan(os.path.join(folder, 'plan brizganja 2025 mesečni.xlsx'), days, machines, seed)
+    # Last run's data, so step 2 has a previous paste to diff against
+    previous = synthetic_pregled(rows, seed + 1, machines)
+    write_porocanje(os.path.join(folder, 'poročanje proizvodnje2025.xlsm'), previous, days, machines)
+
+
+def legacy_step2(path, data_df):
+    """The per-cell write path step 2 used before the bulk writer"""
+    wb = load_workbook(path, keep_vba=True)
+    ws = wb['prilepi gosoft']
+    ws.delete_rows(1, ws.max_row)
+    for c_idx, col_name in enumerate(data_df.columns, 1):
+        ws.cell(row=1, column=c_idx, value=col_name)
+    for r_idx, row in enumerate(data_df.values, 2):
+        for c_idx, value in enumerate(row, 1):
+            ws.cell(row=r_idx, column=c_idx, value=value)
+    wb.save(path)
+    wb.close()
+
+
+def bulk_step2(path, data_df):
+    """The bulk XML write path used by WorkbookSession.flush()"""
+    write_sheet_data(path, {'prilepi gosoft': data_df})
+
+
+def bench_step2(rows):
+    data_df = synthetic_pregled(rows)
+    folder = tempfile.mkdtemp()
+    try:
+        template = os.path.join(folder, 'template.xlsx')
+        template_workbook(template)
+        results = {}
+        for name, func in (('per-cell', legacy_step2), ('bulk', bulk_step2)):
+            path = os.path.join(folder, f'{name}.xlsx')
+            shutil.copy(template, path)
+            start = time.perf_counter()
+            func(path, data_df)
+            elapsed = time.perf_counter() - start
+            results[name] = elapsed
+            print(f"step2 {name:>8}: {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s)")
+        print(f"speedup: {results['per-cell'] / results['bulk']:.1f}x")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def list2_sheet(rows=27, seed=0):
+    """Worksheet formatted like List2 B1:L"""
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+    rng = np.random.default_rng(seed)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'List2'
+    thin = Side(style='thin')
+    ws['B1'] = 'Stroj'
+    ws['B1'].font = Font(bold=True, size=14)
+    ws['B1'].alignment = Alignment(horizontal='center')
+    ws.merge_cells('B1:L1')
+    for c in range(2, 13):
+        ws.cell(2, c, f'Stolpec {c}').fill = PatternFill('solid', fgColor='FFD966')
+    for r in range(3, rows + 1):
+        ws.cell(r, 2, f'Artikel {rng.integers(1000, 9999)}')
+        for c in range(3, 13):
+            cell = ws.cell(r, c, float(rng.random() * 10000))
+            cell.number_format = '#,##0.00 "€"'
+            cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    ws.column_dimensions['B'].width = 20
+    return ws
+
+
+def bench_render(tables, worker_counts):
+    specs = [table_spec(list2_sheet(seed=i), 'B1:L27') for i in range(tables)]
+    base = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        render_tables(specs, workers=workers)
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        print(f"render {workers:>2} workers: {tables} tables in {elapsed:.2f}s "
+              f"({tables / elapsed:.1f} tables/s, {base / elapsed:.1f}x)")
+
+
+def excel_unavailable(*args, **kwargs):
+    raise RuntimeError("Excel is stubbed out in benchmarks")
+
+
+def expected_texts(data_df, machines):
+    """Step 6 texts worked out from the pasted data: M = ROUND(SUMIF(B, A, F) / 1000 * 12.5, 2) > 50"""
+    izmet = data_df.iloc[:, 5].groupby(data_df.iloc[:, 1].str.upper()).sum()
+    return [name for name in machines if round(izmet.get(name.upper(), 0) / 1000 * 12.5, 2) > 50]
+
+
+def check_pipeline(automation, data_df, block, texts):
+    """Read the step 5 block back from the saved workbook and recheck step 6"""
+    ws = load_workbook(automation.porocanje_file)['brizganje izračun']
+    _, first_row, first_col, last_row, _ = automation.written_ranges[-1]
+    pasted = [[ws.cell(row=r, column=c).value for c in range(first_col, first_col + 3)]
+              for r in range(first_row, first_row + len(block))]
+    if pasted != [list(row) for row in block]:
+        raise AssertionError(f"Step 5 block in column {first_col} does not match the plan")
+    machines = [ws.cell(row=r, column=1).value for r in range(7, 47) if ws.cell(row=r, column=1).value]
+    expected = expected_texts(data_df, machines)
+    if sorted(texts) != sorted(expected):
+        raise AssertionError(f"Step 6 flagged {texts}, expected {expected}")
+
+
+def run_pipeline(folder):
+    """Steps 1-6 on the files in folder, checked, returns the run report steps"""
+    automation = ExcelAutomation(folder)
+    automation.recalc_excel = excel_unavailable  # COM layer stubbed, recalc must stay in-process
+    try:
+        data_df = automation.step1_copy_pregled_data()
+        automation.step2_paste_to_porocanje(data_df)
+        target_col = automation.step3_find_date_in_plan()
+        block = automation.step4_copy_plan_range(target_col)
+        automation.step5_paste_to_brizganje(block)
+        with automation.report.measure('flush'):
+            automation.session.flush()
+        automation.recalc()
+        texts = automation.step6_analyze_brizganje()
+    finally:
+        automation.session.close()
+    check_pipeline(automation, data_df, block, texts)
+    return automation.report.steps
+
+
+def bench_pipeline(sizes, days, machines, csv_path=None):
+    logging.disable(logging.INFO)  # Keep the per-step log lines out of the results
+    results = []
+    for rows in sizes:
+        folder = tempfile.mkdtemp()
+        try:
+            generate_inputs(folder, rows, days, machines)
+            porocanje = os.path.join(folder, 'poročanje proizvodnje2025.xlsm')
+            shutil.copy2(porocanje, porocanje + '.orig')
+            for run in ('cold', 'warm'):
+                if run == 'warm':
+                    # Step 5 overwrites the row-4 date it looks up, so start from the
+                    # generated workbook again; the plan and header caches stay warm
+                    shutil.copy2(porocanje + '.orig', porocanje)
+                    RowFingerprint(porocanje, 'prilepi gosoft').clear()
+                for step in run_pipeline(folder):
+                    if step['depth'] == 0:
+                        results.append(dict(step, rows=rows, run=run))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"{'rows':>7} {'run':>5} {'step':<26} {'wall s':>8} {'rows/s':>9} {'peak MB':>8}")
+    for result in results:
+        rate = f"{result['rows'] / result['wall_s']:.0f}" if result['wall_s'] >= 0.001 else '-'
+        print(f"{result['rows']:>7} {result['run']:>5} {result['step']:<26} {result['wall_s']:>8.3f} "
+              f"{rate:>9} {result['peak_rss_mb']:>8.1f}")
+    for rows in sizes:
+        for run in ('cold', 'warm'):
+            total = sum(r['wall_s'] for r in results if r['rows'] == rows and r['run'] == run)
+            peak = max(r['peak_rss_mb'] for r in results if r['rows'] == rows and r['run'] == run)
+            print(f"total {rows:>7} rows {run}: {total:.2f}s ({rows / total:.0f} rows/s), peak {peak:.1f} MB")
+    if csv_path:
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['rows', 'run'] + RunReport.FIELDS,
+                                    extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"Results written to {csv_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=['step2', 'render', 'pipeline'])
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000])
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--machines', type=int, default=38)
+    parser.add_argument('--csv', help="write the pipeline results to this CSV file")
+    parser.add_argument('--tables', type=int, default=24)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    if args.benchmark == 'step2':
+        bench_step2(args.rows[0])
+    elif args.benchmark == 'pipeline':
+        bench_pipeline(args.rows, args.days, args.machines, args.csv)
+    elif args.benchmark == 'render':
+        bench_render(args.tables, args.workers)
@@ -0,0 +1,1487 @@
+"""In-process recalculation of Excel formulas for automate_process.py.
+
+Covers the formula subset used by 'brizganje izračun' and the sheets it
+reads from (arithmetic, comparisons, lookups, conditional aggregates and
+the usual text/date helpers). Formulas come from the openpyxl formula
+view, cached values from the data_only view. Only the cells downstream
+of the ranges that were written are recomputed; everything else keeps
+the value Excel saved.
+
+Check the engine against the values Excel saved in a workbook with:
+
+    python formula_engine.py "poročanje proizvodnje2025.xlsm"
+"""
+import logging
+import math
+import re
+from bisect import bisect_left, bisect_right
+import sys
+from datetime import date, datetime, time as dtime, timedelta
+
+from openpyxl import load_workbook
+from openpyxl.formula.tokenizer import Token, Tokenizer
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+logger = logging.getLogger(__name__)
+
+MAX_ROW = 1048576
+MAX_COL = 16384
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+class UnsupportedFormula(Exception):
+    """A formula uses syntax or a function the engine does not implement"""
+
+
+class ExcelError(str):
+    """An Excel error value such as #N/A, propagated like Excel does"""
+
+
+NA = ExcelError('#N/A')
+VALUE = ExcelError('#VALUE!')
+DIV0 = ExcelError('#DIV/0!')
+REF = ExcelError('#REF!')
+NUM = ExcelError('#NUM!')
+NAME = ExcelError('#NAME?')
+ERRORS = {e: e for e in (NA, VALUE, DIV0, REF, NUM, NAME, ExcelError('#NULL!'))}
+
+
+def is_error(value):
+    return isinstance(value, ExcelError)
+
+
+# --- Parsing ---------------------------------------------------------------
+
+REF_PART = r"\$?[A-Za-z]{1,3}\$?\d+|\$?[A-Za-z]{1,3}|\$?\d+"
+REF_RE = re.compile(
+    rf"^(?:(?:'((?:[^']|'')+)'|([^'!:]+))!)?({REF_PART})(?::({REF_PART}))?$"
+)
+CELL_RE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)$")
+COL_RE = re.compile(r"^\$?([A-Za-z]{1,3})$")
+ROW_RE = re.compile(r"^\$?(\d+)$")
+
+# Binding powers, Excel precedence from loosest to tightest
+INFIX_POWER = {
+    '=': 10, '<>': 10, '<': 10, '>': 10, '<=': 10, '>=': 10,
+    '&': 20,
+    '+': 30, '-': 30,
+    '*': 40, '/': 40,
+    '^': 50,
+}
+PREFIX_POWER = 60
+POSTFIX_POWER = 70
+
+
+def _parse_ref(text, sheet):
+    """Parse a range operand to ('ref', sheet, r1, c1, r2, c2), or None"""
+    match = REF_RE.match(text)
+    if not match:
+        return None
+    quoted, plain, first, second = match.groups()
+    if quoted is not None:
+        sheet = quoted.replace("''", "'")
+    elif plain is not None:
+        sheet = plain
+    if second is None:
+        cell = CELL_RE.match(first)
+        if not cell:
+            return None  # A bare word is a defined name, not a reference
+        row, col = int(cell.group(2)), column_index_from_string(cell.group(1).upper())
+        return ('ref', sheet, row, col, row, col)
+
+    bounds = []
+    for part in (first, second):
+        cell, col, row = CELL_RE.match(part), COL_RE.match(part), ROW_RE.match(part)
+        if cell:
+            bounds.append((int(cell.group(2)), column_index_from_string(cell.group(1).upper())))
+        elif col:
+            bounds.append((None, column_index_from_string(col.group(1).upper())))
+        elif row:
+            bounds.append((int(row.group(1)), None))
+        else:
+            return None
+    (r1, c1), (r2, c2) = bounds
+    if r1 is None or r2 is None:  # Whole columns
+        r1, r2 = 1, MAX_ROW
+    if c1 is None or c2 is None:  # Whole rows
+        c1, c2 = 1, MAX_COL
+    return ('ref', sheet, min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2))
+
+
+class Parser:
+    """Pratt parser turning openpyxl formula tokens into a tuple AST"""
+
+    def __init__(self, formula, sheet):
+        self.sheet = sheet
+        try:
+            tokens = Tokenizer(formula).items
+        except Exception as e:
+            raise UnsupportedFormula(f"Cannot tokenize {formula!r}: {e}")
+        for token in tokens:
+            if token.type == Token.WSPACE:
+                raise UnsupportedFormula(f"Intersection operator in {formula!r}")
+            if token.type == Token.ARRAY:
+                raise UnsupportedFormula(f"Array constant in {formula!r}")
+        self.tokens = tokens
+        self.pos = 0
+        self.formula = formula
+
+    def parse(self):
+        node = self.expr(0)
+        if self.pos != len(self.tokens):
+            raise UnsupportedFormula(f"Unexpected token in {self.formula!r}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise UnsupportedFormula(f"Unexpected end of {self.formula!r}")
+        self.pos += 1
+        return token
+
+    def power(self, token):
+        if token is None:
+            return 0
+        if token.type == Token.OP_IN:
+            return INFIX_POWER.get(token.value, 0)
+        if token.type == Token.OP_POST:
+            return POSTFIX_POWER
+        return 0
+
+    def expr(self, rbp):
+        left = self.prefix(self.next())
+        while rbp < self.power(self.peek()):
+            token = self.next()
+            if token.type == Token.OP_POST:
+                left = ('pct', left)
+            else:
+                left = ('op', token.value, left, self.expr(INFIX_POWER[token.value]))
+        return left
+
+    def prefix(self, token):
+        if token.type == Token.OPERAND:
+            return self.operand(token)
+        if token.type == Token.OP_PRE:
+            operand = self.expr(PREFIX_POWER)
+            return ('neg', operand) if token.value == '-' else operand
+        if token.type == Token.PAREN and token.subtype == Token.OPEN:
+            node = self.expr(0)
+            closing = self.next()
+            if closing.type != Token.PAREN:
+                raise UnsupportedFormula(f"Unbalanced parenthesis in {self.formula!r}")
+            return node
+        if token.type == Token.FUNC and token.subtype == Token.OPEN:
+            return self.function(token.value[:-1].upper())
+        raise UnsupportedFormula(f"Unexpected {token.value!r} in {self.formula!r}")
+
+    def function(self, name):
+        for prefix in ('_XLFN.', '_XLWS.'):
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+        args = []
+        token = self.peek()
+        if token is not None and token.type == Token.FUNC and token.subtype == Token.CLOSE:
+            self.next()
+            return ('func', name, args)
+        while True:
+            token = self.peek()
+            if token is not None and (token.type == Token.SEP or
+                                      (token.type == Token.FUNC and token.subtype == Token.CLOSE)):
+                args.append(('empty',))  # Omitted argument, e.g. VLOOKUP(a,b,2,)
+            else:
+                args.append(self.expr(0))
+            token = self.next()
+            if token.type == Token.FUNC and token.subtype == Token.CLOSE:
+                return ('func', name, args)
+            if token.type != Token.SEP or token.subtype != Token.ARG:
+                raise UnsupportedFormula(f"Unexpected {token.value!r} in {self.formula!r}")
+
+    def operand(self, token):
+        value = token.value
+        if token.subtype == Token.NUMBER:
+            return ('lit', float(value) if any(ch in value for ch in '.eE') else int(value))
+        if token.subtype == Token.TEXT:
+            return ('lit', value[1:-1].replace('""', '"'))
+        if token.subtype == Token.LOGICAL:
+            return ('lit', value.upper() == 'TRUE')
+        if token.subtype == Token.ERROR:
+            return ('lit', ERRORS.get(value.upper(), ExcelError(value.upper())))
+        if value.startswith('['):
+            raise UnsupportedFormula(f"External reference in {self.formula!r}")
+        ref = _parse_ref(value, self.sheet)
+        if ref is not None:
+            return ref
+        if '[' in value:
+            raise UnsupportedFormula(f"Structured reference in {self.formula!r}")
+        return ('name', value)
+
+
+def parse_formula(formula, sheet):
+    return Parser(formula, sheet).parse()
+
+
+def references(node):
+    """Yield every ('ref', ...) and ('name', ...) node of an AST"""
+    kind = node[0]
+    if kind in ('ref', 'name'):
+        yield node
+    elif kind == 'op':
+        yield from references(node[2])
+        yield from references(node[3])
+    elif kind in ('neg', 'pct'):
+        yield from references(node[1])
+    elif kind == 'func':
+        for arg in node[2]:
+            yield from references(arg)
+
+
+# --- Values ----------------------------------------------------------------
+
+class Range:
+    """A rectangular block of cells, materialized on demand"""
+
+    def __init__(self, engine, sheet, r1, c1, r2, c2):
+        self.engine = engine
+        self.sheet = sheet
+        self.r1, self.c1 = r1, c1
+        # Whole-column/row references stop at the sheet's used area
+        max_row, max_col = engine.extent(sheet)
+        self.r2, self.c2 = min(r2, max(max_row, r1)), min(c2, max(max_col, c1))
+
+    @property
+    def shape(self):
+        return self.r2 - self.r1 + 1, self.c2 - self.c1 + 1
+
+    def rows(self):
+        return self.engine.block(self.sheet, self.r1, self.c1, self.r2, self.c2)
+
+    def flat(self):
+        for row in self.rows():
+            yield from row
+
+    def column(self, offset):
+        return [row[offset] for row in self.rows()]
+
+
+def to_serial(value):
+    """Excel serial number of a date/datetime/time"""
+    if isinstance(value, datetime):
+        return (value - EXCEL_EPOCH) / timedelta(days=1)
+    if isinstance(value, date):
+        return float((value - EXCEL_EPOCH.date()).days)
+    if isinstance(value, dtime):
+        return (value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6) / 86400
+    if isinstance(value, timedelta):
+        return value / timedelta(days=1)
+    return value
+
+
+def to_number(value):
+    """Coerce a scalar for arithmetic, returning an ExcelError on failure"""
+    if is_error(value):
+        return value
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, (datetime, date, dtime, timedelta)):
+        return to_serial(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip().replace(',', '.')) if value.strip() else VALUE
+        except ValueError:
+            return VALUE
+    return VALUE
+
+
+def to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (datetime, date, dtime)):
+        return to_text(to_serial(value))
+    return str(value)
+
+
+def to_bool(value):
+    if is_error(value):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, str):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        return VALUE
+    number = to_number(value)
+    return number if is_error(number) else number != 0
+
+
+def _type_rank(value):
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, str):
+        return 1
+    return 0
+
+
+def compare(a, b):
+    """Excel ordering: numbers < text < logicals, text case-insensitive"""
+    if a is None:
+        a = '' if isinstance(b, str) else False if isinstance(b, bool) else 0
+    if b is None:
+        b = '' if isinstance(a, str) else False if isinstance(a, bool) else 0
+    a, b = to_serial(a), to_serial(b)
+    ra, rb = _type_rank(a), _type_rank(b)
+    if ra != rb:
+        return -1 if ra < rb else 1
+    if isinstance(a, str):
+        a, b = a.lower(), b.lower()
+    return (a > b) - (a < b)
+
+
+def scalar(value):
+    """Reduce a Range to a single value the way a cell formula would"""
+    if isinstance(value, Range):
+        if value.shape == (1, 1):
+            return value.rows()[0][0]
+        return VALUE
+    if isinstance(value, list):
+        return value[0][0] if value and value[0] else None
+    return value
+
+
+def as_array(value):
+    """2-D list view of a Range, array or scalar"""
+    if isinstance(value, Range):
+        return value.rows()
+    if isinstance(value, list):
+        return value
+    return [[value]]
+
+
+def _binary(op, a, b):
+    if is_error(a):
+        return a
+    if is_error(b):
+        return b
+    if op == '&':
+        return to_text(a) + to_text(b)
+    if op in ('=', '<>', '<', '>', '<=', '>='):
+        c = compare(a, b)
+        return {'=': c == 0, '<>': c != 0, '<': c < 0, '>': c > 0, '<=': c <= 0, '>=': c >= 0}[op]
+    a, b = to_number(a), to_number(b)
+    if is_error(a):
+        return a
+    if is_error(b):
+        return b
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == '*':
+        return a * b
+    if op == '/':
+        return DIV0 if b == 0 else a / b
+    if op == '^':
+        try:
+            return float(a) ** b
+        except (OverflowError, ZeroDivisionError, ValueError):
+            return NUM
+    raise UnsupportedFormula(f"Operator {op}")
+
+
+def binary(op, a, b):
+    """Apply an operator, element-wise when either side is a range/array"""
+    if isinstance(a, (Range, list)) or isinstance(b, (Range, list)):
+        xa, xb = as_array(a), as_array(b)
+        rows = max(len(xa), len(xb))
+        cols = max(len(xa[0]) if xa else 0, len(xb[0]) if xb else 0)
+
+        def at(x, r, c):
+            return x[r if len(x) > 1 else 0][c if len(x[0]) > 1 else 0]
+        return [[_binary(op, at(xa, r, c), at(xb, r, c)) for c in range(cols)] for r in range(rows)]
+    return _binary(op, a, b)
+
+
+def criteria(crit):
+    """Build a predicate for SUMIF/COUNTIF style criteria"""
+    if isinstance(crit, str):
+        match = re.match(r'^(<=|>=|<>|<|>|=)?(.*)$', crit, re.S)
+        op, operand = match.group(1) or '=', match.group(2)
+        number = to_number(operand) if operand.strip() else None
+        if number is not None and not is_error(number):
+            operand = number
+        elif op in ('=', '<>') and any(ch in operand for ch in '*?'):
+            pattern = re.compile(
+                '^' + ''.join('.*' if ch == '*' else '.' if ch == '?' else re.escape(ch) for ch in operand) + '$',
+                re.I | re.S)
+            if op == '=':
+                return lambda v: isinstance(v, str) and bool(pattern.match(v))
+            return lambda v: not (isinstance(v, str) and pattern.match(v))
+        elif operand == '' and op in ('=', '<>'):
+            if op == '=':
+                return lambda v: v is None or v == ''
+            return lambda v: not (v is None or v == '')
+    else:
+        op, operand = '=', to_serial(crit)
+
+    def predicate(v):
+        if is_error(v):
+            return False
+        v = to_serial(v)
+        if isinstance(operand, (int, float)) and not isinstance(operand, bool):
+            if isinstance(v, str):
+                number = to_number(v)
+                if is_error(number):
+                    return op == '<>'
+                v = number
+            elif v is None or isinstance(v, bool):
+                return op == '<>'
+        elif v is None:
+            v = ''
+        elif _type_rank(v) != _type_rank(operand):
+            return op == '<>'
+        c = compare(v, operand)
+        return {'=': c == 0, '<>': c != 0, '<': c < 0, '>': c > 0, '<=': c <= 0, '>=': c >= 0}[op]
+    return predicate
+
+
+# --- Functions -------------------------------------------------------------
+
+def _numbers(args):
+    """Numbers of the arguments, the way SUM/AVERAGE/MIN/MAX see them"""
+    for arg in args:
+        if isinstance(arg, (Range, list)):
+            for v in (arg.flat() if isinstance(arg, Range) else (x for row in arg for x in row)):
+                if is_error(v):
+                    yield v
+                elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                    yield v
+                elif isinstance(v, (datetime, date, dtime)):
+                    yield to_serial(v)
+        else:
+            v = to_number(arg)
+            yield v
+
+
+def _first_error(values):
+    for v in values:
+        if is_error(v):
+            return v
+    return None
+
+
+def fn_sum(*args):
+    values = list(_numbers(args))
+    return _first_error(values) or sum(values)
+
+
+def fn_average(*args):
+    values = list(_numbers(args))
+    error = _first_error(values)
+    if error:
+        return error
+    return sum(values) / len(values) if values else DIV0
+
+
+def fn_min(*args):
+    values = list(_numbers(args))
+    return _first_error(values) or (min(values) if values else 0)
+
+
+def fn_max(*args):
+    values = list(_numbers(args))
+    return _first_error(values) or (max(values) if values else 0)
+
+
+def fn_count(*args):
+    return sum(1 for v in _numbers(args) if not is_error(v))
+
+
+def fn_counta(*args):
+    count = 0
+    for arg in args:
+        if isinstance(arg, (Range, list)):
+            count += sum(1 for v in (arg.flat() if isinstance(arg, Range) else (x for r in arg for x in r))
+                         if v is not None and v != '')
+        elif arg is not None:
+            count += 1
+    return count
+
+
+def fn_countblank(rng):
+    return sum(1 for v in as_range_values(rng) if v is None or v == '')
+
+
+def as_range_values(value):
+    if isinstance(value, Range):
+        return list(value.flat())
+    return [x for row in as_array(value) for x in row]
+
+
+def _plain_text(crit):
+    """True for criteria that are an exact, case-insensitive text match"""
+    return (isinstance(crit, str) and crit != '' and crit[0] not in '<>=' and not any(ch in crit for ch in '*?~')
+            and is_error(to_number(crit)))
+
+
+def _if_ranges(pairs):
+    """Row mask over (range, criterion) pairs for the *IFS functions"""
+    mask = None
+    for rng, crit in pairs:
+        crit = scalar(crit)
+        if isinstance(rng, Range) and _plain_text(crit):
+            # Grouped once per range and shared by every formula using it
+            hits = [False] * (rng.shape[0] * rng.shape[1])
+            for pos in rng.engine.groups(rng).get(('s', crit.lower()), ()):
+                hits[pos] = True
+        else:
+            test = criteria(crit)
+            hits = [test(v) for v in as_range_values(rng)]
+        mask = hits if mask is None else [m and h for m, h in zip(mask, hits)]
+    return mask
+
+
+def fn_sumif(rng, crit, sum_range=None):
+    mask = _if_ranges([(rng, crit)])
+    values = as_range_values(sum_range if sum_range is not None else rng)
+    return sum(v for v, m in zip(values, mask) if m and isinstance(v, (int, float)) and not isinstance(v, bool))
+
+
+def fn_sumifs(sum_range, *pairs):
+    mask = _if_ranges(zip(pairs[::2], pairs[1::2]))
+    values = as_range_values(sum_range)
+    return sum(v for v, m in zip(values, mask) if m and isinstance(v, (int, float)) and not isinstance(v, bool))
+
+
+def fn_countif(rng, crit):
+    return sum(_if_ranges([(rng, crit)]))
+
+
+def fn_countifs(*pairs):
+    return sum(_if_ranges(zip(pairs[::2], pairs[1::2])))
+
+
+def fn_averageif(rng, crit, avg_range=None):
+    mask = _if_ranges([(rng, crit)])
+    values = [v for v, m in zip(as_range_values(avg_range if avg_range is not None else rng), mask)
+              if m and isinstance(v, (int, float)) and not isinstance(v, bool)]
+    return sum(values) / len(values) if values else DIV0
+
+
+def fn_sumproduct(*arrays):
+    flats = [[v for row in as_array(a) for v in row] for a in arrays]
+    if len({len(f) for f in flats}) > 1:
+        return VALUE
+    total = 0
+    for cells in zip(*flats):
+        product = 1
+        for v in cells:
+            if is_error(v):
+                return v
+            # Text and logicals count as zero unless coerced, e.g. with --
+            product *= v if isinstance(v, (int, float)) and not isinstance(v, bool) else 0
+        total += product
+    return total
+
+
+def _round(value, digits, mode):
+    value, digits = to_number(value), to_number(digits)
+    if is_error(value):
+        return value
+    if is_error(digits):
+        return digits
+    factor = 10 ** int(digits)
+    scaled = value * factor
+    if mode == 'half':
+        result = math.floor(abs(scaled) + 0.5 + 1e-9) * (1 if scaled >= 0 else -1)
+    elif mode == 'up':
+        result = math.ceil(abs(scaled) - 1e-9) * (1 if scaled >= 0 else -1)
+    else:
+        result = math.floor(abs(scaled) + 1e-9) * (1 if scaled >= 0 else -1)
+    return result / factor
+
+
+def _numeric(func):
+    """Wrap a one-argument numeric function with Excel coercion"""
+    def wrapper(value):
+        value = to_number(scalar(value))
+        if is_error(value):
+            return value
+        try:
+            return func(value)
+        except (ValueError, OverflowError):
+            return NUM
+    return wrapper
+
+
+def fn_mod(a, b):
+    a, b = to_number(a), to_number(b)
+    if is_error(a):
+        return a
+    if is_error(b):
+        return b
+    return DIV0 if b == 0 else a - b * math.floor(a / b)
+
+
+def _lookup_key(value):
+    """Normalized key for exact-match lookups (case-insensitive text)"""
+    value = to_serial(value)
+    if isinstance(value, str):
+        return ('s', value.lower())
+    if isinstance(value, bool):
+        return ('b', value)
+    if value is None:
+        return ('n', 0)
+    return ('n', float(value))
+
+
+def _approx_position(values, key):
+    """Last position with value <= key in an ascending list, or None"""
+    found = None
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        if _type_rank(to_serial(v)) != _type_rank(to_serial(key)):
+            continue
+        if compare(v, key) <= 0:
+            found = i
+        else:
+            break
+    return found
+
+
+def fn_index(rng, row=None, col=None):
+    array = as_array(rng)
+    row = 0 if row is None else to_number(row)
+    col = 0 if col is None else to_number(col)
+    if is_error(row) or is_error(col):
+        return VALUE
+    row, col = int(row), int(col)
+    if len(array) == 1 and col == 0 and row > 0 and len(array[0]) > 1:
+        row, col = 1, row  # INDEX(single row, n)
+    if row == 0 and col == 0:
+        return rng
+    if row < 0 or col < 0 or row > len(array) or (array and col > len(array[0])):
+        return REF
+    if row == 0:
+        return [[r[col - 1]] for r in array]
+    if col == 0:
+        return [array[row - 1]]
+    return array[row - 1][col - 1]
+
+
+def fn_choose(index, *values):
+    index = to_number(index)
+    if is_error(index):
+        return index
+    index = int(index)
+    return values[index - 1] if 1 <= index <= len(values) else VALUE
+
+
+def fn_left(text, count=1):
+    count = to_number(count)
+    return VALUE if is_error(count) or count < 0 else to_text(text)[:int(count)]
+
+
+def fn_right(text, count=1):
+    count = to_number(count)
+    if is_error(count) or count < 0:
+        return VALUE
+    text = to_text(text)
+    return text[len(text) - int(count):] if count else ''
+
+
+def fn_mid(text, start, count):
+    start, count = to_number(start), to_number(count)
+    if is_error(start) or is_error(count) or start < 1 or count < 0:
+        return VALUE
+    return to_text(text)[int(start) - 1:int(start) - 1 + int(count)]
+
+
+def fn_find(needle, haystack, start=1, ignore_case=False):
+    needle, haystack = to_text(needle), to_text(haystack)
+    start = int(to_number(start))
+    if ignore_case:
+        needle, haystack = needle.lower(), haystack.lower()
+    pos = haystack.find(needle, start - 1)
+    return VALUE if pos < 0 else pos + 1
+
+
+def fn_value(text):
+    if isinstance(text, (int, float)) and not isinstance(text, bool):
+        return text
+    number = to_number(to_text(text).replace('€', '').replace(' ', ''))
+    return number
+
+
+def fn_date(year, month, day):
+    year, month, day = (int(to_number(v)) for v in (year, month, day))
+    if year < 1900:
+        year += 1900
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return datetime(year, month, 1) + timedelta(days=day - 1)
+
+
+def _as_datetime(value):
+    value = to_serial(value)
+    number = to_number(value)
+    if is_error(number):
+        return number
+    return EXCEL_EPOCH + timedelta(days=number)
+
+
+def fn_weekday(value, kind=1):
+    dt = _as_datetime(value)
+    if is_error(dt):
+        return dt
+    kind = int(to_number(kind))
+    python = dt.weekday()  # Monday = 0
+    if kind == 1:
+        return (python + 1) % 7 + 1
+    if kind == 2:
+        return python + 1
+    if kind == 3:
+        return python
+    return VALUE
+
+
+def fn_subtotal(kind, *args):
+    kind = int(to_number(kind)) % 100
+    funcs = {1: fn_average, 2: fn_count, 3: fn_counta, 4: fn_max, 5: fn_min, 9: fn_sum}
+    if kind not in funcs:
+        raise UnsupportedFormula(f"SUBTOTAL({kind})")
+    return funcs[kind](*args)
+
+
+def fn_text(value, fmt):
+    fmt = to_text(fmt)
+    number = to_number(value)
+    if is_error(number):
+        return to_text(value)
+    decimals = re.fullmatch(r'[#0,]*0(?:\.(0+))?', fmt)
+    if decimals:
+        places = len(decimals.group(1) or '')
+        text = f"{number:,.{places}f}" if ',' in fmt else f"{number:.{places}f}"
+        return text
+    raise UnsupportedFormula(f"TEXT format {fmt!r}")
+
+
+FUNCTIONS = {
+    'SUM': fn_sum,
+    'AVERAGE': fn_average,
+    'MIN': fn_min,
+    'MAX': fn_max,
+    'COUNT': fn_count,
+    'COUNTA': fn_counta,
+    'COUNTBLANK': fn_countblank,
+    'SUMIF': fn_sumif,
+    'SUMIFS': fn_sumifs,
+    'COUNTIF': fn_countif,
+    'COUNTIFS': fn_countifs,
+    'AVERAGEIF': fn_averageif,
+    'SUMPRODUCT': fn_sumproduct,
+    'SUBTOTAL': fn_subtotal,
+    'ROUND': lambda v, d=0: _round(scalar(v), scalar(d), 'half'),
+    'ROUNDUP': lambda v, d=0: _round(scalar(v), scalar(d), 'up'),
+    'ROUNDDOWN': lambda v, d=0: _round(scalar(v), scalar(d), 'down'),
+    'INT': _numeric(lambda v: math.floor(v)),
+    'ABS': _numeric(abs),
+    'SQRT': _numeric(math.sqrt),
+    'MOD': lambda a, b: fn_mod(scalar(a), scalar(b)),
+    'NOT': lambda v: (lambda b: b if is_error(b) else not b)(to_bool(scalar(v))),
+    'ISBLANK': lambda v: scalar(v) is None,
+    'ISNUMBER': lambda v: isinstance(scalar(v), (int, float)) and not isinstance(scalar(v), bool),
+    'ISTEXT': lambda v: isinstance(scalar(v), str) and not is_error(scalar(v)),
+    'ISERROR': lambda v: is_error(scalar(v)),
+    'ISERR': lambda v: is_error(scalar(v)) and scalar(v) != NA,
+    'ISNA': lambda v: scalar(v) == NA,
+    'N': lambda v: (lambda s: s if isinstance(s, (int, float)) and not isinstance(s, bool)
+                    else int(s) if isinstance(s, bool) else 0)(scalar(v)),
+    'INDEX': fn_index,
+    'CHOOSE': lambda i, *v: fn_choose(scalar(i), *v),
+    'LEFT': lambda t, n=1: fn_left(scalar(t), scalar(n)),
+    'RIGHT': lambda t, n=1: fn_right(scalar(t), scalar(n)),
+    'MID': lambda t, s, n: fn_mid(scalar(t), scalar(s), scalar(n)),
+    'LEN': lambda t: len(to_text(scalar(t))),
+    'TRIM': lambda t: ' '.join(to_text(scalar(t)).split()),
+    'UPPER': lambda t: to_text(scalar(t)).upper(),
+    'LOWER': lambda t: to_text(scalar(t)).lower(),
+    'FIND': lambda n, h, s=1: fn_find(scalar(n), scalar(h), scalar(s)),
+    'SEARCH': lambda n, h, s=1: fn_find(scalar(n), scalar(h), scalar(s), ignore_case=True),
+    'SUBSTITUTE': lambda t, o, n: to_text(scalar(t)).replace(to_text(scalar(o)), to_text(scalar(n))),
+    'CONCATENATE': lambda *a: ''.join(to_text(scalar(v)) for v in a),
+    'CONCAT': lambda *a: ''.join(to_text(v) for x in a for v in as_range_values(x)),
+    'VALUE': lambda t: fn_value(scalar(t)),
+    'TEXT': lambda v, f: fn_text(scalar(v), scalar(f)),
+    'DATE': lambda y, m, d: fn_date(scalar(y), scalar(m), scalar(d)),
+    'YEAR': lambda v: (lambda d: d if is_error(d) else d.year)(_as_datetime(scalar(v))),
+    'MONTH': lambda v: (lambda d: d if is_error(d) else d.month)(_as_datetime(scalar(v))),
+    'DAY': lambda v: (lambda d: d if is_error(d) else d.day)(_as_datetime(scalar(v))),
+    'WEEKDAY': lambda v, k=1: fn_weekday(scalar(v), scalar(k)),
+    'TODAY': lambda: datetime.combine(date.today(), dtime()),
+    'NOW': lambda: datetime.now(),
+}
+
+# Functions that evaluate their own arguments (short-circuiting)
+LAZY_FUNCTIONS = {'IF', 'IFERROR', 'IFNA', 'AND', 'OR', 'VLOOKUP', 'HLOOKUP', 'MATCH', 'ROW', 'COLUMN'}
+
+# Functions that inspect error arguments instead of propagating them
+ERROR_AWARE_FUNCTIONS = {'ISERROR', 'ISERR', 'ISNA', 'ISBLANK', 'ISNUMBER', 'ISTEXT'}
+
+
+# --- Engine ----------------------------------------------------------------
+
+def _stored_cells(ws):
+    """Yield ((row, col), value) for the cells a worksheet actually holds.
+
+    iter_rows() would create a Cell object for every empty position of
+    the used area, so the cell store is read directly.
+    """
+    for (r, c), cell in ws._cells.items():
+        yield (r, c), cell.value
+
+
+class FormulaEngine:
+    """Recalculates a workbook's formulas from its openpyxl views.
+
+    formula_wb is the workbook loaded normally (formulas as text),
+    cached_wb the same file loaded with data_only=True. Sheets are read
+    on first use. recalc() recomputes the cells downstream of the given
+    ranges, plus formula cells that have no cached value; value() then
+    returns the current value of any cell.
+    """
+
+    def __init__(self, formula_wb, cached_wb=None):
+        self.formula_wb = formula_wb
+        self.cached_wb = cached_wb
+        self.sheetnames = list(formula_wb.sheetnames)
+        self._values = {}  # sheet -> {(row, col): value}
+        self._formulas = {}  # sheet -> {(row, col): formula text}
+        self._extent = {}  # sheet -> (max row, max col)
+        self._ast = {}  # (sheet, row, col) -> parsed formula
+        self._pending = set()  # formula cells whose value must be recomputed
+        self._active = set()  # cells being evaluated, for cycle detection
+        self._blocks = {}  # (sheet, r1, c1, r2, c2) -> 2-D values
+        self._lookups = {}  # (sheet, r1, c1, r2, c2, offset, axis) -> {key: position}
+        self._names = None
+        self._dependents = None
+        self._changed = []  # ranges written since the cached values were saved
+        self._resolved = {}  # formula cell -> stale?, for lazy evaluation
+        self._formula_columns = {}  # sheet -> {col: sorted formula rows}
+        self.evaluated = 0
+
+    # Sheet data
+
+    def _sheet(self, sheet):
+        if sheet not in self._values:
+            if sheet not in self.sheetnames:
+                raise KeyError(sheet)
+            values, formulas = {}, {}
+            ws = self.formula_wb[sheet]
+            max_row, max_col = ws.max_row, ws.max_column
+            for (r, c), value in _stored_cells(ws):
+                if value is None:
+                    continue
+                text = getattr(value, 'text', value)  # ArrayFormula keeps its text apart
+                if isinstance(text, str) and text.startswith('='):
+                    formulas[(r, c)] = text
+                elif not hasattr(value, 'text'):
+                    values[(r, c)] = value
+            if self.cached_wb is not None and formulas and sheet in self.cached_wb.sheetnames:
+                cached = dict(_stored_cells(self.cached_wb[sheet]))
+                for (r, c) in formulas:
+                    value = cached.get((r, c))
+                    if value is None:
+                        self._pending.add((sheet, r, c))
+                    else:
+                        values[(r, c)] = ERRORS.get(value, value) if isinstance(value, str) else value
+            else:
+                self._pending.update((sheet, r, c) for r, c in formulas)
+            self._values[sheet] = values
+            self._formulas[sheet] = formulas
+            self._extent[sheet] = (max_row, max_col)
+        return self._values[sheet]
+
+    def extent(self, sheet):
+        self._sheet(sheet)
+        return self._extent[sheet]
+
+    def formula(self, sheet, row, col):
+        self._sheet(sheet)
+        return self._formulas[sheet].get((row, col))
+
+    def set_value(self, sheet, row, col, value):
+        """Overwrite a constant cell, e.g. after pasting new data"""
+        self._sheet(sheet)[(row, col)] = value
+        self._forget_blocks(sheet, row, col)
+
+    def set_values(self, sheet, r1, c1, rows):
+        """Overwrite a block of constant cells starting at (r1, c1)"""
+        values = self._sheet(sheet)
+        width = 0
+        for i, row in enumerate(rows):
+            for j, v in enumerate(row):
+                values[(r1 + i, c1 + j)] = v
+            width = max(width, len(row))
+        r2, c2 = r1 + len(rows) - 1, c1 + width - 1
+        for cache in (self._blocks, self._lookups):
+            stale = [k for k in cache if k[0] == sheet and k[1] <= r2 and r1 <= k[3] and k[2] <= c2 and c1 <= k[4]]
+            for k in stale:
+                del cache[k]
+
+    def value(self, sheet, row, col):
+        """Current value of a cell, computing it first if it is pending"""
+        values = self._sheet(sheet)
+        key = (sheet, row, col)
+        if self._changed and key not in self._resolved and (row, col) in self._formulas[sheet]:
+            self.evaluate_cells([key])
+        if key in self._pending:
+            self._compute(key)
+        return values.get((row, col))
+
+    def block(self, sheet, r1, c1, r2, c2):
+        key = (sheet, r1, c1, r2, c2)
+        cached = self._blocks.get(key)
+        if cached is not None:
+            return cached
+        values = self._sheet(sheet)
+        pending = [(r, c) for s, r, c in self._pending if s == sheet and r1 <= r <= r2 and c1 <= c <= c2]
+        for r, c in sorted(pending):
+            self._compute((sheet, r, c))
+        rows = [[values.get((r, c)) for c in range(c1, c2 + 1)] for r in range(r1, r2 + 1)]
+        self._blocks[key] = rows
+        return rows
+
+    def _forget_blocks(self, sheet, row, col):
+        for cache in (self._blocks, self._lookups):
+            stale = [k for k in cache if k[0] == sheet and k[1] <= row <= k[3] and k[2] <= col <= k[4]]
+            for k in stale:
+                del cache[k]
+
+    # Dependency graph
+
+    def _parsed(self, key):
+        ast = self._ast.get(key)
+        if ast is None:
+            ast = parse_formula(self.formula(*key), key[0])
+            self._ast[key] = ast
+        return ast
+
+    def precedents(self, key):
+        """Ranges a formula cell reads, as (sheet, r1, c1, r2, c2)"""
+        result = []
+        for node in references(self._parsed(key)):
+            if node[0] == 'ref':
+                result.append(node[1:])
+            else:
+                target = self._resolve_name(node[1])
+                if target is not None:
+                    result.append(target[1:])
+        return result
+
+    def _build_dependents(self):
+        """Index every formula cell by the ranges it reads.
+
+        Small ranges are expanded to single cells; larger ones are kept as
+        row intervals per column, or in a per-sheet list when very wide.
+        """
+        small, columns, wide = {}, {}, {}
+        for sheet in self.sheetnames:
+            self._sheet(sheet)
+            for (r, c) in self._formulas[sheet]:
+                key = (sheet, r, c)
+                try:
+                    ranges = self.precedents(key)
+                except UnsupportedFormula:
+                    continue  # Only matters if the cell has to be recomputed
+                for s, r1, c1, r2, c2 in ranges:
+                    if (r2 - r1 + 1) * (c2 - c1 + 1) <= 64:
+                        for rr in range(r1, r2 + 1):
+                            for cc in range(c1, c2 + 1):
+                                small.setdefault((s, rr, cc), []).append(key)
+                    elif c2 - c1 < 256:
+                        for cc in range(c1, c2 + 1):
+                            columns.setdefault((s, cc), []).append((r1, r2, key))
+                    else:
+                        wide.setdefault(s, []).append((r1, c1, r2, c2, key))
+        self._dependents = (small, columns, wide)
+
+    def dependents(self, sheet, r1, c1, r2, c2):
+        """Formula cells reading any cell of the given range"""
+        if self._dependents is None:
+            self._build_dependents()
+        small, columns, wide = self._dependents
+        found = set()
+        if (r2 - r1 + 1) * (c2 - c1 + 1) <= 4096:
+            for r in range(r1, r2 + 1):
+                for c in range(c1, c2 + 1):
+                    found.update(small.get((sheet, r, c), ()))
+        else:
+            for (s, r, c), keys in small.items():
+                if s == sheet and r1 <= r <= r2 and c1 <= c <= c2:
+                    found.update(keys)
+        max_col = min(c2, self.extent(sheet)[1]) if sheet in self.sheetnames else c2
+        for c in range(c1, max_col + 1):
+            for rr1, rr2, key in columns.get((sheet, c), ()):
+                if rr1 <= r2 and r1 <= rr2:
+                    found.add(key)
+        for rr1, cc1, rr2, cc2, key in wide.get(sheet, ()):
+            if rr1 <= r2 and r1 <= rr2 and cc1 <= c2 and c1 <= cc2:
+                found.add(key)
+        return found
+
+    def recalc(self, changed_ranges):
+        """Recompute every formula downstream of changed_ranges.
+
+        changed_ranges is a list of (sheet, r1, c1, r2, c2). Formula cells
+        without a cached value are recomputed as well. Returns the set of
+        recomputed cells.
+        """
+        for sheet in self.sheetnames:
+            self._sheet(sheet)
+        dirty = set()
+        frontier = set(self._pending)
+        for rng in changed_ranges:
+            frontier |= self.dependents(*rng)
+        while frontier:
+            key = frontier.pop()
+            dirty.add(key)
+            for dep in self.dependents(key[0], key[1], key[2], key[1], key[2]):
+                if dep not in dirty:
+                    frontier.add(dep)
+
+        self._pending |= dirty
+        self._blocks.clear()
+        self._lookups.clear()
+        for key in self._order(dirty):
+            if key in self._pending:
+                self._compute(key)
+        logger.info(f"Recalculated {len(dirty)} formula cells")
+        return dirty
+
+    # Lazy evaluation
+
+    def mark_changed(self, changed_ranges):
+        """Record written ranges for lazy evaluation, nothing is computed yet"""
+        self._changed.extend(changed_ranges)
+        self._resolved.clear()
+
+    def evaluate_cells(self, cells, changed_ranges=()):
+        """Bring only the given cells up to date.
+
+        Walks the precedents of cells, marks a formula stale when it reads
+        a changed range, a stale formula, or has no cached value, and
+        recomputes just the stale part of that subgraph. Results and
+        staleness are memoized, so overlapping calls share the work.
+        Returns the number of formulas computed.
+        """
+        if changed_ranges:
+            self.mark_changed(changed_ranges)
+        stale = self._stale_subgraph(cells)
+        self._pending |= set(stale)
+        before = self.evaluated
+        for key in stale:
+            if key in self._pending:
+                self._compute(key)
+        return self.evaluated - before
+
+    def _formula_cells_in(self, sheet, r1, c1, r2, c2):
+        """Formula cells inside a range, found through a per-column index"""
+        if sheet not in self.sheetnames:
+            return []
+        columns = self._formula_columns.get(sheet)
+        if columns is None:
+            columns = {}
+            self._sheet(sheet)
+            for r, c in self._formulas[sheet]:
+                columns.setdefault(c, []).append(r)
+            for rows in columns.values():
+                rows.sort()
+            self._formula_columns[sheet] = columns
+        found = []
+        for c, rows in columns.items():
+            if c1 <= c <= c2:
+                found.extend((sheet, r, c) for r in rows[bisect_left(rows, r1):bisect_right(rows, r2)])
+        return found
+
+    def _touches_changes(self, sheet, r1, c1, r2, c2):
+        return any(s == sheet and rr1 <= r2 and r1 <= rr2 and cc1 <= c2 and c1 <= cc2
+                   for s, rr1, cc1, rr2, cc2 in self._changed)
+
+    def _stale_subgraph(self, cells):
+        """Stale formula cells reachable from cells, precedents first"""
+        order, active = [], set()
+        for start in cells:
+            self._sheet(start[0])
+            if start in self._resolved or (start[1], start[2]) not in self._formulas[start[0]]:
+                continue
+            stack = [(start, None)]
+            while stack:
+                key, inputs = stack.pop()
+                if inputs is not None:
+                    # All precedents resolved, decide this cell
+                    active.discard(key)
+                    stale = key in self._pending or any(self._resolved.get(p) for p in inputs[1])
+                    stale = stale or any(self._touches_changes(*rng) for rng in inputs[0])
+                    self._resolved[key] = stale
+                    if stale:
+                        order.append(key)
+                    continue
+                if key in self._resolved or key in active:
+                    continue  # Done already, or a circular reference
+                active.add(key)
+                ranges = self.precedents(key)
+                formula_inputs = [p for rng in ranges for p in self._formula_cells_in(*rng)]
+                stack.append((key, (ranges, formula_inputs)))
+                stack.extend((p, None) for p in formula_inputs if p not in self._resolved and p not in active)
+        return order
+
+    def _order(self, cells):
+        """Cells sorted so that precedents come before dependents"""
+        order, state = [], {}
+        members, by_col = {}, {}
+        for s, r, c in cells:
+            members.setdefault(s, set()).add((r, c))
+            by_col.setdefault(s, {}).setdefault(c, []).append(r)
+        for columns in by_col.values():
+            for rows in columns.values():
+                rows.sort()
+
+        def inside(s, r1, c1, r2, c2):
+            cells_in_sheet = members.get(s, ())
+            if (r2 - r1 + 1) * (c2 - c1 + 1) <= len(cells_in_sheet):
+                return [(s, r, c) for r in range(r1, r2 + 1) for c in range(c1, c2 + 1) if (r, c) in cells_in_sheet]
+            found = []
+            for c, rows in by_col.get(s, {}).items():
+                if c1 <= c <= c2:
+                    found.extend((s, r, c) for r in rows[bisect_left(rows, r1):bisect_right(rows, r2)])
+            return found
+
+        for start in sorted(cells):
+            if start in state:
+                continue
+            stack = [(start, False)]
+            while stack:
+                key, expanded = stack.pop()
+                if expanded:
+                    state[key] = 'done'
+                    order.append(key)
+                    continue
+                if state.get(key):
+                    continue
+                state[key] = 'active'
+                stack.append((key, True))
+                try:
+                    ranges = self.precedents(key)
+                except UnsupportedFormula:
+                    continue
+                for rng in ranges:
+                    stack.extend((dep, False) for dep in inside(*rng) if dep not in state)
+        return order
+
+    def _compute(self, key):
+        if key in self._active:
+            logger.warning(f"Circular reference at {key[0]}!{get_column_letter(key[2])}{key[1]}")
+            return
+        self._active.add(key)
+        try:
+            result = scalar(self.evaluate(self._parsed(key), key))
+            if result is None:
+                result = 0  # A formula pointing at an empty cell shows 0
+            self.evaluated += 1
+        finally:
+            self._active.discard(key)
+        self._pending.discard(key)
+        sheet, row, col = key
+        self._values[sheet][(row, col)] = result
+        self._forget_blocks(sheet, row, col)
+
+    # Evaluation
+
+    def _resolve_name(self, name):
+        if self._names is None:
+            self._names = {}
+            defined = self.formula_wb.defined_names
+            items = defined.items() if hasattr(defined, 'items') else ((d.name, d) for d in defined.definedName)
+            for key, definition in items:
+                try:
+                    destinations = list(definition.destinations)
+                except Exception:
+                    continue  # Constants and formulas are not supported as names
+                if len(destinations) == 1:
+                    sheet, coord = destinations[0]
+                    ref = _parse_ref(coord.replace('$', ''), sheet)
+                    if ref is not None:
+                        self._names[key.upper()] = ref
+        return self._names.get(name.upper())
+
+    def evaluate(self, node, cell):
+        kind = node[0]
+        if kind == 'lit':
+            return node[1]
+        if kind == 'empty':
+            return None
+        if kind == 'ref':
+            _, sheet, r1, c1, r2, c2 = node
+            if sheet not in self.sheetnames:
+                return REF
+            if r1 == r2 and c1 == c2:
+                return self.value(sheet, r1, c1)
+            return Range(self, sheet, r1, c1, r2, c2)
+        if kind == 'name':
+            ref = self._resolve_name(node[1])
+            if ref is None:
+                raise UnsupportedFormula(f"Unknown name {node[1]!r}")
+            return self.evaluate(ref, cell)
+        if kind == 'neg':
+            value = self.evaluate(node[1], cell)
+            if isinstance(value, (Range, list)):
+                return binary('*', value, -1)
+            number = to_number(value)
+            return number if is_error(number) else -number
+        if kind == 'pct':
+            return binary('/', self.evaluate(node[1], cell), 100)
+        if kind == 'op':
+            return binary(node[1], self.evaluate(node[2], cell), self.evaluate(node[3], cell))
+        if kind == 'func':
+            return self.call(node[1], node[2], cell)
+        raise UnsupportedFormula(f"Node {kind}")
+
+    def call(self, name, args, cell):
+        if name in LAZY_FUNCTIONS:
+            return getattr(self, f"fn_{name.lower()}")(args, cell)
+        func = FUNCTIONS.get(name)
+        if func is None:
+            raise UnsupportedFormula(f"Function {name} is not supported")
+        values = [self.evaluate(arg, cell) for arg in args]
+        if name not in ERROR_AWARE_FUNCTIONS:
+            for v in values:
+                if is_error(v):
+                    return v
+        try:
+            return func(*values)
+        except TypeError as e:
+            raise UnsupportedFormula(f"{name} with {len(args)} arguments: {e}")
+
+    def fn_if(self, args, cell):
+        test = to_bool(scalar(self.evaluate(args[0], cell)))
+        if is_error(test):
+            return test
+        if test:
+            return self.evaluate(args[1], cell) if len(args) > 1 else True
+        return self.evaluate(args[2], cell) if len(args) > 2 else False
+
+    def fn_iferror(self, args, cell):
+        value = scalar(self.evaluate(args[0], cell))
+        return self.evaluate(args[1], cell) if is_error(value) else value
+
+    def fn_ifna(self, args, cell):
+        value = scalar(self.evaluate(args[0], cell))
+        return self.evaluate(args[1], cell) if value == NA else value
+
+    def _logical(self, args, cell):
+        for arg in args:
+            value = self.evaluate(arg, cell)
+            for v in (as_range_values(value) if isinstance(value, (Range, list)) else [value]):
+                if isinstance(value, (Range, list)) and (v is None or isinstance(v, str)):
+                    continue
+                yield to_bool(v)
+
+    def fn_and(self, args, cell):
+        results = list(self._logical(args, cell))
+        error = _first_error(results)
+        return error if error else all(results)
+
+    def fn_or(self, args, cell):
+        results = list(self._logical(args, cell))
+        error = _first_error(results)
+        return error if error else any(results)
+
+    def fn_row(self, args, cell):
+        if not args:
+            return cell[1]
+        node = args[0]
+        return node[2] if node[0] == 'ref' else VALUE
+
+    def fn_column(self, args, cell):
+        if not args:
+            return cell[2]
+        node = args[0]
+        return node[3] if node[0] == 'ref' else VALUE
+
+    def groups(self, rng):
+        """{lookup key: [flat positions]} of a range, cached like lookups"""
+        key = (rng.sheet, rng.r1, rng.c1, rng.r2, rng.c2, None, 'groups')
+        groups = self._lookups.get(key)
+        if groups is None:
+            groups = {}
+            for pos, v in enumerate(rng.flat()):
+                if v is not None:
+                    groups.setdefault(_lookup_key(v), []).append(pos)
+            self._lookups[key] = groups
+        return groups
+
+    def _exact_index(self, rng, offset, axis):
+        """{key: first position} for exact matches along one line of a range"""
+        key = (rng.sheet, rng.r1, rng.c1, rng.r2, rng.c2, offset, axis)
+        index = self._lookups.get(key)
+        if index is None:
+            rows = rng.rows()
+            line = [row[offset] for row in rows] if axis == 'col' else rows[offset]
+            index = {}
+            for pos, v in enumerate(line):
+                if v is not None:
+                    index.setdefault(_lookup_key(v), pos)
+            self._lookups[key] = index
+        return index
+
+    def _lookup(self, args, cell, axis):
+        needle = scalar(self.evaluate(args[0], cell))
+        table = self.evaluate(args[1], cell)
+        offset = to_number(scalar(self.evaluate(args[2], cell)))
+        exact = False
+        if len(args) > 3:
+            # VLOOKUP(a, b, 2, ) with the flag left empty means FALSE
+            exact = args[3][0] == 'empty' or not to_bool(scalar(self.evaluate(args[3], cell)))
+        if is_error(needle):
+            return needle
+        if is_error(offset):
+            return offset
+        offset = int(offset)
+        rows = table.rows() if isinstance(table, Range) else as_array(table)
+        if exact and isinstance(table, Range) and not (isinstance(needle, str) and any(ch in needle for ch in '*?')):
+            pos = self._exact_index(table, 0, axis).get(_lookup_key(needle))
+        else:
+            line = [row[0] for row in rows] if axis == 'col' else rows[0]
+            if exact:
+                test = criteria(needle) if isinstance(needle, str) else (lambda v: compare(v, needle) == 0)
+                pos = next((i for i, v in enumerate(line) if v is not None and test(v)), None)
+            else:
+                pos = _approx_position(line, needle)
+        if pos is None:
+            return NA
+        width = len(rows[0]) if axis == 'col' else len(rows)
+        if offset < 1 or offset > width:
+            return REF
+        return rows[pos][offset - 1] if axis == 'col' else rows[offset - 1][pos]
+
+    def fn_vlookup(self, args, cell):
+        return self._lookup(args, cell, 'col')
+
+    def fn_hlookup(self, args, cell):
+        return self._lookup(args, cell, 'row')
+
+    def fn_match(self, args, cell):
+        needle = scalar(self.evaluate(args[0], cell))
+        haystack = self.evaluate(args[1], cell)
+        kind = to_number(scalar(self.evaluate(args[2], cell))) if len(args) > 2 and args[2][0] != 'empty' else 1
+        if is_error(needle):
+            return needle
+        values = as_range_values(haystack)
+        if kind == 0:
+            if isinstance(haystack, Range) and not (isinstance(needle, str) and any(ch in needle for ch in '*?')):
+                axis = 'col' if haystack.shape[1] == 1 else 'row'
+                pos = self._exact_index(haystack, 0, axis).get(_lookup_key(needle))
+            else:
+                test = criteria(needle) if isinstance(needle, str) else (lambda v: compare(v, needle) == 0)
+                pos = next((i for i, v in enumerate(values) if v is not None and test(v)), None)
+        elif kind > 0:
+            pos = _approx_position(values, needle)
+        else:
+            pos = None
+            for i, v in enumerate(values):
+                if v is not None and compare(v, needle) >= 0:
+                    pos = i
+                else:
+                    break
+        return NA if pos is None else pos + 1
+
+    # Verification
+
+    def verify(self, sheets=None, rel_tol=1e-9, abs_tol=1e-6):
+        """Recompute every formula and compare with the values Excel saved.
+
+        Returns a list of (cell, cached, computed) mismatches. Cells with
+        unsupported formulas are reported with computed set to the error.
+        Cells depending on TODAY()/NOW() are skipped and counted in
+        self.skipped.
+        """
+        sheets = sheets or self.sheetnames
+        cached = {}
+        for sheet in sheets:
+            values = self._sheet(sheet)
+            for (r, c) in self._formulas[sheet]:
+                key = (sheet, r, c)
+                if key not in self._pending and (r, c) in values:
+                    cached[key] = values[(r, c)]
+        volatile = self._volatile()
+        self.skipped = len(volatile & set(cached))
+        self._pending |= set(cached)
+        self._blocks.clear()
+        self._lookups.clear()
+
+        mismatches = []
+        for key in self._order(set(cached)):
+            try:
+                computed = self.value(*key)
+            except UnsupportedFormula as e:
+                mismatches.append((key, cached[key], UnsupportedFormula(str(e))))
+                self._pending.discard(key)
+                self._values[key[0]][(key[1], key[2])] = cached[key]
+                continue
+            if key not in volatile and not values_match(cached[key], computed, rel_tol, abs_tol):
+                mismatches.append((key, cached[key], computed))
+        return mismatches
+
+    def _volatile(self):
+        """Formula cells that depend on TODAY() or NOW()"""
+        frontier = set()
+        for sheet in self.sheetnames:
+            for (r, c), text in self._formulas[sheet].items():
+                if re.search(r'\b(TODAY|NOW)\(', text, re.I):
+                    frontier.add((sheet, r, c))
+        volatile = set()
+        while frontier:
+            key = frontier.pop()
+            volatile.add(key)
+            frontier |= self.dependents(key[0], key[1], key[2], key[1], key[2]) - volatile
+        return volatile
+
+
+def values_match(expected, actual, rel_tol=1e-9, abs_tol=1e-6):
+    """Compare a value saved by Excel with a computed one"""
+    if expected in (None, '') and actual in (None, ''):
+        return True
+    expected, actual = to_serial(expected), to_serial(actual)
+    if isinstance(expected, bool) or isinstance(actual, bool):
+        return expected == actual
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return math.isclose(expected, actual, rel_tol=rel_tol, abs_tol=abs_tol)
+    return str(expected) == str(actual)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} WORKBOOK [SHEET ...]")
+        sys.exit(2)
+
+    path, sheets = sys.argv[1], sys.argv[2:] or None
+    engine = FormulaEngine(load_workbook(path), load_workbook(path, data_only=True))
+    mismatches = engine.verify(sheets)
+    checked = sum(len(engine._formulas[s]) for s in (sheets or engine.sheetnames)) - engine.skipped
+    for (sheet, row, col), expected, actual in mismatches[:50]:
+        logger.info(f"{sheet}!{get_column_letter(col)}{row}: Excel {expected!r}, engine {actual!r}")
+    logger.info(f"{checked - len(mismatches)} of {checked} formula cells match the values Excel saved "
+                f"({engine.skipped} cells depending on TODAY()/NOW() skipped)")
+    sys.exit(1 if mismatches else 0)
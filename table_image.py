@@ -0,0 +1,652 @@
+"""Headless rendering of a worksheet range to PNG.
+
+An alternative to Excel's CopyPicture/Paste. It is not used by
+automate_process.py's step 7 yet, because List2 is only right after the
+'sortiraj' macro has run. The range is read from openpyxl
+(values, fonts, fills, borders, alignment, number formats, merged cells,
+column widths and row heights), drawn with Pillow and anchored into a
+sheet as an openpyxl image. Nothing here needs Excel or a clipboard.
+
+A table is rendered in two steps: table_spec() turns the openpyxl range
+into a plain, picklable description and render_table() draws it. Render
+a range of a workbook to a file with:
+
+    python table_image.py "poročanje proizvodnje2025.xlsm" List2 B1:L27 list2.png
+"""
+import calendar
+import colorsys
+import io
+import logging
+import math
+import os
+import re
+import sys
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, time as dtime, timedelta
+from functools import lru_cache
+
+from openpyxl.styles.colors import COLOR_INDEX
+from openpyxl.styles.numbers import is_date_format
+from openpyxl.utils import column_index_from_string, range_boundaries
+
+logger = logging.getLogger(__name__)
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+DEFAULT_COLUMN_PX = 64  # 8.43 characters of Calibri 11
+DEFAULT_ROW_PT = 15
+AUTO_ROW_FACTOR = 1.34  # Excel's auto-fit row height per point of font size
+GRIDLINE = (217, 217, 217)
+BORDER_WIDTHS = {'hair': 1, 'thin': 1, 'dotted': 1, 'dashed': 1, 'dashDot': 1, 'dashDotDot': 1,
+                 'medium': 2, 'mediumDashed': 2, 'mediumDashDot': 2, 'mediumDashDotDot': 2,
+                 'slantDashDot': 2, 'thick': 3, 'double': 3}
+# Office theme, used when the workbook does not carry its own
+DEFAULT_THEME = ['FFFFFF', '000000', 'E7E6E6', '44546A', '4472C4', 'ED7D31',
+                 'A5A5A5', 'FFC000', '5B9BD5', '70AD47', '0563C1', '954F72']
+FONT_DIRS = [os.path.join(os.environ.get('WINDIR', r'C:\Windows'), 'Fonts'),
+             '/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.fonts'),
+             '/Library/Fonts', '/System/Library/Fonts']
+# Font files per family as (regular, bold, italic, bold italic)
+FONT_FILES = {
+    'calibri': ('calibri.ttf', 'calibrib.ttf', 'calibrii.ttf', 'calibriz.ttf'),
+    'arial': ('arial.ttf', 'arialbd.ttf', 'ariali.ttf', 'arialbi.ttf'),
+    'tahoma': ('tahoma.ttf', 'tahomabd.ttf', 'tahoma.ttf', 'tahomabd.ttf'),
+    'times new roman': ('times.ttf', 'timesbd.ttf', 'timesi.ttf', 'timesbi.ttf'),
+    'liberation sans': ('LiberationSans-Regular.ttf', 'LiberationSans-Bold.ttf',
+                        'LiberationSans-Italic.ttf', 'LiberationSans-BoldItalic.ttf'),
+    'carlito': ('Carlito-Regular.ttf', 'Carlito-Bold.ttf', 'Carlito-Italic.ttf', 'Carlito-BoldItalic.ttf'),
+    'dejavu sans': ('DejaVuSans.ttf', 'DejaVuSans-Bold.ttf', 'DejaVuSans-Oblique.ttf', 'DejaVuSans-BoldOblique.ttf'),
+}
+FALLBACK_FONTS = ['carlito', 'liberation sans', 'dejavu sans']  # Carlito has Calibri's metrics
+
+
+# Number formats
+
+def _split_sections(fmt):
+    sections, current, quoted = [], [], False
+    for ch in fmt:
+        if ch == '"':
+            quoted = not quoted
+        if ch == ';' and not quoted:
+            sections.append(''.join(current))
+            current = []
+        else:
+            current.append(ch)
+    sections.append(''.join(current))
+    return sections
+
+
+FORMAT_TOKEN_RE = re.compile(r'"[^"]*"|\\.|_.|\*.|\[[^\]]*\]|[0#?,.]+|.', re.S)
+DATE_TOKEN_RE = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]|yyyy|yy|mmmmm|mmmm|mmm|mm|m|dddd|ddd|dd|d|'
+                           r'hh|h|ss|s|AM/PM|am/pm|\.0+|.', re.I | re.S)
+
+
+def general_number(x, decimal_sep=','):
+    """A number the way Excel's General format shows it"""
+    if x == int(x) and abs(x) < 1e11:
+        return str(int(x))
+    if abs(x) >= 1e11 or abs(x) < 1e-9:
+        text = f"{x:.5E}".replace('E+0', 'E+').replace('E-0', 'E-')
+        mantissa, exponent = text.split('E')
+        text = mantissa.rstrip('0').rstrip('.') + 'E' + exponent
+    else:
+        digits = max(0, 10 - max(0, int(math.floor(math.log10(abs(x)))) + 1))
+        text = f"{x:.{digits}f}".rstrip('0').rstrip('.')
+    return text.replace('.', decimal_sep)
+
+
+def _number_pattern(x, pattern, decimal_sep, thousands_sep):
+    int_part, _, dec_part = pattern.partition('.')
+    grouped = ',' in int_part.strip(',')
+    scale = len(int_part) - len(int_part.rstrip(','))  # trailing commas divide by 1000
+    x = x / 1000 ** scale
+    int_part = int_part.replace(',', '')
+    decimals = sum(1 for ch in dec_part if ch in '0#?')
+    min_decimals = sum(1 for ch in dec_part if ch == '0')
+    text = f"{x:.{decimals}f}"
+    whole, _, frac = text.partition('.')
+    if frac and len(frac) > min_decimals:
+        frac = frac[:min_decimals] + frac[min_decimals:].rstrip('0')
+    min_digits = int_part.count('0')
+    whole = whole.lstrip('0')
+    whole = whole.rjust(min_digits, '0')
+    if grouped and whole:
+        groups = []
+        while len(whole) > 3:
+            groups.insert(0, whole[-3:])
+            whole = whole[:-3]
+        whole = thousands_sep.join([whole] + groups)
+    return whole + (decimal_sep + frac if frac else '')
+
+
+def _date_text(value, section):
+    tokens = DATE_TOKEN_RE.findall(section)
+    twelve_hour = any(t.upper() == 'AM/PM' for t in tokens)
+    out = []
+    for i, tok in enumerate(tokens):
+        low = tok.lower()
+        if tok.startswith('"'):
+            out.append(tok[1:-1])
+        elif tok.startswith('\\'):
+            out.append(tok[1:])
+        elif tok.startswith('['):
+            continue
+        elif low in ('m', 'mm'):
+            # Minutes after an hour or before seconds, month otherwise
+            before = next((t.lower() for t in reversed(tokens[:i]) if t[0].lower() in 'hdys'), '')
+            after = next((t.lower() for t in tokens[i + 1:] if t[0].lower() in 'hdys'), '')
+            if before.startswith('h') or after.startswith('s'):
+                out.append(f"{value.minute:0{len(tok)}d}")
+            else:
+                out.append(f"{value.month:0{len(tok)}d}")
+        elif low == 'mmm':
+            out.append(calendar.month_abbr[value.month])
+        elif low == 'mmmm':
+            out.append(calendar.month_name[value.month])
+        elif low == 'mmmmm':
+            out.append(calendar.month_name[value.month][:1])
+        elif low in ('d', 'dd'):
+            out.append(f"{value.day:0{len(tok)}d}")
+        elif low == 'ddd':
+            out.append(calendar.day_abbr[value.weekday()])
+        elif low == 'dddd':
+            out.append(calendar.day_name[value.weekday()])
+        elif low == 'yy':
+            out.append(f"{value.year % 100:02d}")
+        elif low == 'yyyy':
+            out.append(f"{value.year:04d}")
+        elif low in ('h', 'hh'):
+            hour = value.hour % 12 or 12 if twelve_hour else value.hour
+            out.append(f"{hour:0{len(tok)}d}")
+        elif low in ('s', 'ss'):
+            out.append(f"{value.second:0{len(tok)}d}")
+        elif low == 'am/pm':
+            out.append('AM' if value.hour < 12 else 'PM')
+        elif low.startswith('.0'):
+            out.append(f"{value.microsecond / 1e6:.{len(tok) - 1}f}"[1:])
+        else:
+            out.append(tok)
+    return ''.join(out)
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, dtime):
+        return datetime.combine(EXCEL_EPOCH.date(), value)
+    if isinstance(value, timedelta):
+        return EXCEL_EPOCH + value
+    return EXCEL_EPOCH + timedelta(days=float(value))
+
+
+def format_value(value, number_format='General', decimal_sep=',', thousands_sep='.'):
+    """Text Excel shows for value under number_format.
+
+    Format codes always use '.' and ',', the separators shown are
+    decimal_sep and thousands_sep (Slovenian settings by default).
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, str):
+        sections = _split_sections(number_format or 'General')
+        if len(sections) > 3 and '@' in sections[3]:
+            return sections[3].replace('"', '').replace('@', value)
+        return value
+    if not isinstance(value, (int, float, date, dtime, timedelta)):
+        return str(value)  # Error values
+    fmt = number_format or 'General'
+    is_temporal = isinstance(value, (date, dtime, timedelta))
+    if is_temporal and fmt == 'General':
+        fmt = 'd.m.yyyy' if not isinstance(value, dtime) else 'h:mm:ss'
+    if is_temporal or is_date_format(fmt):
+        try:
+            return _date_text(_as_datetime(value), _split_sections(fmt)[0])
+        except (OverflowError, ValueError):
+            return '#' * 8
+    x = float(value)
+    if math.isnan(x) or math.isinf(x):
+        return '#NUM!'
+    sections = _split_sections(fmt)
+    sign = ''
+    if x < 0 and len(sections) > 1 and sections[1]:
+        section, x = sections[1], -x
+    elif x == 0 and len(sections) > 2:
+        section = sections[2]
+    else:
+        section = sections[0]
+        if x < 0:
+            sign, x = '-', -x
+    if section.strip().lower() in ('general', ''):
+        return sign + general_number(x, decimal_sep)
+    out, pattern_done = [], False
+    tokens = FORMAT_TOKEN_RE.findall(section)
+    if '%' in tokens:
+        x *= 100
+    if any(t[:1] in 'Ee' and t not in ('E', 'e') for t in tokens) or re.search(r'[Ee][+-]', section):
+        return sign + f"{x:.2E}".replace('.', decimal_sep)
+    for tok in tokens:
+        if tok.startswith('"'):
+            out.append(tok[1:-1])
+        elif tok.startswith('\\'):
+            out.append(tok[1:])
+        elif tok.startswith('_'):
+            out.append(' ')
+        elif tok.startswith('*'):
+            continue
+        elif tok.startswith('['):
+            currency = re.match(r'\[\$([^-\]]*)', tok)
+            if currency:
+                out.append(currency.group(1))
+        elif tok[0] in '0#?.,' and any(ch in '0#?' for ch in tok):
+            if not pattern_done:
+                out.append(_number_pattern(x, tok, decimal_sep, thousands_sep))
+                pattern_done = True
+        elif tok.lower() == 'general':
+            out.append(general_number(x, decimal_sep))
+        else:
+            out.append(tok)
+    text = ''.join(out)
+    if not pattern_done and 'general' not in section.lower():
+        return text  # Only literals, e.g. "-" for zero
+    return sign + text
+
+
+# Colours
+
+def theme_palette(wb):
+    """The twelve theme colours in Excel's index order (lt1, dk1, lt2, dk2, ...)"""
+    theme = getattr(wb, 'loaded_theme', None)
+    if not theme:
+        return list(DEFAULT_THEME)
+    try:
+        root = ET.fromstring(theme)
+    except ET.ParseError:
+        return list(DEFAULT_THEME)
+    scheme = root.find('.//{http://schemas.openxmlformats.org/drawingml/2006/main}clrScheme')
+    if scheme is None:
+        return list(DEFAULT_THEME)
+    colours = []
+    for entry in scheme:
+        child = entry[0] if len(entry) else None
+        if child is None:
+            colours.append(None)
+        else:
+            colours.append(child.get('lastClr') or child.get('val'))
+    if len(colours) < 12:
+        return list(DEFAULT_THEME)
+    dk1, lt1, dk2, lt2 = colours[:4]
+    palette = [lt1, dk1, lt2, dk2] + colours[4:12]
+    return [c or d for c, d in zip(palette, DEFAULT_THEME)]
+
+
+def _tint(rgb, tint):
+    r, g, b = (int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    h, l, s = colorsys.rgb_to_hls(r, g, b)
+    l = l * (1 + tint) if tint < 0 else l * (1 - tint) + tint
+    r, g, b = colorsys.hls_to_rgb(h, l, s)
+    return ''.join(f"{round(v * 255):02X}" for v in (r, g, b))
+
+
+def resolve_color(color, palette, default=None):
+    """openpyxl Color as an (r, g, b) tuple, default when unset or automatic"""
+    if color is None:
+        return default
+    rgb = None
+    if color.type == 'rgb' and isinstance(color.rgb, str):
+        rgb = color.rgb[-6:]
+    elif color.type == 'theme' and color.theme is not None and color.theme < len(palette):
+        rgb = palette[color.theme]
+    elif color.type == 'indexed' and color.indexed is not None:
+        if color.indexed >= len(COLOR_INDEX):
+            return default  # System foreground/background
+        rgb = COLOR_INDEX[color.indexed][-6:]
+    if not rgb:
+        return default
+    if color.tint:
+        rgb = _tint(rgb, color.tint)
+    return tuple(int(rgb[i:i + 2], 16) for i in (0, 2, 4))
+
+
+# Table description
+
+def column_widths_px(ws, min_col, max_col):
+    widths = {}
+    default = ws.sheet_format.defaultColWidth
+    default_px = int(default * 7 + 0.5) if default else DEFAULT_COLUMN_PX
+    for dim in ws.column_dimensions.values():
+        lo = dim.min or column_index_from_string(dim.index)
+        hi = dim.max or lo
+        for c in range(lo, hi + 1):
+            if min_col <= c <= max_col:
+                if dim.hidden:
+                    widths[c] = 0
+                elif dim.width:
+                    widths[c] = int(dim.width * 7 + 0.5)
+    return [widths.get(c, default_px) for c in range(min_col, max_col + 1)]
+
+
+def row_heights_px(ws, min_row, max_row, font_sizes=None):
+    """Row heights in pixels; rows without a set height grow to their largest font"""
+    default = ws.sheet_format.defaultRowHeight or DEFAULT_ROW_PT
+    font_sizes = font_sizes or {}
+    heights = []
+    for r in range(min_row, max_row + 1):
+        dim = ws.row_dimensions.get(r)  # get() does not create the row
+        if dim is not None and dim.hidden:
+            heights.append(0)
+        elif dim is not None and dim.height is not None:
+            heights.append(round(dim.height * 4 / 3))
+        else:
+            heights.append(round(max(default, font_sizes.get(r, 0) * AUTO_ROW_FACTOR) * 4 / 3))
+    return heights
+
+
+def _border_side(side, palette):
+    if side is None or not side.style:
+        return None
+    return BORDER_WIDTHS.get(side.style, 1), resolve_color(side.color, palette, (0, 0, 0))
+
+
+def cell_style(cell, palette):
+    """Picklable drawing style of an openpyxl cell"""
+    font = cell.font
+    fill = cell.fill
+    fill_rgb = None
+    if fill is not None and getattr(fill, 'fill_type', None) == 'solid':
+        fill_rgb = resolve_color(fill.fgColor, palette)
+    border = cell.border
+    align = cell.alignment
+    return {
+        'font': (font.name or 'Calibri', float(font.sz or 11), bool(font.b), bool(font.i),
+                 resolve_color(font.color, palette, (0, 0, 0)), bool(font.u)),
+        'fill': fill_rgb,
+        'border': tuple(_border_side(getattr(border, side), palette) for side in ('left', 'right', 'top', 'bottom')),
+        'halign': align.horizontal or 'general',
+        'valign': align.vertical or 'bottom',
+        'wrap': bool(align.wrap_text),
+        'indent': int(align.indent or 0),
+    }
+
+
+def table_spec(ws, cell_range, value=None, palette=None, decimal_sep=',', thousands_sep='.'):
+    """Plain description of a worksheet range for render_table().
+
+    value(row, col) supplies cell values (for example from the formula
+    engine); by default the values stored in ws are used.
+    """
+    min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+    palette = palette or theme_palette(ws.parent)
+    merges = []
+    covered = set()
+    for merged in ws.merged_cells.ranges:
+        c1, r1, c2, r2 = merged.bounds
+        if r2 < min_row or r1 > max_row or c2 < min_col or c1 > max_col:
+            continue
+        r1, c1 = max(r1, min_row), max(c1, min_col)
+        r2, c2 = min(r2, max_row), min(c2, max_col)
+        merges.append((r1 - min_row, c1 - min_col, r2 - min_row, c2 - min_col))
+        covered.update((r, c) for r in range(r1, r2 + 1) for c in range(c1, c2 + 1) if (r, c) != (r1, c1))
+    cells = {}
+    font_sizes = {}
+    for r in range(min_row, max_row + 1):
+        for c in range(min_col, max_col + 1):
+            cell = ws.cell(row=r, column=c)
+            v = value(r, c) if value is not None else cell.value
+            style = cell_style(cell, palette)
+            text = '' if (r, c) in covered else format_value(v, cell.number_format, decimal_sep, thousands_sep)
+            numeric = isinstance(v, (int, float, date, dtime, timedelta)) and not isinstance(v, bool)
+            if style['halign'] == 'general':
+                style['halign'] = 'right' if numeric else ('center' if isinstance(v, bool) else 'left')
+            style['numeric'] = numeric
+            if text:
+                font_sizes[r] = max(font_sizes.get(r, 0), style['font'][1])
+            cells[(r - min_row, c - min_col)] = (text, style)
+    show_grid = ws.sheet_view.showGridLines
+    return {
+        'widths': column_widths_px(ws, min_col, max_col),
+        'heights': row_heights_px(ws, min_row, max_row, font_sizes),
+        'cells': cells,
+        'merges': merges,
+        'gridlines': show_grid is None or bool(show_grid),
+    }
+
+
+def spec_size(spec):
+    """Display size of a rendered table in pixels"""
+    return sum(spec['widths']), sum(spec['heights'])
+
+
+# Drawing
+
+def _find_font_file(filename):
+    for folder in FONT_DIRS:
+        if not os.path.isdir(folder):
+            continue
+        direct = os.path.join(folder, filename)
+        if os.path.exists(direct):
+            return direct
+        for root, _dirs, files in os.walk(folder):
+            for f in files:
+                if f.lower() == filename.lower():
+                    return os.path.join(root, f)
+    return None
+
+
+@lru_cache(maxsize=None)
+def load_font(name, size_px, bold=False, italic=False):
+    """Pillow font for a family, falling back to metric-compatible fonts"""
+    from PIL import ImageFont
+
+    variant = (2 if italic else 0) + (1 if bold else 0)
+    for family in [name.lower()] + FALLBACK_FONTS:
+        files = FONT_FILES.get(family)
+        if not files:
+            continue
+        for filename in (files[variant], files[0]):
+            path = _find_font_file(filename)
+            if path:
+                return ImageFont.truetype(path, size_px)
+    return ImageFont.load_default(size_px)
+
+
+def _wrap(draw, text, font, width):
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f"{line} {word}" if line else word
+            if line and draw.textlength(candidate, font=font) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def render_table(spec, scale=2):
+    """Draw a table_spec() as PNG bytes, scale times the display size"""
+    from PIL import Image, ImageDraw
+
+    xs = [0]
+    for w in spec['widths']:
+        xs.append(xs[-1] + w * scale)
+    ys = [0]
+    for h in spec['heights']:
+        ys.append(ys[-1] + h * scale)
+    n_rows, n_cols = len(spec['heights']), len(spec['widths'])
+    img = Image.new('RGB', (max(xs[-1], 1), max(ys[-1], 1)), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    cells = spec['cells']
+
+    # Cell areas: merged ranges draw as one cell
+    areas = {}
+    merged_cells = set()
+    for r1, c1, r2, c2 in spec['merges']:
+        areas[(r1, c1)] = (r1, c1, r2, c2)
+        merged_cells.update((r, c) for r in range(r1, r2 + 1) for c in range(c1, c2 + 1))
+    for r in range(n_rows):
+        for c in range(n_cols):
+            if (r, c) not in merged_cells:
+                areas[(r, c)] = (r, c, r, c)
+
+    def box(area):
+        r1, c1, r2, c2 = area
+        return xs[c1], ys[r1], xs[c2 + 1], ys[r2 + 1]
+
+    if spec['gridlines']:
+        for x in xs[1:]:
+            draw.line([(x - 1, 0), (x - 1, ys[-1])], fill=GRIDLINE, width=1)
+        for y in ys[1:]:
+            draw.line([(0, y - 1), (xs[-1], y - 1)], fill=GRIDLINE, width=1)
+        for area in areas.values():
+            if area[0] != area[2] or area[1] != area[3]:
+                x0, y0, x1, y1 = box(area)
+                draw.rectangle([x0, y0, x1 - 2, y1 - 2], fill=(255, 255, 255))
+
+    for (r, c), area in areas.items():
+        fill = cells[(r, c)][1]['fill']
+        x0, y0, x1, y1 = box(area)
+        if fill and x1 > x0 and y1 > y0:
+            draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=fill)
+
+    # Text, left-aligned text may run into empty neighbours like in Excel
+    pad = 2 * scale
+    for (r, c), area in areas.items():
+        text, style = cells[(r, c)]
+        if not text:
+            continue
+        x0, y0, x1, y1 = box(area)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        name, size, bold, italic, colour, underline = style['font']
+        font = load_font(name, max(1, round(size * 4 / 3 * scale)), bold, italic)
+        halign, valign = style['halign'], style['valign']
+        indent = style['indent'] * 9 * scale
+        clip_x1 = x1
+        if not style['wrap'] and halign in ('left', 'fill') and area[3] == area[1]:
+            c2 = area[3] + 1
+            while (draw.textlength(text, font=font) + 2 * pad + indent > clip_x1 - x0 and c2 < n_cols
+                   and (r, c2) not in merged_cells and not cells[(r, c2)][0]):
+                clip_x1 = xs[c2 + 1]
+                c2 += 1
+        avail = clip_x1 - x0 - 2 * pad - indent
+        if style['wrap']:
+            lines = _wrap(draw, text, font, max(avail, 1))
+        elif style['numeric'] and draw.textlength(text, font=font) > x1 - x0 - 2 * pad:
+            lines = ['#' * max(1, int((x1 - x0 - 2 * pad) // max(draw.textlength('#', font=font), 1)))]
+        else:
+            lines = text.split('\n')[:1]
+        ascent, descent = font.getmetrics()
+        line_h = ascent + descent
+        block_h = line_h * len(lines)
+        if valign in ('top',):
+            ty = y0 + pad
+        elif valign in ('center', 'centerContinuous', 'distributed', 'justify'):
+            ty = y0 + (y1 - y0 - block_h) / 2
+        else:
+            ty = y1 - pad - block_h
+        layer = img.crop((x0, y0, clip_x1, y1))
+        layer_draw = ImageDraw.Draw(layer)
+        for i, line in enumerate(lines):
+            width = layer_draw.textlength(line, font=font)
+            if halign in ('center', 'centerContinuous', 'distributed', 'justify'):
+                tx = (clip_x1 - x0 - width) / 2
+            elif halign == 'right':
+                tx = clip_x1 - x0 - pad - indent - width
+            else:
+                tx = pad + indent
+            top = ty - y0 + i * line_h
+            layer_draw.text((tx, top), line, font=font, fill=colour)
+            if underline:
+                base = top + ascent + scale
+                layer_draw.line([(tx, base), (tx + width, base)], fill=colour, width=scale)
+        img.paste(layer, (x0, y0))
+
+    for (r, c), area in areas.items():
+        x0, y0, x1, y1 = box(area)
+        left, right, top, bottom = cells[(r, c)][1]['border']
+        # The outer cells of a merged range carry its border
+        if area[3] != area[1]:
+            right = cells[(area[0], area[3])][1]['border'][1] or right
+        if area[2] != area[0]:
+            bottom = cells[(area[2], area[1])][1]['border'][3] or bottom
+        for side, points in ((left, [(x0, y0), (x0, y1 - 1)]), (right, [(x1 - 1, y0), (x1 - 1, y1 - 1)]),
+                             (top, [(x0, y0), (x1 - 1, y0)]), (bottom, [(x0, y1 - 1), (x1 - 1, y1 - 1)])):
+            if side is not None:
+                width, colour = side
+                draw.line(points, fill=colour, width=width * scale)
+
+    out = io.BytesIO()
+    img.save(out, format='PNG', optimize=False)
+    return out.getvalue()
+
+
+def render_tables(specs, workers=None, scale=2):
+    """render_table() for several specs, fanned out over a process pool.
+
+    PNGs come back in the order of specs. workers defaults to the number
+    of cores; one worker (or a single spec) renders in-process.
+    """
+    specs = list(specs)
+    workers = min(workers or os.cpu_count() or 1, len(specs))
+    if workers <= 1:
+        return [render_table(spec, scale) for spec in specs]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render_table, specs, [scale] * len(specs)))
+
+
+# Placing images in a sheet
+
+def anchor_cell(image):
+    """(row, col) of an openpyxl image's top-left anchor, 1-based"""
+    anchor = image.anchor
+    if isinstance(anchor, str):
+        col, row, _, _ = range_boundaries(anchor)
+        return row, col
+    return anchor._from.row + 1, anchor._from.col + 1
+
+
+def remove_images(ws, min_row, min_col, max_row, max_col):
+    """Drop images anchored inside the range, returns how many were removed"""
+    keep = []
+    for image in ws._images:
+        row, col = anchor_cell(image)
+        if not (min_row <= row <= max_row and min_col <= col <= max_col):
+            keep.append(image)
+    removed = len(ws._images) - len(keep)
+    ws._images = keep
+    return removed
+
+
+def place_image(ws, png, row, col, width, height):
+    """Anchor a PNG at (row, col) at width x height pixels and fit the row to it"""
+    from openpyxl.drawing.image import Image as SheetImage
+    from openpyxl.utils import get_column_letter
+
+    image = SheetImage(io.BytesIO(png))
+    image.width, image.height = width, height
+    ws.add_image(image, f"{get_column_letter(col)}{row}")
+    ws.row_dimensions[row].height = height * 0.75  # pixels to points
+    return image
+
+
+if __name__ == "__main__":
+    from openpyxl import load_workbook
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) != 5:
+        print(__doc__)
+        sys.exit(2)
+    path, sheet, cell_range, target = sys.argv[1:]
+    cached = load_workbook(path, data_only=True)
+    ws = cached[sheet]
+    spec = table_spec(ws, cell_range)
+    with open(target, 'wb') as f:
+        f.write(render_table(spec))
+    logger.info(f"Rendered {sheet}!{cell_range} ({spec_size(spec)[0]}x{spec_size(spec)[1]} px) to {target}")
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Folder with small synthetic 43.xls, plan and poročanje workbooks"""
+    pytest.importorskip('xlwt')
+    from benchmark import generate_inputs
+
+    generate_inputs(str(tmp_path), rows=300, days=30, machines=12)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def automation(tmp_path):
+    """ExcelAutomation over empty placeholder inputs, for steps that only use COM"""
+    from automate_process import ExcelAutomation
+
+    for name in ('43.xls', 'poročanje proizvodnje2025.xlsm', 'plan brizganja 2025 mesečni.xlsx'):
+        (tmp_path / name).touch()
+    return ExcelAutomation(str(tmp_path))
@@ -0,0 +1,168 @@
+"""In-memory stand-in for the few Excel COM Worksheet members the script uses"""
+from openpyxl.utils import column_index_from_string, range_boundaries
+
+XL_UP = -4162
+
+
+class FakeCell:
+    def __init__(self, sheet, row, column):
+        self.sheet, self.Row, self.Column = sheet, row, column
+
+    @property
+    def Value(self):
+        self.sheet.calls += 1
+        return self.sheet.cells.get((self.Row, self.Column))
+
+    def End(self, direction):
+        assert direction == XL_UP
+        self.sheet.calls += 1
+        rows = [r for (r, c), v in self.sheet.cells.items() if c == self.Column and v not in (None, '')]
+        return FakeCell(self.sheet, max(rows, default=1), self.Column)
+
+
+class FakeRange:
+    def __init__(self, sheet, ref):
+        self.sheet = sheet
+        self.min_col, self.min_row, self.max_col, self.max_row = range_boundaries(ref)
+
+    @property
+    def Value(self):
+        self.sheet.calls += 1
+        rows = tuple(tuple(self.sheet.cells.get((r, c)) for c in range(self.min_col, self.max_col + 1))
+                     for r in range(self.min_row, self.max_row + 1))
+        return rows[0][0] if len(rows) == 1 and len(rows[0]) == 1 else rows
+
+    @Value.setter
+    def Value(self, rows):
+        self.sheet.calls += 1
+        for r, values in enumerate(rows, self.min_row):
+            for c, value in enumerate(values, self.min_col):
+                self.sheet.cells[(r, c)] = value
+
+    def CopyPicture(self, Appearance=1, Format=2):
+        self.sheet.calls += 1
+
+    def ClearContents(self):
+        self.sheet.calls += 1
+        for r in range(self.min_row, self.max_row + 1):
+            for c in range(self.min_col, self.max_col + 1):
+                self.sheet.cells.pop((r, c), None)
+
+
+class FakeShape:
+    def __init__(self, sheet, row, column, height):
+        self.TopLeftCell = FakeCell(sheet, row, column)
+        self.Height = height
+
+
+class FakeShapes:
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def __iter__(self):
+        self.sheet.calls += 1
+        return iter(list(self.sheet.shapes))
+
+    def __call__(self, index):
+        self.sheet.calls += 1
+        return self.sheet.shapes[index - 1]
+
+    @property
+    def Count(self):
+        self.sheet.calls += 1
+        return len(self.sheet.shapes)
+
+    def Range(self, indexes):
+        sheet = self.sheet
+
+        class Selection:
+            def Delete(self):
+                sheet.calls += 1
+                for index in sorted(indexes, reverse=True):
+                    del sheet.shapes[index - 1]
+        return Selection()
+
+
+class FakeRows:
+    Count = 1048576
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def __call__(self, spec):
+        sheet = self.sheet
+        first, _, last = str(spec).partition(':')
+
+        class Rows:
+            def __setattr__(self, name, value):
+                assert name == 'RowHeight'
+                sheet.calls += 1
+                for row in range(int(first), int(last or first) + 1):
+                    sheet.heights[row] = value
+        return Rows()
+
+
+class FakeSheet:
+    """Cells, shapes and row heights of one worksheet; calls counts COM round trips"""
+
+    def __init__(self, cells=None, shapes=(), paste_height=99.0):
+        self.cells = dict(cells or {})
+        self.shapes = []
+        self.heights = {}
+        self.calls = 0
+        self.paste_height = paste_height
+        self.Shapes = FakeShapes(self)
+        self.Rows = FakeRows(self)
+        for row, column, height in shapes:
+            self.shapes.append(FakeShape(self, row, column, height))
+
+    def Cells(self, row, column):
+        if isinstance(column, str):
+            column = column_index_from_string(column)
+        return FakeCell(self, row, column)
+
+    def Range(self, ref):
+        return FakeRange(self, ref)
+
+    def Paste(self, cell, Link=False):
+        self.calls += 1
+        self.shapes.append(FakeShape(self, cell.Row, cell.Column, self.paste_height))
+
+
+class FakeWorkbook:
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self.saved = False
+
+    def Worksheets(self, name):
+        return self.sheets[name]
+
+    def Save(self):
+        self.saved = True
+
+    def Close(self):
+        pass
+
+
+class FakeExcel:
+    """Excel.Application whose window handle is the PID of a stand-in process"""
+
+    def __init__(self, pid, sheets=None):
+        self.Hwnd = pid
+        self.Visible = True
+        self.CutCopyMode = False
+        self.macros = []
+        self.quit_calls = 0
+        self.workbook = FakeWorkbook(sheets or {})
+        app = self
+
+        class Workbooks:
+            def Open(self, path):
+                return app.workbook
+        self.Workbooks = Workbooks()
+
+    def Run(self, macro):
+        self.macros.append(macro)
+
+    def Quit(self):
+        self.quit_calls += 1
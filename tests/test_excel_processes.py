@@ -0,0 +1,71 @@
+import shutil
+import subprocess
+import sys
+import types
+
+import psutil
+import pytest
+
+from automate_process import ExcelProcesses
+from fake_excel import FakeExcel, FakeSheet
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux') or shutil.which('sleep') is None,
+                    reason="uses 'sleep' processes as Excel stand-ins")
+def test_shutdown_stops_only_owned_processes():
+    foreign = subprocess.Popen(['sleep', '30'])
+    try:
+        excel = ExcelProcesses(names=('sleep',), grace=0.2, timeout=2)
+        owned = excel.spawn(lambda: subprocess.Popen(['sleep', '30']))
+        assert set(excel.owned) == {owned.pid}
+
+        excel.shutdown()
+        assert owned.poll() is not None
+        assert excel.owned == {}
+        assert psutil.pid_exists(foreign.pid) and foreign.poll() is None
+        assert excel.calls == 1 and excel.dead_time > 0
+    finally:
+        foreign.kill()
+        foreign.wait()
+
+
+
+def fake_win32(monkeypatch, dispatch, dispatch_ex):
+    client = types.SimpleNamespace(Dispatch=dispatch, DispatchEx=dispatch_ex)
+    monkeypatch.setitem(sys.modules, 'win32com', types.SimpleNamespace(client=client))
+    monkeypatch.setitem(sys.modules, 'win32com.client', client)
+    monkeypatch.setitem(sys.modules, 'win32process',
+                        types.SimpleNamespace(GetWindowThreadProcessId=lambda hwnd: (1, hwnd)))
+
+
+def workbook_sheets():
+    izbor = {(1, c): f'h{c}' for c in range(6, 14)}
+    izbor.update({(2, c): c for c in range(6, 14)})
+    izbor[(2, 27)] = 'BR01'
+    return {'izbor': FakeSheet(izbor), 'List2': FakeSheet(),
+            'brizganje izračun': FakeSheet({(7, 1): 'BR01'}, [(8, 1, 40.0)])}
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux') or shutil.which('sleep') is None,
+                    reason="uses 'sleep' processes as Excel stand-ins")
+def test_step7_leaves_the_users_excel_alone(automation, monkeypatch):
+    users = subprocess.Popen(['sleep', '30'])
+    started = []
+    try:
+        users_app = FakeExcel(users.pid)
+
+        def dispatch_ex(prog_id):
+            started.append(subprocess.Popen(['sleep', '30']))
+            return FakeExcel(started[-1].pid, workbook_sheets())
+
+        fake_win32(monkeypatch, lambda prog_id: users_app, dispatch_ex)
+        automation.excel = ExcelProcesses(names=('sleep',), grace=0.2, timeout=2)
+        automation.step7_process_saved_texts(['BR01'])
+
+        assert len(started) == 1 and started[0].poll() is not None
+        assert users_app.quit_calls == 0
+        assert users.poll() is None
+    finally:
+        for proc in [users, *started]:
+            proc.kill()
+            proc.wait()
@@ -0,0 +1,110 @@
+import os
+import re
+import subprocess
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from formula_engine import FormulaEngine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Formula -> the value Excel saves for it, over A1:B5 below
+FORMULAS = {
+    'D1': ('=SUMIF(A1:A5,"BR01",B1:B5)', 90),
+    'D2': ('=COUNTIF(A1:A5,"BR01")', 3),
+    'D3': ('=ROUND(D1/7,2)', 12.86),
+    'D4': ('=IF(D1>50,"high","low")', 'high'),
+    'D5': ('=INDEX(B1:B5,4)', 40),
+    'D6': ('=SUMPRODUCT(B1:B5,B1:B5)/1000', 5.5),
+    'D7': ('=TEXT(D3,"0.0")', '12.9'),
+    'D8': ('=LEFT(A2,2)&MID(A2,3,2)', 'BR02'),
+    'D9': ('=ISNUMBER(D1)', True),
+    'D10': ('=SUMIFS(B1:B5,A1:A5,"BR01",B1:B5,">20")', 80),
+    'D11': ('=MOD(47,5)', 2),
+    'D12': ('=AVERAGE(B1:B5)', 30),
+}
+
+
+def cached_value_xml(value):
+    if isinstance(value, bool):
+        return ' t="b"', f'<v>{int(value)}</v>'
+    if isinstance(value, str):
+        return ' t="str"', f'<v>{escape(value)}</v>'
+    return '', f'<v>{value}</v>'
+
+
+def write_workbook(path, overrides=None):
+    """Workbook with FORMULAS and the values Excel would have cached for them"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'data'
+    for r, (name, qty) in enumerate([('BR01', 10), ('BR02', 20), ('BR01', 30), ('BR03', 40), ('BR01', 50)], 1):
+        ws.cell(r, 1, name)
+        ws.cell(r, 2, qty)
+    for ref, (formula, _) in FORMULAS.items():
+        ws[ref] = formula
+    wb.save(path)
+
+    cached = {ref: value for ref, (_, value) in FORMULAS.items()}
+    cached.update(overrides or {})
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+    sheet = parts['xl/worksheets/sheet1.xml'].decode('utf-8')
+    for ref, value in cached.items():
+        attr, v = cached_value_xml(value)
+        sheet = re.sub(rf'<c r="{ref}"([^>]*)>(<f>.*?</f>)<v ?/>', rf'<c r="{ref}"\g<1>{attr}>\g<2>{v}', sheet)
+    parts['xl/worksheets/sheet1.xml'] = sheet.encode('utf-8')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+    return path
+
+
+def engine_for(path):
+    return FormulaEngine(load_workbook(path), load_workbook(path, data_only=True))
+
+
+def test_verify_matches_excel_values(tmp_path):
+    engine = engine_for(write_workbook(str(tmp_path / 'book.xlsx')))
+    assert engine.verify() == []
+
+
+def test_verify_reports_a_wrong_cached_value(tmp_path):
+    engine = engine_for(write_workbook(str(tmp_path / 'book.xlsx'), {'D1': 91}))
+    mismatches = engine.verify()
+    assert [(key, cached, computed) for key, cached, computed in mismatches if key[2] == 4 and key[1] == 1] \
+        == [(('data', 1, 4), 91, 90)]
+
+
+@pytest.mark.parametrize('overrides, code', [({}, 0), ({'D12': 31}, 1)])
+def test_verify_cli(tmp_path, overrides, code):
+    path = write_workbook(str(tmp_path / 'book.xlsx'), overrides)
+    result = subprocess.run([sys.executable, 'formula_engine.py', path], cwd=ROOT, capture_output=True)
+    assert result.returncode == code
+
+
+def test_changed_inputs_recompute_dependents(tmp_path):
+    engine = engine_for(write_workbook(str(tmp_path / 'book.xlsx')))
+    engine.set_values('data', 1, 2, [[100]])
+    engine.mark_changed([('data', 1, 2, 1, 2)])
+    engine.evaluate_cells([('data', 1, 4), ('data', 3, 4)], [('data', 1, 2, 1, 2)])
+    assert engine.value('data', 1, 4) == 180
+    assert engine.value('data', 3, 4) == 25.71
+    assert engine.value('data', 4, 4) == 'high'
+
+
+def test_only_the_requested_subgraph_is_computed(tmp_path):
+    engine = engine_for(write_workbook(str(tmp_path / 'book.xlsx')))
+    engine.set_values('data', 1, 2, [[100]])
+    # D3 reads D1, which reads B1; no other formula is needed
+    assert engine.evaluate_cells([('data', 3, 4)], [('data', 1, 2, 1, 2)]) == 2
+    assert engine.value('data', 3, 4) == 25.71
+    # Memoized: asking again or for D1 computes nothing
+    assert engine.evaluate_cells([('data', 3, 4), ('data', 1, 4)]) == 0
+    # D2 does not read column B, so its cached value stays valid
+    assert engine.evaluate_cells([('data', 2, 4)]) == 0
+    assert engine.value('data', 2, 4) == 3
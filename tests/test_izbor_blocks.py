@@ -0,0 +1,24 @@
+from automate_process import group_izbor_rows, read_izbor_blocks, write_list2_block
+from fake_excel import FakeSheet
+
+
+def test_izbor_blocks_round_trip_to_list2():
+    header = ['F', 'G', 'H', 'I', 'J', 'K', 'L', 'M']
+    izbor = {(1, c): name for c, name in enumerate(header, 6)}
+    rows = [('BR01', 1), ('BR02', 2), ('BR01', 3)]
+    for r, (key, value) in enumerate(rows, 2):
+        izbor.update({(r, c): value * 10 + c for c in range(6, 14)})
+        izbor[(r, 27)] = key
+    izbor_sheet = FakeSheet(izbor)
+
+    read_header, keyed_rows = read_izbor_blocks(izbor_sheet)
+    assert izbor_sheet.calls == 3  # End(xlUp) and two Range reads
+    groups = group_izbor_rows(keyed_rows)
+    assert read_header == header
+    assert [row[0] for row in groups['BR01']] == [16, 36]
+
+    # Leftovers of a longer previous group must be cleared
+    list2 = FakeSheet({(r, c): 'old' for r in range(1, 10) for c in range(20, 28)})
+    write_list2_block(list2, read_header, groups['BR01'])
+    assert list2.calls == 3
+    assert [list2.cells.get((r, 20)) for r in range(1, 6)] == ['F', 16, 36, None, None]
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook
+
+from automate_process import read_plan_blocks, read_plan_range, stream_plan_block
+
+DAY = datetime(2025, 3, 4)
+
+
+def short_plan(path, last_row):
+    """Plan whose stored rows end at last_row, well above row 44"""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'plan'
+    ws['H4'] = DAY
+    if last_row >= 5:
+        ws['H5'] = 'Fiksno'
+    for r in range(6, last_row + 1):
+        ws.cell(r, 8, r)
+    wb.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('last_row', [4, 10])
+def test_blocks_have_their_full_height(tmp_path, last_row):
+    path = short_plan(tmp_path / 'plan.xlsx', last_row)
+    expected = [[r if r <= last_row else None, None, None] for r in range(6, 45)]
+
+    col, status, block = stream_plan_block(path, lambda header: 8)
+    assert (col, block) == (8, expected)
+    assert read_plan_range(path, 8) == expected
+    assert read_plan_blocks(path, [8])[8][1] == expected
+
+    rows = read_plan_range(path, 8, first_row=5)
+    assert len(rows) == 40
+    assert rows[0][0] == ('Fiksno' if last_row >= 5 else None)
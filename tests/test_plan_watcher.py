@@ -0,0 +1,77 @@
+import time
+from datetime import datetime
+
+from openpyxl import Workbook, load_workbook
+
+import automate_process
+from automate_process import PlanWatcher
+
+DAY = datetime(2025, 3, 4)
+
+
+def fixed_plan(path, status='Fiksno'):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'plan'
+    ws['H4'], ws['H5'] = DAY, status
+    wb.save(path)
+    return str(path)
+
+
+def watcher(tmp_path, **kwargs):
+    return PlanWatcher(fixed_plan(tmp_path / 'plan.xlsx'), interval=0.05, debounce=0, **kwargs)
+
+
+def test_failed_run_waits_for_the_back_off(tmp_path):
+    calls = []
+    plan = watcher(tmp_path, retry=0.5)
+    start = time.monotonic()
+    plan.run(lambda: calls.append(time.monotonic()) and False, target_date=lambda: DAY.date(), max_runs=2)
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.5
+    assert time.monotonic() - start < 5
+
+
+def test_failed_run_is_retried_after_a_change(tmp_path):
+    plan = watcher(tmp_path, retry=60)
+    calls = []
+
+    def pipeline():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            fixed_plan(plan.plan_file)  # The planner saves the plan again
+            return False
+        return True
+
+    plan.run(pipeline, target_date=lambda: DAY.date(), max_runs=2)
+    assert len(calls) == 2
+    assert plan.done == {DAY.date()}
+
+
+def test_unchanged_plan_is_not_read_again(tmp_path, monkeypatch):
+    plan = PlanWatcher(fixed_plan(tmp_path / 'plan.xlsx', 'Osnutek'), interval=0.02, debounce=0.01)
+    reads = []
+    monkeypatch.setattr(automate_process, 'read_plan_status',
+                        lambda path, column: reads.append(column) or load_workbook(path)['plan']['H5'].value)
+    settles = []
+    settle = plan.settle
+    monkeypatch.setattr(plan, 'settle', lambda: settles.append(1) or settle())
+    polls = []
+
+    def target_date():
+        polls.append(1)
+        if len(polls) == 20:
+            fixed_plan(plan.plan_file)  # The planner fixes the plan
+        return DAY.date()
+
+    plan.run(lambda: True, target_date=target_date, max_runs=1)
+    assert len(polls) >= 20
+    assert len(reads) == len(settles) == 2
+
+
+def test_settle_gives_up_on_a_lock_held_all_day(tmp_path, monkeypatch):
+    plan = watcher(tmp_path, lock_timeout=0.3)
+    monkeypatch.setattr(automate_process, 'file_locked', lambda path: True)
+    start = time.monotonic()
+    plan.settle()
+    assert 0.3 <= time.monotonic() - start < 2
@@ -0,0 +1,45 @@
+from automate_process import ShapeIndex
+from fake_excel import FakeSheet
+
+
+def brizganje_sheet():
+    labels = {7: 'BR01', 20: 'BR02', 30: 'BR03', 60: 'skupaj'}
+    shapes = [(8, 1, 40.0), (10, 3, 40.0), (50, 1, 40.0), (12, 20, 40.0)]
+    return FakeSheet({(r, 1): text for r, text in labels.items()}, shapes)
+
+
+def test_shape_index_plans_deletions_targets_and_heights():
+    sheet = brizganje_sheet()
+    shapes = ShapeIndex(sheet)
+    assert shapes.delete_in(7, 1, 44, 13) == 2
+    assert [(s.TopLeftCell.Row, s.TopLeftCell.Column) for s in sheet.shapes] == [(50, 1), (12, 20)]
+    assert shapes.target_row('BR02') == 21
+    assert shapes.target_row('missing') is None
+
+    shapes.placed(8, 1, 99.0)
+    heights = shapes.row_heights(7, 44)
+    assert heights[7] == 16.5 and heights[8] == 99.0 and heights[44] == 16.5
+    assert heights[12] is None  # A surviving shape keeps its row's height
+    assert shapes.apply_row_heights(heights) == 4  # 7, 8, 9-11, 13-44
+    assert 12 not in sheet.heights and sheet.heights[13] == 16.5
+
+
+def test_steps_7_and_9_shape_handling_is_batched(automation):
+    sheet = brizganje_sheet()
+    shapes = ShapeIndex(sheet)
+    shapes.delete_in(7, 1, 44, 13)
+    for text in ('BR01', 'BR02', 'missing'):
+        automation.step9_paste_as_image(sheet, text, shapes)
+    shapes.apply_row_heights(shapes.row_heights(7, 44))
+
+    assert sheet.heights[8] == sheet.heights[21] == 99.0
+    assert sheet.heights[7] == sheet.heights[44] == 16.5
+    # Independent of the number of rows and shapes
+    assert sheet.calls == 14
+
+
+def test_step9_without_index_fits_its_row(automation):
+    sheet = brizganje_sheet()
+    automation.step9_paste_as_image(sheet, 'BR03')
+    assert sheet.heights == {31: 99.0}
+    assert (31, 1) in [(s.TopLeftCell.Row, s.TopLeftCell.Column) for s in sheet.shapes]
@@ -0,0 +1,56 @@
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+
+from automate_process import SnapshotCache
+
+
+def export(tmp_path):
+    path = tmp_path / "43.xls"
+    path.write_bytes(b"source bytes")
+    return str(path)
+
+
+def test_mixed_object_columns_round_trip(tmp_path):
+    path = export(tmp_path)
+    data_df = pd.DataFrame({
+        'qty': [1.5, 2.0, np.nan],
+        'code': pd.Series([101, 'A-7', None], dtype=object),
+        'start': pd.Series([time(8, 30), datetime(2025, 3, 4, 6, 0), date(2025, 3, 5)], dtype=object),
+        'span': pd.Series([timedelta(hours=2), None, 3], dtype=object),
+    })
+    cache = SnapshotCache(str(tmp_path / "cache"))
+    cache.store(path, data_df)
+
+    loaded = cache.load(path)
+    assert loaded is not None
+    for col in ('code', 'start', 'span'):
+        assert loaded[col].tolist() == data_df[col].where(data_df[col].notna(), None).tolist()
+        assert [type(v) for v in loaded[col]] == [type(v) for v in data_df[col].where(data_df[col].notna(), None)]
+    np.testing.assert_array_equal(loaded['qty'].to_numpy(), data_df['qty'].to_numpy())
+
+
+def test_unsupported_values_are_not_cached(tmp_path):
+    path = export(tmp_path)
+    cache = SnapshotCache(str(tmp_path / "cache"))
+    cache.store(path, pd.DataFrame({'x': pd.Series([1, {1, 2}], dtype=object)}))
+    assert cache.load(path) is None
+
+
+def test_loaded_frame_is_writable_and_load_does_not_write(tmp_path):
+    path = export(tmp_path)
+    data_df = pd.DataFrame({'qty': [1.5, 2.0], 'day': pd.to_datetime(['2025-03-04', '2025-03-05'])})
+    cache = SnapshotCache(str(tmp_path / "cache"))
+    cache.store(path, data_df)
+    files = sorted((tmp_path / "cache").rglob('*'))
+    before = {f: (f.stat().st_mtime_ns, f.read_bytes()) for f in files if f.is_file()}
+
+    loaded = cache.load(path)
+    loaded.loc[0, 'qty'] = 9.0
+    loaded.loc[1, 'day'] = pd.Timestamp('2025-04-01')
+    assert loaded['qty'].tolist() == [9.0, 2.0]
+
+    after = {f: (f.stat().st_mtime_ns, f.read_bytes()) for f in files if f.is_file()}
+    assert after == before
+    assert cache.load(path)['qty'].tolist() == [1.5, 2.0]
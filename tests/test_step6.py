@@ -0,0 +1,72 @@
+import random
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from automate_process import ExcelAutomation, analyze_rows
+
+
+def old_step6(rows):
+    """The loop step 6 used before analyze_rows, over {row: (A, L, M)}"""
+    saved_texts = []
+    for row, (cell_a, cell_l, cell_m) in rows.items():
+        if not cell_a:
+            continue
+        if cell_l in (None, ""):
+            continue
+        try:
+            if isinstance(cell_m, str):
+                value_m = float(cell_m.replace("€", "").replace(",", ".").strip())
+            else:
+                value_m = float(cell_m)
+        except (TypeError, ValueError):
+            continue
+        if value_m > 50:
+            saved_texts.append(str(cell_a))
+    return saved_texts
+
+
+def frame_of(rows):
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['A', 'L', 'M'], dtype=object)
+
+
+def test_matches_old_loop_in_sheet_order():
+    rng = random.Random(19)
+    keys = [None, '', 0, 0.0, False, ' ', 'BR01', 'BR02', 7, True]
+    fills = [None, '', 0, 'x', 3.5]
+    amounts = [None, '', 'n/a', 0, 49.9, 50, 50.5, 120, '75,5', '75,5 €', -80]
+    for _ in range(20):
+        rows = {r: (rng.choice(keys), rng.choice(fills), rng.choice(amounts)) for r in range(7, 47)}
+        result = analyze_rows(frame_of(rows), ExcelAutomation.STEP6_RULES, rank=ExcelAutomation.STEP6_RANK)
+        assert list(result['text']) == old_step6(rows)
+
+
+def test_zero_key_is_skipped_but_zero_l_is_not():
+    rows = {7: (0, 1, 90), 8: ('BR01', 0, 90), 9: ('BR02', '', 90)}
+    result = analyze_rows(frame_of(rows), ExcelAutomation.STEP6_RULES)
+    assert list(result.index) == [8]
+
+
+def test_rank_orders_by_descending_value():
+    rows = {7: ('BR01', 1, 60), 8: ('BR02', 1, 200), 9: ('BR03', 1, 90)}
+    result = analyze_rows(frame_of(rows), ExcelAutomation.STEP6_RULES, rank='M')
+    assert list(result['text']) == ['BR02', 'BR03', 'BR01']
+
+
+def test_recalc_evaluates_every_cell_step6_reads(inputs, monkeypatch):
+    automation = ExcelAutomation(inputs)
+    wb = load_workbook(automation.porocanje_file, keep_vba=True)
+    wb["brizganje izračun"]["N50"] = "=FORECAST(1,L7:L8,M7:M8)"
+    wb.save(automation.porocanje_file)
+    fallback = []
+    monkeypatch.setattr(automation, 'recalc_excel', lambda: fallback.append(True))
+    automation.STEP6_ROWS = (7, None)
+
+    automation.recalc()
+    assert fallback == [] and automation.engine is not None
+
+    # A rule on column N reaches the unsupported formula below the default rows
+    automation.STEP6_RULES = [*ExcelAutomation.STEP6_RULES, {'name': 'trend', 'column': 'N', 'threshold': 1}]
+    automation.recalc()
+    assert fallback == [True] and automation.engine is None
+    automation.session.close()
@@ -0,0 +1,87 @@
+import zipfile
+
+from openpyxl import load_workbook
+
+from automate_process import ExcelAutomation
+
+
+def read_block(path, col, rows):
+    ws = load_workbook(path)["brizganje izračun"]
+    return [[ws.cell(row=4 + i, column=col + j).value for j in range(3)] for i in range(rows)]
+
+
+def test_step5_block_survives_step2_write(inputs):
+    automation = ExcelAutomation(inputs)
+    automation.step2_paste_to_porocanje(automation.step1_copy_pregled_data())
+    block = automation.step4_copy_plan_range(automation.step3_find_date_in_plan())
+    automation.step5_paste_to_brizganje(block)
+    saves = automation.session.saves
+    automation.session.flush()
+    automation.session.close()
+
+    # Steps 2 and 5 go into one rewrite of the package
+    assert automation.session.saves == saves + 1
+    _, _, paste_col, _, _ = automation.written_ranges[-1]
+    assert read_block(automation.porocanje_file, paste_col, len(block)) == [list(row) for row in block]
+
+
+def without_full_calc(path):
+    """Drop fullCalcOnLoad, as in a workbook last saved by Excel"""
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+    parts['xl/workbook.xml'] = parts['xl/workbook.xml'].replace(b' fullCalcOnLoad="1"', b'')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+
+def test_direct_xml_writes_flag_a_full_recalculation(inputs):
+    automation = ExcelAutomation(inputs)
+    without_full_calc(automation.porocanje_file)
+    block = automation.step4_copy_plan_range(automation.step3_find_date_in_plan())
+    automation.step5_paste_to_brizganje(block)
+    automation.session.flush()
+    automation.session.close()
+
+    with zipfile.ZipFile(automation.porocanje_file) as zf:
+        assert b'fullCalcOnLoad="1"' in zf.read('xl/workbook.xml')
+
+
+def run_steps_2_to_6(automation):
+    automation.step2_paste_to_porocanje(automation.step1_copy_pregled_data())
+    block = automation.step4_copy_plan_range(automation.step3_find_date_in_plan())
+    automation.step5_paste_to_brizganje(block)
+    automation.session.flush()
+    automation.recalc()
+    return automation.step6_analyze_brizganje()
+
+
+def test_a_run_parses_the_workbook_once_per_view(inputs):
+    automation = ExcelAutomation(inputs)
+    run_steps_2_to_6(automation)
+    automation.session.close()
+    # The formula and data_only views for the engine, nothing before the flush
+    assert automation.session.loads == 2
+    assert automation.session.saves == 1
+
+
+def test_views_loaded_before_the_flush_stay_valid(inputs):
+    automation = ExcelAutomation(inputs)
+    formulas = automation.session.get(automation.porocanje_file)
+    values = automation.session.get(automation.porocanje_file, data_only=True)
+    data_df = automation.step1_copy_pregled_data().iloc[:-5]
+    automation.step2_paste_to_porocanje(data_df)
+    block = automation.step4_copy_plan_range(automation.step3_find_date_in_plan())
+    automation.step5_paste_to_brizganje(block)
+    automation.session.flush()
+
+    assert automation.session.get(automation.porocanje_file) is formulas
+    assert automation.session.get(automation.porocanje_file, data_only=True) is values
+    assert automation.session.loads == 2
+    ws = values['prilepi gosoft']
+    assert ws.max_row == len(data_df) + 1
+    assert [c.value for c in ws[2]][:3] == data_df.iloc[0, :3].tolist()
+    _, _, paste_col, _, _ = automation.written_ranges[-1]
+    assert [[values["brizganje izračun"].cell(4 + i, paste_col + j).value for j in range(3)]
+            for i in range(len(block))] == [list(row) for row in block]
+    automation.session.close()
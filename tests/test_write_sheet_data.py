@@ -0,0 +1,85 @@
+import zipfile
+from datetime import datetime, time, timedelta
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+
+import automate_process
+from automate_process import _number_style, write_package, write_sheet_data
+
+
+def template(path, styled_date=False):
+    wb = Workbook()
+    wb.active.title = 'prilepi gosoft'
+    if styled_date:
+        # A bold date cell: its xf must not be reused for pasted dates
+        cell = wb.active['Z1']
+        cell.value, cell.number_format, cell.font = datetime(2025, 1, 1), 'mm-dd-yy', Font(bold=True)
+    wb.save(path)
+    return path
+
+
+def test_times_and_durations_are_written_as_numbers(tmp_path):
+    path = template(str(tmp_path / 'book.xlsx'))
+    data_df = pd.DataFrame({
+        'start': pd.Series([time(8, 30), time(22, 15, 30), None], dtype=object),
+        'span': pd.Series([timedelta(hours=2), None, timedelta(hours=26, minutes=30)], dtype=object),
+        'idle': pd.to_timedelta(['0:45:00', None, '3:00:00']),
+        'day': pd.to_datetime(['2025-03-04', '2025-03-05', None]),
+    })
+    write_sheet_data(path, {'prilepi gosoft': data_df})
+
+    ws = load_workbook(path)['prilepi gosoft']
+    rows = [[cell.value for cell in row] for row in ws.iter_rows(min_row=2, max_row=4)]
+    assert [row[0] for row in rows] == [time(8, 30), time(22, 15, 30), None]
+    assert [row[1] for row in rows] == [timedelta(hours=2), None, timedelta(hours=26, minutes=30)]
+    assert [row[2] for row in rows] == [timedelta(minutes=45), None, timedelta(hours=3)]
+    assert [row[3] for row in rows] == [datetime(2025, 3, 4), datetime(2025, 3, 5), None]
+
+
+def test_date_style_is_plain(tmp_path):
+    path = template(str(tmp_path / 'book.xlsx'), styled_date=True)
+    wb = load_workbook(path)
+    bold_xf = wb.active['Z1'].style_id
+    with zipfile.ZipFile(path) as zf:
+        styles_xml = zf.read('xl/styles.xml')
+    idx, new_xml = _number_style(styles_xml, 'date')
+    assert idx != bold_xf
+    assert _number_style(new_xml, 'date') == (idx, new_xml)
+
+
+@pytest.mark.parametrize('raw', [True, False])
+def test_sheets_and_cells_are_written_in_one_pass(tmp_path, monkeypatch, raw):
+    monkeypatch.setattr(automate_process, '_RAW_ZIP_COPY', raw)
+    path = str(tmp_path / 'book.xlsx')
+    wb = Workbook()
+    wb.active.title = 'prilepi gosoft'
+    other = wb.create_sheet('brizganje izračun')
+    other['A1'], other['B2'] = 'keep', '=A1'
+    wb.create_sheet('untouched')['C3'] = 42
+    wb.save(path)
+    with zipfile.ZipFile(path) as zf:
+        before = {name: zf.read(name) for name in zf.namelist()}
+
+    rendered, written = write_package(path, {'prilepi gosoft': pd.DataFrame({'qty': [1, 2]})},
+                                      {'brizganje izračun': {(4, 2): 7.5, (5, 2): datetime(2025, 3, 4)}})
+    assert rendered == {'prilepi gosoft': 2}
+    assert 'xl/worksheets/sheet3.xml' not in written
+
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        for name in ('xl/worksheets/sheet3.xml', 'docProps/app.xml', 'xl/theme/theme1.xml'):
+            assert zf.read(name) == before[name]
+    wb = load_workbook(path)
+    assert [c.value for c in wb['prilepi gosoft']['A']] == ['qty', 1, 2]
+    ws = wb['brizganje izračun']
+    assert (ws['A1'].value, ws['B2'].value, ws['B4'].value, ws['B5'].value) == ('keep', '=A1', 7.5, datetime(2025, 3, 4))
+    assert wb['untouched']['C3'].value == 42
+
+
+def test_a_sheet_is_not_both_rewritten_and_patched(tmp_path):
+    path = template(str(tmp_path / 'book.xlsx'))
+    with pytest.raises(ValueError):
+        write_package(path, {'prilepi gosoft': pd.DataFrame({'qty': [1]})}, {'prilepi gosoft': {(1, 1): 2}})